@@ -0,0 +1,335 @@
+"""
+Servizio HTTP JSON locale sul motore di calcolo (solo libreria standard, asyncio).
+
+Endpoint (corpo JSON = parametri con i nomi di genera_progetto_ev /
+genera_progetto_ev_multi):
+- POST /calc        -> risultato di genera_progetto_ev (JSON)
+- POST /calc_multi  -> risultato di genera_progetto_ev_multi (JSON)
+- POST /pdf         -> PDF del progetto (application/pdf); con "n_colonnine"
+                       nel corpo il progetto è calcolato come multi-colonnina
+- GET  /stato       -> richieste, coalescenze, rifiuti, lavori in corso
+- GET  /metrics     -> metriche_ev.REGISTRO in formato Prometheus (latenze per endpoint,
+                       errori per tipo, dimensione PDF, coalescenza come cache)
+- GET  /health
+
+Il front end asyncio accetta le connessioni e legge/scrive le richieste; il
+lavoro CPU-bound gira su un pool di processi. Richieste identiche (stesso
+endpoint e corpo canonicalizzato) in volo nello stesso momento sono coalescenti:
+attendono un solo calcolo e ne condividono la risposta. Se i lavori distinti
+in corso raggiungono max_in_volo la richiesta è respinta subito con 503 e
+Retry-After (contropressione) invece di accumularsi in coda.
+
+Errori: 400 corpo non valido, 404 endpoint, 422 errore del motore (ValueError,
+es. "Potenza e distanza devono essere > 0."), 503 pool saturo.
+
+Uso:
+    python api_ev.py serve --porta 8765 --processi 4
+    python api_ev.py carico --url http://127.0.0.1:8765 --richieste 500 --concorrenza 32
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from calcolo_ev import genera_progetto_ev, genera_progetto_ev_multi
+from coalescenza_ev import chiave_canonica
+from metriche_ev import REGISTRO
+from portafoglio_ev import calcola_sito
+
+MAX_CORPO = 2 * 1024 * 1024
+ENDPOINT_POST = ("/calc", "/calc_multi", "/pdf")
+_MOTIVI = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+
+def _json_bytes(v) -> bytes:
+    return json.dumps(v, ensure_ascii=False, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o)).encode("utf-8")
+
+
+# ---------------------------
+# Lavori eseguiti nei processi del pool (restituiscono byte già serializzati)
+# ---------------------------
+def _lavoro(percorso: str, parametri: dict) -> tuple[int, str, bytes, Exception | None]:
+    """(stato, content-type, corpo, errore di input del motore per le metriche)."""
+    try:
+        if percorso == "/calc":
+            return 200, "application/json", _json_bytes(genera_progetto_ev(**parametri)), None
+        if percorso == "/calc_multi":
+            return 200, "application/json", _json_bytes(genera_progetto_ev_multi(**parametri)), None
+        multi = int(parametri.get("n_colonnine", 1)) > 1
+        if not multi:
+            parametri = {k: v for k, v in parametri.items() if k != "n_colonnine"}
+        return 200, "application/pdf", calcola_sito(parametri, multi, pdf=True)["pdf"], None
+    except (ValueError, TypeError) as e:
+        return 422, "application/json", _json_bytes({"errore": f"{type(e).__name__}: {e}"}), e
+
+
+class ServizioApi:
+    """Front end asyncio + pool di processi, con coalescenza e contropressione."""
+
+    def __init__(self, n_processi: int | None = None, max_in_volo: int | None = None):
+        self.n_processi = int(n_processi or os.cpu_count() or 1)
+        self.max_in_volo = int(max_in_volo or 4 * self.n_processi)
+        self.pool = ProcessPoolExecutor(max_workers=self.n_processi)
+        self._in_volo: dict[str, asyncio.Future] = {}
+        self.contatori = {"richieste": 0, "coalescenti": 0, "rifiutate": 0, "errori": 0, "calcoli": 0}
+
+    def stato(self) -> dict:
+        return {**self.contatori, "in_volo": len(self._in_volo), "max_in_volo": self.max_in_volo,
+                "processi": self.n_processi}
+
+    async def esegui(self, percorso: str, corpo: dict) -> tuple[int, str, bytes, dict]:
+        """Risposta a una richiesta POST (stato, content-type, corpo, header extra)."""
+        chiave = chiave_canonica(percorso, corpo)
+        fase = "api" + percorso
+        fut = self._in_volo.get(chiave)
+        if fut is not None:
+            self.contatori["coalescenti"] += 1
+            REGISTRO.incrementa("ev_cache_total", cache="coalescenza_api", esito="hit")
+            return (*(await asyncio.shield(fut))[:3], {"X-Coalescente": "1"})
+        if len(self._in_volo) >= self.max_in_volo:
+            self.contatori["rifiutate"] += 1
+            REGISTRO.incrementa("ev_richieste_total", fase=fase, esito="rifiutata")
+            return 503, "application/json", _json_bytes({"errore": "pool saturo, riprovare"}), {"Retry-After": "1"}
+        REGISTRO.incrementa("ev_cache_total", cache="coalescenza_api", esito="miss")
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self.pool, _lavoro, percorso, corpo)
+        self._in_volo[chiave] = fut
+        self.contatori["calcoli"] += 1
+        t0 = time.perf_counter()
+        try:
+            stato, tipo, dati, errore = await asyncio.shield(fut)
+        except Exception as e:
+            REGISTRO.registra(fase, time.perf_counter() - t0, e)
+            raise
+        finally:
+            if self._in_volo.get(chiave) is fut:
+                del self._in_volo[chiave]
+        REGISTRO.registra(fase, time.perf_counter() - t0, errore)
+        if tipo == "application/pdf":
+            REGISTRO.osserva("ev_pdf_bytes", len(dati))
+        return stato, tipo, dati, {}
+
+    async def gestisci(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Connessione HTTP/1.1 (keep-alive): una richiesta alla volta."""
+        try:
+            while True:
+                riga = await reader.readline()
+                if not riga:
+                    break
+                try:
+                    metodo, url, _ = riga.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    await self._rispondi(writer, 400, "application/json", _json_bytes({"errore": "richiesta non valida"}), {}, False)
+                    break
+                header = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    header[k.strip().lower()] = v.strip()
+                try:
+                    lunghezza = int(header.get("content-length", 0) or 0)
+                    if lunghezza < 0:
+                        raise ValueError
+                except ValueError:
+                    await self._rispondi(writer, 400, "application/json",
+                                         _json_bytes({"errore": "Content-Length non valido"}), {}, False)
+                    break
+                mantieni = header.get("connection", "").lower() != "close"
+                if lunghezza > MAX_CORPO:
+                    await self._rispondi(writer, 413, "application/json", _json_bytes({"errore": "corpo troppo grande"}), {}, False)
+                    break
+                dati = await reader.readexactly(lunghezza) if lunghezza else b""
+                stato, tipo, corpo, extra = await self._instrada(metodo, urlsplit(url).path, dati)
+                await self._rispondi(writer, stato, tipo, corpo, extra, mantieni)
+                if not mantieni:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _instrada(self, metodo: str, percorso: str, dati: bytes):
+        self.contatori["richieste"] += 1
+        if metodo == "GET" and percorso == "/health":
+            return 200, "application/json", b'{"ok": true}', {}
+        if metodo == "GET" and percorso == "/stato":
+            return 200, "application/json", _json_bytes(self.stato()), {}
+        if metodo == "GET" and percorso == "/metrics":
+            return 200, "text/plain; version=0.0.4; charset=utf-8", REGISTRO.prometheus().encode("utf-8"), {}
+        if percorso not in ENDPOINT_POST:
+            return 404, "application/json", _json_bytes({"errore": f"endpoint sconosciuto: {percorso}"}), {}
+        if metodo != "POST":
+            return 405, "application/json", _json_bytes({"errore": "usare POST"}), {}
+        try:
+            corpo = json.loads(dati or b"{}")
+            if not isinstance(corpo, dict):
+                raise ValueError("il corpo deve essere un oggetto JSON")
+        except ValueError as e:
+            return 400, "application/json", _json_bytes({"errore": f"JSON non valido: {e}"}), {}
+        try:
+            risposta = await self.esegui(percorso, corpo)
+        except Exception as e:  # errore inatteso nel processo (non di input)
+            self.contatori["errori"] += 1
+            return 500, "application/json", _json_bytes({"errore": f"{type(e).__name__}: {e}"}), {}
+        if risposta[0] >= 400 and risposta[0] != 503:
+            self.contatori["errori"] += 1
+        return risposta
+
+    @staticmethod
+    async def _rispondi(writer, stato: int, tipo: str, corpo: bytes, extra: dict, mantieni: bool):
+        testa = [f"HTTP/1.1 {stato} {_MOTIVI.get(stato, '')}", f"Content-Type: {tipo}",
+                 f"Content-Length: {len(corpo)}", f"Connection: {'keep-alive' if mantieni else 'close'}"]
+        testa += [f"{k}: {v}" for k, v in extra.items()]
+        writer.write(("\r\n".join(testa) + "\r\n\r\n").encode("latin-1") + corpo)
+        await writer.drain()
+
+    async def avvia(self, host: str = "127.0.0.1", porta: int = 8765) -> asyncio.base_events.Server:
+        # i processi del pool nascono alla prima submit: avviati tutti prima di aprire il socket,
+        # altrimenti (fork) ereditano le connessioni client aperte e il client non riceve EOF
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, os.getpid) for _ in range(self.n_processi)))
+        return await asyncio.start_server(self.gestisci, host, porta, limit=MAX_CORPO)
+
+    def chiudi(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+# ==============================================================
+# GENERATORE DI CARICO
+# ==============================================================
+SCENARI_CARICO = (
+    ("/calc", dict(nome="Mario", cognome="Rossi", indirizzo="Via Garibaldi 1, Mantova", potenza_kw=22.0,
+                   distanza_m=35.0, alimentazione="Trifase 400 V", tipo_posa="A vista")),
+    ("/calc", dict(nome="Anna", cognome="Bianchi", indirizzo="Via Po 2", potenza_kw=7.4, distanza_m=20.0,
+                   alimentazione="Monofase 230 V", tipo_posa="Interrata", sistema="TN-S")),
+    ("/calc_multi", dict(nome="Luca", cognome="Verdi", indirizzo="Via Dante 3", n_colonnine=8,
+                         architettura="Dorsale unica + sottoquadro in prossimità", potenza_kw=11.0,
+                         distanza_dorsale_m=80.0, distanza_linea_m=12.0, alimentazione="Trifase 400 V",
+                         tipo_posa="Interrata")),
+    ("/pdf", dict(nome="Mario", cognome="Rossi", indirizzo="Via Garibaldi 1, Mantova", potenza_kw=22.0,
+                  distanza_m=35.0, alimentazione="Trifase 400 V", tipo_posa="A vista")),
+)
+
+
+async def _richiesta(host: str, porta: int, percorso: str, corpo: dict) -> tuple[int, float | None]:
+    """(stato HTTP, Retry-After in secondi se presente)."""
+    reader, writer = await asyncio.open_connection(host, porta)
+    dati = json.dumps(corpo).encode("utf-8")
+    writer.write(
+        f"POST {percorso} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(dati)}\r\nConnection: close\r\n\r\n".encode("latin-1") + dati
+    )
+    await writer.drain()
+    stato = int((await reader.readline()).split()[1])
+    riprova = None
+    while (h := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        k, _, v = h.decode("latin-1").partition(":")
+        if k.strip().lower() == "retry-after":
+            riprova = float(v.strip())
+    await reader.read()
+    writer.close()
+    return stato, riprova
+
+
+async def genera_carico(url: str, n_richieste: int = 200, concorrenza: int = 16, quota_uguali: float = 0.5,
+                        seme: int = 0, max_tentativi: int = 30) -> dict:
+    """
+    Invia n_richieste con concorrenza fissa: una quota_uguali ripete lo scenario
+    predefinito (coalescibile), le altre variano la distanza (calcoli distinti).
+    Una risposta 503 è ripetuta dopo Retry-After (fino a max_tentativi invii).
+
+    Restituisce conteggi per stato HTTP finale, numero di 503 ricevuti e, sulle sole
+    risposte 200, throughput e percentili di latenza (dal primo invio, attese comprese).
+    """
+    import random
+
+    rnd = random.Random(seme)
+    parti = urlsplit(url)
+    host, porta = parti.hostname or "127.0.0.1", parti.port or 80
+    coda: asyncio.Queue = asyncio.Queue()
+    for i in range(n_richieste):
+        percorso, corpo = SCENARI_CARICO[rnd.randrange(len(SCENARI_CARICO))]
+        if rnd.random() >= quota_uguali:
+            chiave = "distanza_linea_m" if percorso == "/calc_multi" else "distanza_m"
+            corpo = {**corpo, chiave: round(corpo[chiave] + rnd.uniform(1, 60), 1)}
+        coda.put_nowait((percorso, corpo))
+    latenze, stati = [], {}
+    rifiuti = 0
+
+    async def _utente():
+        nonlocal rifiuti
+        while not coda.empty():
+            percorso, corpo = coda.get_nowait()
+            t0 = time.perf_counter()
+            for _ in range(max_tentativi):
+                try:
+                    stato, riprova = await _richiesta(host, porta, percorso, corpo)
+                except OSError:
+                    stato, riprova = 0, None
+                if stato != 503:
+                    break
+                rifiuti += 1
+                await asyncio.sleep(riprova if riprova is not None else 1.0)
+            stati[stato] = stati.get(stato, 0) + 1
+            if stato == 200:
+                latenze.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_utente() for _ in range(concorrenza)))
+    durata = time.perf_counter() - t0
+    latenze.sort()
+
+    def _p(q):
+        return round(latenze[min(len(latenze) - 1, int(q * len(latenze)))] * 1000, 1) if latenze else None
+
+    return {"richieste": n_richieste, "durata_s": round(durata, 2), "ok_s": round(len(latenze) / durata, 1),
+            "p50_ms": _p(0.50), "p95_ms": _p(0.95), "p99_ms": _p(0.99), "stati_http": stati,
+            "rifiuti_503": rifiuti}
+
+
+async def _servi(host: str, porta: int, n_processi: int | None, max_in_volo: int | None):
+    servizio = ServizioApi(n_processi, max_in_volo)
+    server = await servizio.avvia(host, porta)
+    print(f"API EV in ascolto su http://{host}:{porta} ({servizio.n_processi} processi)", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        servizio.chiudi()
+
+
+def _main(argv=None):
+    ap = argparse.ArgumentParser(description="API HTTP JSON locale per il calcolo EV.")
+    sub = ap.add_subparsers(dest="comando", required=True)
+    s = sub.add_parser("serve")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--porta", type=int, default=8765)
+    s.add_argument("--processi", type=int, default=None)
+    s.add_argument("--max-in-volo", type=int, default=None)
+    c = sub.add_parser("carico")
+    c.add_argument("--url", default="http://127.0.0.1:8765")
+    c.add_argument("--richieste", type=int, default=200)
+    c.add_argument("--concorrenza", type=int, default=16)
+    c.add_argument("--quota-uguali", type=float, default=0.5)
+    args = ap.parse_args(argv)
+    if args.comando == "serve":
+        try:
+            asyncio.run(_servi(args.host, args.porta, args.processi, args.max_in_volo))
+        except KeyboardInterrupt:
+            pass
+    else:
+        esito = asyncio.run(genera_carico(args.url, args.richieste, args.concorrenza, args.quota_uguali))
+        print(json.dumps(esito, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    _main()
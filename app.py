@@ -2,15 +2,32 @@ import streamlit as st
 
 import os
 import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 sys.path.insert(0, os.path.dirname(__file__))  # ensure local imports work when run from project root
 
 try:
-    from calcolo_ev import genera_progetto_ev, genera_progetto_ev_multi, PORTATA_BASE
+    from calcolo_ev import genera_progetto_ev, genera_progetto_ev_multi
 except Exception:
     # fallback: older calcolo_ev without multi
-    from calcolo_ev import genera_progetto_ev, PORTATA_BASE
+    from calcolo_ev import genera_progetto_ev
     genera_progetto_ev_multi = None
-from documenti_ev import genera_pdf_unico_bytes
+from caduta_tensione_ev import candidati
+from calcolo_ev import MAX_COLONNINE, STADI_PROGETTO
+from catalogo_ev import CAVO_DEFAULT, posa_interrata, tipi_cavo, tipi_posa
+from coalescenza_ev import SingoloVolo, chiave_canonica
+from documenti_ev import GenerazioneAnnullata, annulla_pdf_background, avvia_pdf_background, genera_pdf_unico_bytes
+from metriche_ev import REGISTRO, accesso_admin, tasso_hit
+from montecarlo_ev import analisi_montecarlo, testo_montecarlo
+from portafoglio_ev import (
+    elabora_portafoglio,
+    leggi_portafoglio,
+    rapporto_errori,
+    rapporto_errori_csv,
+    valida_portafoglio,
+)
+from profilatore_ev import CatturaProfilo, profilo_da_ambiente
 
 # =========================
 # Config & Theme
@@ -40,6 +57,204 @@ hr { margin: 1.1rem 0; }
     unsafe_allow_html=True,
 )
 
+
+@st.cache_resource
+def _esecutore_pdf() -> ThreadPoolExecutor:
+    """Pool di generazione PDF condiviso da tutte le sessioni dell'app."""
+    return ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="pdf_ev")
+
+
+@st.cache_resource
+def _singolo_volo_calcolo() -> SingoloVolo:
+    """Calcoli identici concorrenti (tra sessioni) eseguiti una sola volta."""
+    return SingoloVolo()
+
+
+@st.cache_resource
+def _singolo_volo_pdf() -> SingoloVolo:
+    """PDF identici in generazione condivisi tra le sessioni."""
+    return SingoloVolo()
+
+
+@st.cache_resource
+def _metriche():
+    """
+    Registro metriche del processo, con i raccoglitori delle cache tenute altrove
+    (registrati una sola volta: la funzione è in cache_resource).
+    """
+    def _cache():
+        for nome, volo in (("coalescenza_calcolo", _singolo_volo_calcolo()), ("coalescenza_pdf", _singolo_volo_pdf())):
+            m = volo.metriche()
+            yield "ev_cache_total", {"cache": nome, "esito": "hit"}, m["coalescenti"]
+            yield "ev_cache_total", {"cache": nome, "esito": "miss"}, m["eseguite"]
+        info = candidati.cache_info()
+        yield "ev_cache_total", {"cache": "candidati_lru", "esito": "hit"}, info.hits
+        yield "ev_cache_total", {"cache": "candidati_lru", "esito": "miss"}, info.misses
+
+    REGISTRO.aggiungi_raccoglitore(_cache)
+    return REGISTRO
+
+
+def _esporta_metriche():
+    """Formato Prometheus su FILE_METRICHE (fuori da static/: non servito dall'app)."""
+    try:
+        _metriche().scrivi_prometheus(FILE_METRICHE)
+    except OSError:
+        pass  # cartella non scrivibile: metriche solo nella pagina
+
+
+PAGINA_PROGETTO = "Progetto"
+PAGINA_PORTAFOGLIO = "Portafoglio (caricamento massivo)"
+PAGINA_METRICHE = "Metriche (admin)"
+CARTELLA_ZIP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "portafoglio")
+FILE_METRICHE = os.environ.get(
+    "EV_METRICHE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "metriche", "metriche.prom")
+)
+
+
+@st.cache_resource
+def _pool_portafoglio() -> ProcessPoolExecutor:
+    """Pool di processi per il calcolo dei portafogli, condiviso da tutte le sessioni."""
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+
+
+def _pagina_portafoglio():
+    """Caricamento CSV/XLSX di molti siti, calcolo parallelo con tabella aggiornata e ZIP dei PDF."""
+    st.subheader("Portafoglio siti")
+    st.caption(
+        "Una riga per sito; colonne con i nomi dei parametri di calcolo (nome, cognome, indirizzo, potenza_kw, "
+        "distanza_m, alimentazione, tipo_posa, sistema, ...). Con n_colonnine > 1 servono architettura, "
+        "distanza_dorsale_m e distanza_linea_m. Colonna facoltativa: sito."
+    )
+    file = st.file_uploader("File portafoglio (CSV o XLSX)", type=["csv", "xlsx"])
+    if file is None:
+        return
+    try:
+        righe = leggi_portafoglio(file.name, file.getvalue())
+    except Exception as e:
+        st.error(f"Errore lettura file: {e}")
+        return
+    siti = valida_portafoglio(righe)
+    validi = [s for s in siti if not s["errori"]]
+    scartati = rapporto_errori(siti)
+    st.write(f"Righe lette: {len(siti)} — valide: {len(validi)} — scartate: {len(scartati)}")
+    if scartati:
+        st.warning("Righe scartate in validazione (non inviate al calcolo)")
+        st.dataframe(scartati, use_container_width=True)
+        st.download_button(
+            "⬇️ Rapporto errori (CSV)",
+            data=rapporto_errori_csv(siti),
+            file_name="portafoglio_errori.csv",
+            mime="text/csv",
+        )
+    con_pdf = st.checkbox("Genera PDF per sito (archivio ZIP)", value=True)
+    if not validi or not st.button("▶️ Elabora portafoglio", type="primary"):
+        _download_zip_portafoglio()
+        return
+
+    archivio = None
+    if con_pdf:
+        os.makedirs(CARTELLA_ZIP, exist_ok=True)
+        for vecchio in os.listdir(CARTELLA_ZIP):  # archivi di elaborazioni passate (> 1 giorno)
+            percorso = os.path.join(CARTELLA_ZIP, vecchio)
+            try:
+                if time.time() - os.path.getmtime(percorso) > 86400:
+                    os.remove(percorso)
+            except OSError:
+                pass  # già rimosso da un'altra sessione
+        archivio = os.path.join(CARTELLA_ZIP, f"portafoglio_{uuid.uuid4().hex}.zip")
+    st.session_state.zip_portafoglio = None
+
+    avanzamento = st.progress(0.0, text="Elaborazione in corso…")
+    tabella = st.empty()
+    esiti = []
+    ultimo = 0.0
+    n_proc = os.cpu_count() or 1
+    for esito in elabora_portafoglio(validi, _pool_portafoglio(), archivio, pdf=con_pdf, n_processi=n_proc):
+        esiti.append(esito)
+        if time.monotonic() - ultimo > 0.5 or len(esiti) == len(validi):
+            ultimo = time.monotonic()
+            avanzamento.progress(len(esiti) / len(validi), text=f"Siti elaborati: {len(esiti)}/{len(validi)}")
+            tabella.dataframe(esiti, use_container_width=True)
+    n_err = sum(e["stato"] == "errore" for e in esiti)
+    (st.warning if n_err else st.success)(f"Portafoglio elaborato: {len(esiti) - n_err} siti OK, {n_err} con errori.")
+    st.session_state.zip_portafoglio = archivio
+    _download_zip_portafoglio()
+
+
+def _pagina_metriche():
+    """Contatori, istogrammi di latenza e dimensione PDF, tassi di hit delle cache; esportazione Prometheus."""
+    st.subheader("Metriche del processo")
+    ist = _metriche().istantanea()
+    contatori, istogrammi = ist["contatori"], ist["istogrammi"]
+    st.caption(f"Dall'avvio del processo ({time.strftime('%d/%m/%Y %H:%M', time.localtime(ist['avvio']))}).")
+
+    richieste = [
+        {**dict(et), "Richieste": int(v)} for (nome, et), v in sorted(contatori.items()) if nome == "ev_richieste_total"
+    ]
+    latenze = [
+        {"fase": dict(et).get("fase", ""), "n": h["n"],
+         "media [ms]": round(h["media"] * 1000, 1) if h["media"] is not None else None,
+         "p50 [ms]": round(h["p50"] * 1000, 1) if h["p50"] is not None else None,
+         "p95 [ms]": round(h["p95"] * 1000, 1) if h["p95"] is not None else None}
+        for (nome, et), h in sorted(istogrammi.items()) if nome == "ev_latenza_seconds"
+    ]
+    c1, c2 = st.columns(2)
+    with c1:
+        st.markdown("**Richieste per fase ed esito**")
+        st.dataframe(richieste or [{"—": "nessuna richiesta"}], use_container_width=True)
+    with c2:
+        st.markdown("**Latenza per fase**")
+        st.dataframe(latenze or [{"—": "nessuna misura"}], use_container_width=True)
+
+    errori = [
+        {**dict(et), "Errori": int(v)} for (nome, et), v in sorted(contatori.items(), key=lambda kv: -kv[1])
+        if nome == "ev_errori_total"
+    ]
+    st.markdown("**Errori per tipo e motivo**")
+    st.dataframe(errori or [{"—": "nessun errore"}], use_container_width=True)
+
+    st.markdown("**Cache (tasso di hit)**")
+    cache = sorted({dict(et)["cache"] for (nome, et) in contatori if nome == "ev_cache_total"})
+    colonne = st.columns(max(1, len(cache)))
+    for col, nome in zip(colonne, cache):
+        hit, miss, tasso = tasso_hit(contatori, nome)
+        col.metric(nome, "—" if tasso is None else f"{tasso * 100:.0f}%", f"{int(hit)} hit / {int(miss)} miss",
+                   delta_color="off")
+
+    pdf = istogrammi.get(("ev_pdf_bytes", ()))
+    if pdf and pdf["n"]:
+        st.markdown(f"**Dimensione PDF** (n = {pdf['n']}, media {pdf['media'] / 1024:.0f} kB)")
+        etichette = [f"≤ {b / 1000:g} kB" for b in pdf["bucket"]] + ["oltre"]
+        st.bar_chart({"PDF": dict(zip(etichette, pdf["conteggi"] + [pdf["n"] - sum(pdf["conteggi"])]))})
+
+    testo = _metriche().prometheus()
+    _esporta_metriche()
+    with st.expander("Formato Prometheus"):
+        st.caption(f"Scritto anche su {FILE_METRICHE} (variabile EV_METRICHE_FILE).")
+        st.code(testo, language="text")
+        st.download_button("⬇️ Scarica metriche (Prometheus)", data=testo, file_name="metriche.txt", mime="text/plain")
+
+
+def _download_zip_portafoglio():
+    """
+    Link all'archivio ZIP: con server.enableStaticServing il file è servito a blocchi dal
+    disco (mai caricato in memoria); altrimenti ripiego su download_button.
+    """
+    archivio = st.session_state.get("zip_portafoglio")
+    if not archivio or not os.path.exists(archivio):
+        return
+    nome = os.path.basename(archivio)
+    if st.get_option("server.enableStaticServing"):
+        st.markdown(
+            f'<a href="app/static/portafoglio/{nome}" download="portafoglio_pdf.zip">⬇️ Scarica ZIP dei PDF</a>',
+            unsafe_allow_html=True,
+        )
+    else:
+        with open(archivio, "rb") as f:
+            st.download_button("⬇️ Scarica ZIP dei PDF", data=f, file_name="portafoglio_pdf.zip", mime="application/zip")
+
+
 st.title(" Progettazione Ricarica Veicoli Elettrici (EV) – CEI 64-8 Sez. 7.22")
 st.caption("Calcolo, verifica sezione linea, protezioni e relazione tecnica – eV Field Service")
 
@@ -59,9 +274,39 @@ with st.sidebar:
         '<div class="small-muted">Suggerimento: passa col mouse sull’icona ℹ️ per i dettagli tecnici dei parametri.</div>',
         unsafe_allow_html=True,
     )
+    st.divider()
+    # pagina metriche solo per l'amministratore (EV_ADMIN=1 oppure ?admin=<EV_ADMIN_TOKEN>)
+    pagine = [PAGINA_PROGETTO, PAGINA_PORTAFOGLIO]
+    if accesso_admin(st.query_params.get("admin")):
+        pagine.append(PAGINA_METRICHE)
+    pagina = st.radio("Pagina", pagine)
+    with st.expander("Coalescenza richieste"):
+        for titolo, volo in (("Calcolo", _singolo_volo_calcolo()), ("PDF", _singolo_volo_pdf())):
+            m = volo.metriche()
+            st.caption(
+                f"{titolo}: {m['chiamate']} richieste, {m['eseguite']} eseguite, "
+                f"{m['coalescenti']} coalescenti, {m['in_volo']} in corso"
+            )
+    # Modalità debug (profilo di calcolo e PDF con cattura degli input): EV_PROFILO=1,
+    # oppure interruttore visibile solo aprendo l'app con ?debug=1.
+    debug_profilo = profilo_da_ambiente()
+    if not debug_profilo and st.query_params.get("debug") == "1":
+        debug_profilo = st.toggle(
+            "Profilo richiesta (debug)",
+            key="debug_profilo",
+            help="Il prossimo calcolo e il relativo PDF sono eseguiti sotto profilatore; "
+            "input, pstats, stack collassati e script di riproduzione sono salvati su disco.",
+        )
 
 st.divider()
 
+if pagina == PAGINA_PORTAFOGLIO:
+    _pagina_portafoglio()
+    st.stop()
+if pagina == PAGINA_METRICHE:
+    _pagina_metriche()
+    st.stop()
+
 # =========================
 # Input area (guided)
 # =========================
@@ -120,17 +365,29 @@ with i4:
 
 i5, i6 = st.columns(2)
 with i5:
+    tipo_cavo = st.selectbox(
+        "Tipo cavo",
+        tipi_cavo(),
+        index=tipi_cavo().index(CAVO_DEFAULT),
+        help="Cavo da catalogo (catalogo_cavi.json): portate, R/X, conducibilità e k per I²t.",
+    )
     tipo_posa = st.selectbox(
         "Tipo posa",
-        list(PORTATA_BASE.keys()),
+        tipi_posa(tipo_cavo),
         help="Metodo di posa (CEI 64-8 / tabelle portata). Determina Iz di base.",
     )
+    interrata = posa_interrata(tipo_posa)
 with i6:
     sistema = st.selectbox(
         "Sistema di distribuzione",
         ["TT", "TN-S", "TN-C-S"],
         help="TT: verifica tipica Ra·Id ≤ 50 V. TN: verifica Zs/impedenza anello e tempi di intervento.",
     )
+    curva_interruttore = st.selectbox(
+        "Curva magnetotermico",
+        ["C", "B", "D"],
+        help="Curva di intervento MCB (CEI EN 60898-1) per tempi di interruzione 4-41 e I²t 4-43; oltre 160 A scatolato.",
+    )
 
 
 # =========================
@@ -139,10 +396,12 @@ with i6:
 st.subheader("2b) Architettura multi-colonnina")
 a1, a2, a3 = st.columns(3)
 with a1:
-    n_colonnine = st.selectbox(
+    n_colonnine = st.number_input(
         "Numero colonnine",
-        [1, 2, 3, 4, 5],
-        index=0,
+        min_value=1,
+        max_value=MAX_COLONNINE,
+        value=1,
+        step=1,
         help="Se >1, il calcolo genera anche una dorsale e le linee dedicate per ciascuna colonnina.",
     )
 
@@ -172,6 +431,38 @@ if int(n_colonnine) > 1:
             key="distanza_dorsale_m",
         )
 
+    alimentazione_dorsale = None
+    if alimentazione == "Monofase 230 V":
+        alimentazione_dorsale = st.selectbox(
+            "Alimentazione dorsale",
+            ["Trifase 400 V", "Monofase 230 V"],
+            index=0,
+            help="Con dorsale trifase le colonnine monofase vengono ripartite su L1/L2/L3 (bilanciamento fasi) "
+                 "e la dorsale è dimensionata sulla fase più caricata.",
+        )
+
+    potenze_colonnine_kw = None
+    priorita_colonnine = None
+    with st.expander("Potenze e priorità per colonnina (opzionale)"):
+        st.caption(
+            "Potenza diversa per ciascuna colonnina (linee, dorsale e simulazione) e priorità (> 0) "
+            "che pesano la colonnina nel bilanciamento fasi (es. probabilità di utilizzo contemporaneo)."
+        )
+        per_colonnina = st.checkbox("Usa valori per singola colonnina", value=False)
+        if per_colonnina:
+            tabella = st.data_editor(
+                {
+                    "Colonnina": list(range(1, int(n_colonnine) + 1)),
+                    "Potenza [kW]": [float(potenza_kw)] * int(n_colonnine),
+                    "Priorità": [1.0] * int(n_colonnine),
+                },
+                disabled=["Colonnina"],
+                hide_index=True,
+                key=f"tabella_colonnine_{int(n_colonnine)}",
+            )
+            potenze_colonnine_kw = [float(x) for x in tabella["Potenza [kW]"]]
+            priorita_colonnine = [float(x) for x in tabella["Priorità"]]
+
     # Ri-usa il campo distanza_m come "distanza linea"
     if architettura == "Linee separate dal contatore":
         st.info("Per 'Linee separate dal contatore', il campo 'Distanza' sopra è: **contatore/quadro principale → singola colonnina**.")
@@ -180,6 +471,9 @@ if int(n_colonnine) > 1:
     distanza_linea_m = float(distanza_m)
 else:
     architettura = "Linea unica (1 colonnina)"
+    alimentazione_dorsale = None
+    potenze_colonnine_kw = None
+    priorita_colonnine = None
     distanza_dorsale_m = None
     distanza_linea_m = float(distanza_m)
 
@@ -217,6 +511,82 @@ with p4:
         help="Se presente, può ridurre la potenza simultanea richiesta e migliorare compatibilità con fornitura.",
     )
 
+profilo_carichi = None
+if int(n_colonnine) > 1:
+    with st.expander("Simulazione contemporaneità dorsale (opzionale)"):
+        st.caption(
+            "Simula un anno di sessioni di ricarica (passo 1 minuto) e usa la potenza risultante "
+            "come potenza di progetto della dorsale, invece di potenza × n. colonnine."
+        )
+        sim_enable = st.checkbox("Usa simulazione annuale per la dorsale", value=False)
+        s1, s2, s3 = st.columns(3)
+        with s1:
+            sim_politica = st.selectbox(
+                "Politica gestione carichi",
+                ["proporzionale", "limite", "round_robin"],
+                index=0,
+                disabled=not (sim_enable and gestione_carichi),
+                help="Usata solo con 'Gestione carichi' attiva. limite = FIFO; round_robin = rotazione a slot di 15 min.",
+            )
+        with s2:
+            sim_limite_kw = st.number_input(
+                "Limite potenza sito (kW)",
+                min_value=1.0,
+                max_value=5000.0,
+                value=float(potenza_kw),
+                step=1.0,
+                disabled=not (sim_enable and gestione_carichi),
+            )
+        with s3:
+            sim_sessioni = st.number_input(
+                "Sessioni/giorno per colonnina",
+                min_value=0.1,
+                max_value=10.0,
+                value=1.0,
+                step=0.1,
+                disabled=not sim_enable,
+            )
+        if sim_enable:
+            profilo_carichi = {
+                "politica": sim_politica,
+                "limite_kw": float(sim_limite_kw),
+                "sessioni_giorno": float(sim_sessioni),
+            }
+
+profilo_ciclico = None
+portata_ciclica_dorsale = False
+with st.expander("Portata ciclica cavi (opzionale)"):
+    st.caption(
+        "La ricarica è un carico ciclico: con un profilo giornaliero la portata Iz è corretta "
+        "dal fattore di portata ciclica kC (modello termico conduttore/terreno) invece della sola portata continua."
+    )
+    cic_enable = st.checkbox("Usa profilo giornaliero per le linee colonnina", value=False)
+    c1, c2 = st.columns(2)
+    with c1:
+        cic_inizio = st.number_input("Inizio ricarica (ora)", min_value=0, max_value=23, value=18, step=1, disabled=not cic_enable)
+    with c2:
+        cic_ore = st.number_input(
+            "Ore a piena potenza/giorno",
+            min_value=1,
+            max_value=24,
+            value=4,
+            step=1,
+            disabled=not cic_enable,
+            help="Durata della ricarica a potenza nominale; nelle altre ore la linea è a vuoto.",
+        )
+    if cic_enable:
+        profilo_ciclico = {
+            "carico": [1.0 if (h - int(cic_inizio)) % 24 < int(cic_ore) else 0.0 for h in range(24)],
+            "passo_min": 60,
+        }
+    if int(n_colonnine) > 1:
+        portata_ciclica_dorsale = st.checkbox(
+            "Dorsale: profilo dal giorno peggiore della simulazione annuale",
+            value=False,
+            disabled=profilo_carichi is None,
+            help="Richiede la simulazione contemporaneità dorsale.",
+        )
+
 st.subheader("4) CEI 64-8/7 Sez. 7.22 – Dati Caratteristici della Wallbox / Colonnina")
 e1, e2, e3, e4 = st.columns(4)
 with e1:
@@ -343,10 +713,35 @@ with v3:
         help="Abilita se il tempo è noto (da curva dispositivo o selettività).",
     )
 
+mc_enable = False
+incertezze_mc = {}
+if int(n_colonnine) == 1:
+    with st.expander("Analisi di rischio Monte Carlo (opzionale)"):
+        st.caption(
+            "Campiona gli input incerti (distribuzione uniforme ± tolleranza) e stima la probabilità "
+            "che la sezione scelta non rispetti Ib ≤ In ≤ Iz o ΔV ≤ 4%."
+        )
+        mc_enable = st.checkbox("Esegui analisi Monte Carlo", value=False)
+        mc1, mc2, mc3, mc4 = st.columns(4)
+        with mc1:
+            mc_tol_dist = st.number_input("± lunghezza cavo (%)", min_value=0.0, max_value=50.0, value=10.0, step=1.0, disabled=not mc_enable)
+            mc_tol_cosphi = st.number_input("± cosφ", min_value=0.0, max_value=0.15, value=0.03, step=0.01, disabled=not mc_enable)
+        with mc2:
+            mc_tol_temp = st.number_input("± temperatura (°C)", min_value=0.0, max_value=20.0, value=5.0, step=1.0, disabled=not mc_enable)
+            mc_tol_rho = st.number_input("± ρ terreno (K·m/W)", min_value=0.0, max_value=2.0, value=0.5, step=0.1, disabled=not mc_enable)
+        with mc3:
+            mc_campioni = st.number_input("Campioni", min_value=10_000, max_value=2_000_000, value=200_000, step=10_000, disabled=not mc_enable)
+        with mc4:
+            mc_confidenza = st.number_input("Confidenza richiesta (%)", min_value=50.0, max_value=99.9, value=95.0, step=0.5, disabled=not mc_enable)
+
 st.divider()
 
 if "res" not in st.session_state:
     st.session_state.res = None
+# Cache degli stadi di calcolo (calcolo_ev.STADI_PROGETTO): a ogni ricalcolo
+# sono rieseguiti solo gli stadi i cui input sono cambiati.
+if "cache_stadi" not in st.session_state:
+    st.session_state.cache_stadi = {"singola": {}, "multi": {}}
 
 # =========================
 # Action
@@ -364,8 +759,8 @@ with left:
     temp_terreno = 20  # °C (valore tipico)
     rho_terra = 2.5    # K·m/W (valore tipico terreno)
 
-    # Mostra i correttivi SOLO se è selezionata la posa Interrata
-    if tipo_posa == "Interrata":
+    # Mostra i correttivi SOLO se è selezionata una posa interrata
+    if interrata:
         with st.expander("Correttivi posa interrata (opzionali)"):
             st.caption("Usa questi campi solo se stai dimensionando una linea **interrata** e hai dati attendibili.")
             ctt1, ctt2 = st.columns(2)
@@ -403,17 +798,38 @@ with left:
 
 
 
+if mc_enable:
+    def _unif(nominale, tol):
+        return {"tipo": "uniforme", "min": nominale - tol, "max": nominale + tol}
+
+    incertezze_mc = {
+        "distanza_m": _unif(float(distanza_m), float(distanza_m) * float(mc_tol_dist) / 100.0),
+        "cosphi": {**_unif(float(cosphi), float(mc_tol_cosphi)), "max": min(1.0, float(cosphi) + float(mc_tol_cosphi))},
+    }
+    if interrata:
+        incertezze_mc["temp_terreno"] = _unif(float(temp_terreno if temp_terra_enable else 20), float(mc_tol_temp))
+        incertezze_mc["rho_terreno_km_w"] = _unif(float(rho_terra if rho_enable else 2.5), float(mc_tol_rho))
+    else:
+        incertezze_mc["temp_amb"] = _unif(float(temp_amb), float(mc_tol_temp))
+
 if calcola:
     if alimentazione == "Monofase 230 V" and potenza_kw > 7.4:
         st.error("Monofase: potenza > 7,4 kW non ammessa.")
         st.stop()
 
+    # In debug il calcolo gira sotto profilatore, senza cache degli stadi né coalescenza,
+    # così il profilo misura il lavoro completo; il PDF si aggiunge alla stessa cattura.
+    cattura = st.session_state.cattura_profilo = (
+        CatturaProfilo("multi" if int(n_colonnine) > 1 else "singola") if debug_profilo else None
+    )
+    st.session_state.profilo_salvato = None
+    t0_calcolo = time.perf_counter()
     try:
         if int(n_colonnine) > 1:
             if genera_progetto_ev_multi is None:
                 raise RuntimeError("Modulo multi-colonnina non disponibile (genera_progetto_ev_multi mancante).")
 
-            res = genera_progetto_ev_multi(
+            parametri_multi = dict(
                 nome=nome,
                 cognome=cognome,
                 indirizzo=indirizzo,
@@ -424,11 +840,13 @@ if calcola:
                 distanza_linea_m=float(distanza_linea_m),
                 alimentazione=alimentazione,
                 tipo_posa=tipo_posa,
+                tipo_cavo=tipo_cavo,
+                curva_interruttore=curva_interruttore,
                 sistema=sistema,
                 cosphi=cosphi,
                 temp_amb=int(temp_amb),
-                temp_terreno=(int(temp_terreno) if (tipo_posa == "Interrata" and temp_terra_enable) else None),
-                rho_terreno_km_w=(float(rho_terra) if (tipo_posa == "Interrata" and rho_enable) else None),
+                temp_terreno=(int(temp_terreno) if (interrata and temp_terra_enable) else None),
+                rho_terreno_km_w=(float(rho_terra) if (interrata and rho_enable) else None),
                 n_linee=int(n_linee),  # compat: non usato nel multi (derating gestito internamente)
                 icc_ka=float(icc_ka),
                 modo_ricarica=modo_ricarica,
@@ -445,9 +863,24 @@ if calcola:
                 ra_ohm=(float(ra_ohm) if ra_enable else None),
                 zs_ohm=(float(zs_ohm) if zs_enable else None),
                 t_intervento_s=(float(t_int) if t_enable else None),
+                profilo_carichi=profilo_carichi,
+                alimentazione_dorsale=alimentazione_dorsale,
+                portata_ciclica_dorsale=portata_ciclica_dorsale,
+                profilo_ciclico_linee=profilo_ciclico,
+                potenze_colonnine_kw=potenze_colonnine_kw,
+                priorita_colonnine=priorita_colonnine,
             )
+            if cattura is not None:
+                res = cattura.esegui("calcolo", genera_progetto_ev_multi, **parametri_multi)
+            else:
+                res = _singolo_volo_calcolo().esegui(
+                    chiave_canonica("multi", parametri_multi),
+                    genera_progetto_ev_multi,
+                    **parametri_multi,
+                    cache_stadi=st.session_state.cache_stadi["multi"],
+                )
         else:
-            res = genera_progetto_ev(
+            parametri_linea = dict(
                 nome=nome,
                 cognome=cognome,
                 indirizzo=indirizzo,
@@ -455,11 +888,13 @@ if calcola:
                 distanza_m=float(distanza_m),
                 alimentazione=alimentazione,
                 tipo_posa=tipo_posa,
+                tipo_cavo=tipo_cavo,
+                curva_interruttore=curva_interruttore,
                 sistema=sistema,
                 cosphi=cosphi,
                 temp_amb=int(temp_amb),
-                temp_terreno=(int(temp_terreno) if (tipo_posa == "Interrata" and temp_terra_enable) else None),
-                rho_terreno_km_w=(float(rho_terra) if (tipo_posa == "Interrata" and rho_enable) else None),
+                temp_terreno=(int(temp_terreno) if (interrata and temp_terra_enable) else None),
+                rho_terreno_km_w=(float(rho_terra) if (interrata and rho_enable) else None),
                 n_linee=int(n_linee),
                 icc_ka=float(icc_ka),
                 modo_ricarica=modo_ricarica,
@@ -476,13 +911,59 @@ if calcola:
                 ra_ohm=(float(ra_ohm) if ra_enable else None),
                 zs_ohm=(float(zs_ohm) if zs_enable else None),
                 t_intervento_s=(float(t_int) if t_enable else None),
+                profilo_ciclico=profilo_ciclico,
+            )
+            impostazioni_mc = (
+                dict(incertezze=incertezze_mc, n_campioni=int(mc_campioni), confidenza=float(mc_confidenza))
+                if mc_enable else None
+            )
+
+            def _calcolo_linea():
+                if cattura is not None:
+                    r = cattura.esegui("calcolo", genera_progetto_ev, **parametri_linea)
+                else:
+                    r = genera_progetto_ev(**parametri_linea, cache_stadi=st.session_state.cache_stadi["singola"])
+                if impostazioni_mc is not None:
+                    parametri_mc = dict(
+                        progetto=parametri_linea,
+                        incertezze=incertezze_mc,
+                        n_campioni=int(mc_campioni),
+                        confidenza=float(mc_confidenza) / 100.0,
+                    )
+                    r["montecarlo"] = (
+                        cattura.esegui("montecarlo", analisi_montecarlo, **parametri_mc)
+                        if cattura is not None else analisi_montecarlo(**parametri_mc)
+                    )
+                    r["relazione"] += "\n\n" + testo_montecarlo(r["montecarlo"])
+                return r
+
+            # Sessioni che premono "Calcola" con gli stessi input nello stesso momento
+            # attendono un unico calcolo (coalescenza) e ne ricevono una copia.
+            res = _calcolo_linea() if cattura is not None else _singolo_volo_calcolo().esegui(
+                chiave_canonica("singola", parametri_linea, impostazioni_mc), _calcolo_linea
             )
 
+        _metriche().registra("calcolo", time.perf_counter() - t0_calcolo)
+        # cache degli stadi: uno stadio non ricalcolato è un hit (multi: dorsale e ogni linea)
+        for r in [res, res.get("dorsale"), *res.get("linee", [])]:
+            if isinstance(r, dict) and "stadi_ricalcolati" in r:
+                n_ricalcolati = len(r["stadi_ricalcolati"])
+                _metriche().incrementa("ev_cache_total", len(STADI_PROGETTO) - n_ricalcolati, cache="stadi", esito="hit")
+                _metriche().incrementa("ev_cache_total", n_ricalcolati, cache="stadi", esito="miss")
+        _esporta_metriche()
         st.session_state.res = res
         st.success("Calcolo completato.")
+        st.caption(
+            "Stadi ricalcolati: " + (", ".join(res.get("stadi_ricalcolati", [])) or "nessuno (risultati in cache)")
+        )
     except Exception as e:
+        _metriche().registra("calcolo", time.perf_counter() - t0_calcolo, e)
+        _esporta_metriche()
         st.session_state.res = None
         st.error(f"Errore: {e}")
+        if cattura is not None:  # anche una richiesta fallita va riprodotta
+            st.session_state.cattura_profilo = None
+            st.info(f"Profilo della richiesta salvato in {cattura.salva()}.")
 
 res = st.session_state.res
 
@@ -502,28 +983,81 @@ if isinstance(res, dict) and res:
 
     # Extra output per modalità multi-colonnina
     is_multi = isinstance(res, dict) and res.get("multi", False)
+    def _sezione(r):
+        n = r.get("n_paralleli", 1)
+        return r.get("sezione_mm2", "—") if n == 1 else f"{n} × {r.get('sezione_mm2')}"
+
     if is_multi:
         st.markdown("**Tabella linee colonnine**")
         rows = []
         for rr in res.get("linee", []):
             rows.append({
                 "Colonnina": rr.get("colonnina_idx"),
+                "Fase": rr.get("fase", "—"),
                 "Ib [A]": rr.get("Ib_a"),
                 "In [A]": rr.get("In_a"),
                 "Iz [A]": rr.get("Iz_a"),
-                "Sezione [mm²]": rr.get("sezione_mm2"),
+                "Sezione [mm²]": _sezione(rr),
                 "PE [mm²]": rr.get("sezione_pe_mm2"),
                 "k_ragg": rr.get("k_ragg"),
             })
         st.dataframe(rows, use_container_width=True)
 
+        sim = res.get("simulazione_carichi")
+        if sim:
+            st.markdown("**Simulazione annuale contemporaneità**")
+            st.write({
+                "Politica": sim.get("politica"),
+                "Picco [kW]": sim.get("picco_kw"),
+                "P99,9 [kW]": sim.get("p999_kw"),
+                "Fattore contemporaneità": sim.get("fattore_contemporaneita"),
+                "Energia non servita [%]": sim.get("energia_non_servita_pct"),
+                "Potenza progetto dorsale [kW]": sim.get("potenza_progetto_kw"),
+            })
+
+        bil = res.get("bilanciamento_fasi")
+        if bil:
+            st.markdown("**Bilanciamento fasi**")
+            st.write({
+                **{f"I {f} [A]": v for f, v in bil["corrente_fase_a"].items()},
+                "I neutro [A]": bil.get("corrente_neutro_a"),
+                "Metodo": bil.get("metodo"),
+            })
+
+        cc_rete = res.get("cortocircuito_rete")
+        if cc_rete:
+            st.markdown("**Cortocircuito e anello di guasto (rete)**")
+            st.dataframe([
+                {
+                    "Tratto": c["nome"],
+                    "Icc max inizio [kA]": round(c["icc_max_inizio_a"] / 1000, 2),
+                    "Icc max fine [kA]": round(c["icc_max_fine_a"] / 1000, 2),
+                    "Icc min fine [kA]": round(c["icc_min_fine_a"] / 1000, 3),
+                    "Zs [Ω]": c["zs_fine_ohm"],
+                }
+                for c in cc_rete
+            ], use_container_width=True)
+
+        sel = res.get("selettivita")
+        if sel:
+            st.markdown("**Selettività dorsale → linee**")
+            n_lin = len(sel["linee"])
+            if sel["n_totale"] == n_lin:
+                st.success(f"Selettività totale su tutte le {n_lin} linee (In monte {sel['In_monte_a']:.0f} A, curva {sel['curva_monte']}).")
+            else:
+                st.warning(f"Selettività parziale su {n_lin - sel['n_totale']} linee su {n_lin}.")
+                st.dataframe([
+                    {"Colonnina": l["colonnina_idx"], "Is [A]": l["limite_a"]}
+                    for l in sel["linee"] if not l["totale"]
+                ], use_container_width=True)
+
         st.markdown("**Dorsale (quadro → sottoquadro EV)**")
         d = res.get("dorsale", {})
         st.write({
             "Ib [A]": d.get("Ib_a"),
             "In [A]": d.get("In_a"),
             "Iz [A]": d.get("Iz_a"),
-            "Sezione [mm²]": d.get("sezione_mm2"),
+            "Sezione [mm²]": _sezione(d),
             "PE [mm²]": d.get("sezione_pe_mm2"),
         })
 
@@ -533,10 +1067,19 @@ if isinstance(res, dict) and res:
     m1.metric("Ib [A]", res.get("Ib_a", "—"))
     m2.metric("In [A]", res.get("In_a", "—"))
     m3.metric("Iz [A]", res.get("Iz_a", "—"))
-    m4.metric("Sezione [mm²]", res.get("sezione_mm2", "—"))
+    m4.metric("Sezione [mm²]", _sezione(res))
     m5.metric("ΔV [%]", res.get("dv_percent", res.get("deltaV_percent", "—")))
     m6.metric("Esito", "OK" if (not res.get("nonconf_722")) else "ATTENZIONE")
 
+    if res.get("montecarlo"):
+        mc = res["montecarlo"]
+        st.markdown("**Analisi di rischio Monte Carlo**")
+        st.text(testo_montecarlo(mc))
+        st.bar_chart(
+            {"P(non conforme) [%]": {str(S): p * 100 for S, p in mc["prob_non_conforme_per_sezione"].items()}},
+            x_label="Sezione [mm²]",
+        )
+
     st.divider()
 
     t1, t2, t3 = st.tabs(["📄 Relazione", "✅ Checklist CEI 64.8 7.22", "🧪 Verifiche 4-41"])
@@ -588,40 +1131,92 @@ if isinstance(res, dict) and res:
 
     st.divider()
 
-    # Compatibilità: alcune versioni di documenti_ev.py potrebbero non avere
-    # i parametri aggiuntivi per i "DATI GENERALI" (Streamlit Cloud può cacheare).
-    # Proviamo prima con i campi estesi; se la firma non li supporta, ripieghiamo.
-    try:
-        pdf_bytes = genera_pdf_unico_bytes(
-            relazione=res["relazione"],
-            unifilare=res["unifilare"],
-            planimetria=res["planimetria"],
-            ok_722=res["ok_722"],
-            warning_722=res["warning_722"],
-            nonconf_722=res["nonconf_722"],
-            # Dati generali intestazione PDF
-            committente=f"{nome} {cognome}".strip(),
-            ubicazione=indirizzo,
-            sistema_distribuzione=sistema,
-            alimentazione_evse=alimentazione,
-            modo_ricarica=modo_ricarica,
-            punto_connessione=tipo_punto,
-            installazione_esterna=esterno,
-            altezza_punto_connessione_m=altezza_presa_m,
+    # PDF generato in background sul pool condiviso tra le sessioni: la pagina resta
+    # reattiva, un frammento aggiorna l'avanzamento e abilita il download a fine lavoro.
+    # Se gli input cambiano, il lavoro precedente (superato) viene annullato.
+    parametri_pdf = dict(
+        relazione=res["relazione"],
+        unifilare=res["unifilare"],
+        planimetria=res["planimetria"],
+        ok_722=res["ok_722"],
+        warning_722=res["warning_722"],
+        nonconf_722=res["nonconf_722"],
+        # Dati generali intestazione PDF
+        committente=f"{nome} {cognome}".strip(),
+        ubicazione=indirizzo,
+        sistema_distribuzione=sistema,
+        alimentazione_evse=alimentazione,
+        modo_ricarica=modo_ricarica,
+        punto_connessione=tipo_punto,
+        installazione_esterna=esterno,
+        altezza_punto_connessione_m=altezza_presa_m,
+    )
+    chiave_pdf = chiave_canonica(parametri_pdf)
+
+    def _avvia_pdf_misurato(chiave, parametri):
+        lavoro = avvia_pdf_background(_esecutore_pdf(), chiave=chiave, **parametri)
+        _metriche().misura_futuro(lavoro["future"], "pdf", annullamento=(GenerazioneAnnullata,))
+        return lavoro
+
+    cattura = st.session_state.get("cattura_profilo")
+    if cattura is not None:
+        # debug: PDF della stessa richiesta sotto profilatore, poi cattura salvata su disco
+        st.session_state.cattura_profilo = None
+        cattura.esegui("pdf", genera_pdf_unico_bytes, **parametri_pdf)
+        cattura.salva()
+        st.session_state.profilo_salvato = (cattura.cartella, cattura.archivio_zip())
+    if st.session_state.get("profilo_salvato"):
+        cartella_profilo, zip_profilo = st.session_state.profilo_salvato
+        st.info(f"Profilo della richiesta salvato in {cartella_profilo} (riproduzione: python riproduci.py).")
+        st.download_button(
+            "⬇️ Scarica profilo (pstats, stack collassati, input, script di riproduzione)",
+            data=zip_profilo,
+            file_name=os.path.basename(cartella_profilo) + ".zip",
+            mime="application/zip",
         )
-    except TypeError:
-        pdf_bytes = genera_pdf_unico_bytes(
-            relazione=res["relazione"],
-            unifilare=res["unifilare"],
-            planimetria=res["planimetria"],
-            ok_722=res["ok_722"],
-            warning_722=res["warning_722"],
-            nonconf_722=res["nonconf_722"],
+    lavoro_pdf = st.session_state.get("lavoro_pdf")
+    if lavoro_pdf is None or lavoro_pdf["chiave"] != chiave_pdf:
+        # Un PDF identico già in generazione per un'altra sessione è condiviso; il lavoro
+        # superato è annullato solo se nessun'altra sessione lo sta ancora attendendo.
+        if lavoro_pdf is not None:
+            _singolo_volo_pdf().rilascia(lavoro_pdf)
+        lavoro_pdf = _singolo_volo_pdf().condividi(
+            chiave_pdf,
+            lambda: _avvia_pdf_misurato(chiave_pdf, parametri_pdf),
+            annulla_pdf_background,
         )
+        st.session_state.lavoro_pdf = lavoro_pdf
 
-    st.download_button(
-        label="⬇️ Scarica PDF completo (Relazione + Unifilare + Planimetria + Checklist 722)",
-        data=pdf_bytes,
-        file_name="Progetto_EV_CEI64-8_722.pdf",
-        mime="application/pdf",
-    )
+    etichetta_pdf = "⬇️ Scarica PDF completo (Relazione + Unifilare + Planimetria + Checklist 722)"
+
+    def _download_pdf():
+        lavoro = st.session_state.get("lavoro_pdf")
+        if lavoro is None:
+            return
+        fut = lavoro["future"]
+        if not fut.done():
+            st.progress(lavoro["progresso"], text=f"Generazione PDF in corso… {lavoro['progresso'] * 100:.0f}%")
+            st.download_button(label=etichetta_pdf, data=b"", disabled=True)
+            return
+        if fut.cancelled() or isinstance(fut.exception(), GenerazioneAnnullata):
+            return
+        if fut.exception() is not None:
+            st.error(f"Errore generazione PDF: {fut.exception()}")
+            return
+        st.download_button(
+            label=etichetta_pdf,
+            data=fut.result(),
+            file_name="Progetto_EV_CEI64-8_722.pdf",
+            mime="application/pdf",
+        )
+
+    if lavoro_pdf["future"].done():
+        _download_pdf()
+    else:
+        @st.fragment(run_every=0.5)
+        def _attesa_pdf():
+            if st.session_state.lavoro_pdf["future"].done():
+                st.rerun()  # rerun completo: il download compare senza più polling
+            _download_pdf()
+
+        _attesa_pdf()
@@ -0,0 +1,107 @@
+"""
+Caduta di tensione con R e X del catalogo cavi, valutata per tutte le sezioni
+candidate in un solo passaggio vettoriale.
+
+    ΔV = k · L · Ib · (R_θ·cosφ + X·sinφ)      k = √3 (trifase), 2 (monofase)
+
+con R_θ = R20·(1 + α·(θ − 20)) alla temperatura di esercizio del conduttore,
+stimata dal carico: θ = T_rif + (θ_max − T_rif)·(Ib/Iz)² (θ_max = 90 °C XLPE).
+
+Il nucleo (caduta_tensione_vett) lavora su array di candidati (sezione ×
+conduttori in parallelo) e, opzionalmente, su lotti di campioni (Monte Carlo):
+il risultato ha forma (n_candidati, *forma_lotto). La scelta della sezione è
+una maschera (ΔV ≤ limite e In ≤ Iz) seguita da argmin sull'ordine dei
+candidati.
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from types import MappingProxyType
+
+import numpy as np
+
+from catalogo_ev import fattore_paralleli, n_paralleli_ammessi, tabella
+
+LIMITE_DV_PERCENTO = 4.0
+TEMP_MAX_ESERCIZIO = 90.0  # °C, isolamento XLPE/EPR
+
+
+@lru_cache(maxsize=64)
+def candidati(tipo_cavo: str, tipo_posa: str, n_paralleli_max: int = 1) -> dict:
+    """
+    Candidati in ordine di preferenza (prima meno conduttori in parallelo, poi
+    sezione crescente): sezione, n, Iz_base totale, R20 e X equivalenti [Ω/km].
+    """
+    t = tabella(tipo_cavo, tipo_posa)
+    sez, n_par, iz, r20, x = [], [], [], [], []
+    for n in n_paralleli_ammessi():
+        if n > n_paralleli_max:
+            break
+        kp = fattore_paralleli(n)
+        for S, i, r, xx in zip(t["sezioni"], t["iz"], t["r20_ohm_km"], t["x_ohm_km"]):
+            sez.append(S)
+            n_par.append(n)
+            iz.append(i * n * kp)
+            r20.append(r / n)
+            x.append(xx / n)
+    arr = {
+        "sezione": np.array(sez),
+        "n_paralleli": np.array(n_par),
+        "iz_base": np.array(iz, dtype=float),
+        "r20_ohm_km": np.array(r20, dtype=float),
+        "x_ohm_km": np.array(x, dtype=float),
+    }
+    for v in arr.values():
+        v.setflags(write=False)
+    return MappingProxyType(arr)  # condiviso tra le chiamate (lru_cache): in sola lettura
+
+
+def caduta_tensione_vett(
+    r20_ohm_km,
+    x_ohm_km,
+    iz_a,
+    ib_a,
+    lunghezza_m,
+    cosphi,
+    trifase: bool,
+    tensione_v: float,
+    alfa_r: float,
+    temp_rif_c=30.0,
+    temp_max_c: float = TEMP_MAX_ESERCIZIO,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    ΔV% e temperatura del conduttore per ogni candidato.
+
+    r20_ohm_km, x_ohm_km, iz_a: array (n_candidati,) (iz_a = portata corretta);
+    ib_a, lunghezza_m, cosphi, temp_rif_c: scalari o array con la stessa forma di
+    lotto (es. (n_campioni,)); iz_a può avere forma (n_candidati, *lotto).
+    Restituisce (dv_percento, theta_c) di forma (n_candidati, *lotto).
+    """
+    ib = np.asarray(ib_a, dtype=float)
+    lotto = np.broadcast_shapes(ib.shape, np.shape(lunghezza_m), np.shape(cosphi), np.shape(temp_rif_c))
+    espandi = (slice(None),) + (None,) * len(lotto)
+    r20 = np.asarray(r20_ohm_km, dtype=float)[espandi]
+    x = np.asarray(x_ohm_km, dtype=float)[espandi]
+    iz = np.asarray(iz_a, dtype=float)
+    if iz.ndim == 1:
+        iz = iz[espandi]
+    cos = np.clip(np.asarray(cosphi, dtype=float), 0.0, 1.0)
+    sin = np.sqrt(1.0 - cos ** 2)
+    t_rif = np.asarray(temp_rif_c, dtype=float)
+
+    theta = np.minimum(t_rif + (temp_max_c - t_rif) * (ib / iz) ** 2, temp_max_c)
+    r_theta = r20 * (1.0 + alfa_r * (theta - 20.0))
+    k = np.sqrt(3.0) if trifase else 2.0
+    dv = k * (np.asarray(lunghezza_m, dtype=float) / 1000.0) * ib * (r_theta * cos + x * sin)
+    return 100.0 * dv / float(tensione_v), theta
+
+
+def indice_scelta(ammessi: np.ndarray) -> np.ndarray | int | None:
+    """Primo candidato ammesso lungo l'asse 0 (maschera + argmin sull'ordine); None/-1 se nessuno."""
+    ordine = np.arange(ammessi.shape[0], dtype=float).reshape((-1,) + (1,) * (ammessi.ndim - 1))
+    pos = np.where(ammessi, ordine, np.inf)
+    idx = np.argmin(pos, axis=0)
+    valido = np.isfinite(np.min(pos, axis=0))
+    if ammessi.ndim == 1:
+        return int(idx) if valido else None
+    return np.where(valido, idx, -1)
@@ -1,34 +1,80 @@
 import math
+from bisect import bisect_left
 from textwrap import dedent
+from types import MappingProxyType
+
+import numpy as np
+
+from caduta_tensione_ev import LIMITE_DV_PERCENTO, TEMP_MAX_ESERCIZIO, candidati, caduta_tensione_vett, indice_scelta
+from catalogo_ev import (
+    CAVO_DEFAULT,
+    catalogo,
+    dati_cavo,
+    portata_base,
+    posa_interrata,
+    seleziona_interruttore,
+    tabella,
+    tipi_posa,
+)
+from cortocircuito_ev import (
+    alfa_cavo,
+    cortocircuito_rete,
+    impedenza_tratto,
+    testo_cortocircuito,
+    verifica_linea,
+)
+from curve_intervento_ev import tempo_intervento
+from termico_ev import costanti_tempo, fattore_ciclico, profilo_da_serie, testo_portata_ciclica
+from fasi_ev import bilancia_fasi, testo_fasi
+from selettivita_ev import analisi_selettivita, testo_selettivita
+from simulazione_carichi_ev import simula_anno, testo_simulazione
 
 BULLET_JOIN = "\n- "
 
 # =========================
 # TABELLE (SEMPLIFICATE)
 # =========================
+# Sezioni, interruttori e portate provengono dal catalogo (catalogo_cavi.json).
+# Le costanti sotto restano per compatibilità e si riferiscono al cavo di default.
+# Tutte le tabelle di modulo sono immutabili (tuple / MappingProxyType): il motore non
+# ha stato globale modificabile e può essere chiamato da più thread contemporaneamente
+# (ogni chiamante usa la propria cache_stadi).
 
-SEZIONI = [6, 10, 16, 25, 35, 50, 70, 95]
-INTERRUTTORI = [16, 20, 25, 32, 40, 50, 63, 80, 100, 125, 160]
+SEZIONI = tuple(tabella(CAVO_DEFAULT, "A vista")["sezioni"])
+INTERRUTTORI = tuple(catalogo()["interruttori"])
 
-# Portate base Iz per FG16(O)R16 in condizioni standard (semplificate)
-PORTATA_BASE = {
-    "Interrata": {6: 34, 10: 46, 16: 61, 25: 80, 35: 99, 50: 119, 70: 151, 95: 182},
-    "A vista":   {6: 41, 10: 57, 16: 76, 25: 101, 35: 125, 50: 150, 70: 192, 95: 232},
-}
+# Portate base Iz per FG16(O)R16 in condizioni standard (semplificate), per ogni posa a catalogo
+PORTATA_BASE = MappingProxyType(
+    {posa: MappingProxyType(portata_base(CAVO_DEFAULT, posa)) for posa in tipi_posa(CAVO_DEFAULT)}
+)
 
 # Fattori correttivi (semplificati)
-FATT_TEMP_ARIA = {30: 1.00, 35: 0.94, 40: 0.87, 45: 0.79, 50: 0.71}
+FATT_TEMP_ARIA = MappingProxyType({30: 1.00, 35: 0.94, 40: 0.87, 45: 0.79, 50: 0.71})
 # Per posa interrata la condizione di riferimento tipica nelle tabelle IEC/CEI è T_terreno=20°C.
 # Valori qui sotto: semplificazione prudente ma non eccessiva (da usare con consapevolezza).
-FATT_TEMP_TERRA = {20: 1.00, 25: 0.96, 30: 0.92, 35: 0.88, 40: 0.84}
+FATT_TEMP_TERRA = MappingProxyType({20: 1.00, 25: 0.96, 30: 0.92, 35: 0.88, 40: 0.84})
 
 # Fattore per resistività termica del terreno ρ [K·m/W] (riferimento tipico 2.5).
 # Se ρ aumenta (terreno più "isolante"), la portata si riduce.
-FATT_RHO_TERRA = {2.5: 1.00, 3.0: 0.96, 4.0: 0.90, 5.0: 0.86}
-FATT_RAGGR = {1: 1.00, 2: 0.80, 3: 0.70}
+FATT_RHO_TERRA = MappingProxyType({2.5: 1.00, 3.0: 0.96, 4.0: 0.90, 5.0: 0.86})
+# Fattore di raggruppamento per numero di circuiti (CEI-UNEL 35024/1, IEC 60364-5-52 B.52.17);
+# per numeri intermedi vale la colonna successiva, oltre l'ultima vale l'ultimo fattore.
+FATT_RAGGR = MappingProxyType({
+    1: 1.00, 2: 0.80, 3: 0.70, 4: 0.65, 5: 0.60, 6: 0.57, 7: 0.54, 8: 0.52, 9: 0.50,
+    12: 0.45, 16: 0.41, 20: 0.38,
+})
+_N_RAGGR = tuple(FATT_RAGGR)
 
 # Coefficiente k per verifica termica I²t (rame, XLPE/EPR ~ 90°C) - valore tipico
-K_CU_XLPE = 143  # A·sqrt(s)/mm² (valore tipico usato in pratica)
+K_CU_XLPE = 143  # A·sqrt(s)/mm² (valore tipico usato in pratica; per tipo cavo vedi catalogo "k_i2t")
+
+# Limiti sugli input (condivisi con la validazione a colonne di portafoglio_ev)
+IDN_AMMESSE_MA = (30, 100, 300)
+POTENZA_MAX_MONOFASE_KW = 7.4
+
+# Tensioni nominali di calcolo [V] (Ib, ΔV, correnti di fase del bilanciamento)
+TENSIONE_TRIFASE_V = 400
+TENSIONE_MONOFASE_V = 220
 
 
 def _interp_dict(x: float, tab: dict) -> float:
@@ -50,13 +96,13 @@ def _fattore_temp(tipo_posa: str, temp_aria: int, temp_terreno: int | None) -> t
     """
     Restituisce (k_temp, T_usata).
 
-    - "A vista": tabella aria (riferimento 30°C).
-    - "Interrata": tabella terreno (riferimento 20°C). Se non specifichi temp_terreno,
+    - Pose in aria ("A vista", ...): tabella aria (riferimento 30°C).
+    - Pose interrate ("Interrata", ...): tabella terreno (riferimento 20°C). Se non specifichi temp_terreno,
       NON viene applicata automaticamente la temperatura aria al cavo interrato.
 
     Nota: fattori semplificati. Per casi critici usare tabelle CEI/IEC complete.
     """
-    if tipo_posa == "Interrata":
+    if posa_interrata(tipo_posa):
         T = 20 if temp_terreno is None else int(temp_terreno)
         return (_interp_dict(float(T), FATT_TEMP_TERRA), T)
     T = int(temp_aria)
@@ -64,9 +110,8 @@ def _fattore_temp(tipo_posa: str, temp_aria: int, temp_terreno: int | None) -> t
 
 
 def _fattore_raggr(n_linee: int) -> float:
-    if n_linee in FATT_RAGGR:
-        return FATT_RAGGR[n_linee]
-    return 0.70
+    i = bisect_left(_N_RAGGR, max(1, int(n_linee)))
+    return FATT_RAGGR[_N_RAGGR[min(i, len(_N_RAGGR) - 1)]]
 
 
 def _pe_da_fase(sez_fase_mm2: int) -> int:
@@ -117,127 +162,264 @@ def genera_progetto_ev(
     # verifiche 4-41 / campo
     ra_ohm: float | None = None,         # resistenza di terra (TT) se disponibile
     ul_v: float = 50.0,                  # tensione limite ordinaria
-    zs_ohm: float | None = None,         # impedenza anello guasto (TN) se disponibile
+    zs_ohm: float | None = None,         # impedenza anello guasto (TN) all'origine linea, se misurata
     # verifica termica I²t (facoltativa)
-    t_intervento_s: float | None = None  # tempo intervento protezione (s) se disponibile
+    t_intervento_s: float | None = None,  # tempo intervento protezione (s) se disponibile
+    # catalogo cavi
+    tipo_cavo: str = CAVO_DEFAULT,
+    n_paralleli_max: int = 4,            # conduttori in parallelo ammessi se un solo cavo non basta
+    # rete a monte (es. fine dorsale): sostituisce icc_ka/zs_ohm per il calcolo di Icc e Zs
+    impedenze_monte: dict | None = None,
+    # protezione (curve_intervento_ev): curva MCB fino a 160 A, oltre scatolato
+    curva_interruttore: str = "C",
+    circuito_terminale: bool = True,     # False per dorsali (tempi di interruzione di distribuzione)
+    # portata ciclica (termico_ev): {"carico": [frazioni di Ib per passo, un periodo], "passo_min": 60}
+    profilo_ciclico: dict | None = None,
+    # ricalcolo incrementale: dict persistente tra chiamate (uscite degli stadi, vedi STADI_PROGETTO)
+    cache_stadi: dict | None = None,
 ):
     """
     Pre-dimensionamento + relazione tecnica con:
-    - Ib, In, sezione per ΔV ≤ 4%, verifica Ib ≤ In ≤ Iz
+    - Ib, In, sezione per ΔV ≤ 4% (R a temperatura di esercizio + X, caduta_tensione_ev), verifica Ib ≤ In ≤ Iz
+    - con profilo_ciclico: Iz corretta dal fattore di portata ciclica kC (termico_ev)
+      al posto della sola portata continua
     - PE (5-54) in modo semplificato
+    - Icc max/min e Zs a fine linea (cortocircuito_ev) da Icc presunta o impedenze a monte
     - verifica contatti indiretti:
       * TT: Ra·IΔn ≤ UL (se Ra fornita)
-      * TN: nota/verifica con Zs/tempi (se dati non forniti)
-    - verifica termica corto (I²t) se Icc e t sono forniti
+      * TN: Zs·Ia ≤ U0 con Zs calcolata (o misurata all'origine)
+    - verifica cortocircuito 4-43: I²t con Icc max inizio linea (se t fornito),
+      intervento magnetico con Icc min fine linea
     - checklist 722 coerente
     - note obbligatorie per prove in campo dove necessario
     """
 
-    # ---------------------------
-    # CONTROLLI INPUT
-    # ---------------------------
-    if potenza_kw <= 0 or distanza_m <= 0:
+    p = dict(locals())
+    cache = p.pop("cache_stadi")
+    _controlla_input(p)
+    s, ricalcolati = _esegui_stadi(p, {} if cache is None else cache)
+    c, prot, sez, pe, i2t = s["corrente"], s["protezione"], s["sezione"], s["pe"], s["i2t"]
+    cc, verifiche = i2t["cc"], i2t["verifiche"]
+    e441, e722 = s["441"], s["722"]
+    # copie: le uscite degli stadi restano in cache e non devono essere modificate dal chiamante
+    return {
+        # numeri
+        "tensione_v": c["tensione"],
+        "Ib_a": round(c["Ib"], 2),
+        "In_a": prot["In"],
+        "Iz_a": round(sez["Iz_corr"], 1),
+        "sezione_mm2": sez["sezione"],
+        "n_paralleli": sez["n_paralleli"],
+        "tipo_cavo": tipo_cavo,
+        "tipo_posa": tipo_posa,
+        "distanza_m": distanza_m,
+        "sezione_pe_mm2": pe["sezione_pe"],
+        "S_cad_min_mm2": round(sez["S_cad"], 2),
+        "dv_percent": round(sez["dv_percento"], 2),
+        "temp_conduttore_c": round(sez["theta_c"], 1),
+        "fattore_ciclico": round(sez["k_cicl_sel"], 3),
+        "temp_picco_ciclo_c": (round(sez["theta_ciclo"], 1) if sez["theta_ciclo"] is not None else None),
+        "k_temp": round(sez["k_temp"], 2),
+        "k_ragg": round(sez["k_ragg"], 2),
+        "Smin_i2t_mm2": round(verifiche["smin_i2t_mm2"], 1),
+        "curva_interruttore": verifiche["curva"],
+        "t_guasto_s": round(verifiche["t_guasto_s"], 3),
+        "cortocircuito": {**cc, "impedenze_fine": dict(cc["impedenze_fine"])},
+        # testi
+        **s["testi"],
+        # 722
+        "ok_722": list(e722["ok_722"]),
+        "warning_722": list(e722["warning_722"]),
+        "nonconf_722": list(e722["nonconf_722"]),
+        # 4-41
+        "ok_441": list(e441["esito_441"]["ok"]),
+        "warning_441": list(e441["esito_441"]["warning"]),
+        "nonconf_441": list(e441["esito_441"]["nonconf"]),
+        # 4-43
+        "ok_443": list(verifiche["443"]["ok"]),
+        "warning_443": list(verifiche["443"]["warning"]),
+        "nonconf_443": list(verifiche["443"]["nonconf"]),
+        # ricalcolo incrementale
+        "stadi_ricalcolati": ricalcolati,
+    }
+
+
+# ==============================================================
+# STADI DI CALCOLO (ricalcolo incrementale)
+# ==============================================================
+# genera_progetto_ev esegue gli stadi di STADI_PROGETTO in ordine. Ogni stadio
+# dichiara i parametri di ingresso e gli stadi a monte da cui dipende: con una
+# cache_stadi persistente (es. st.session_state) uno stadio è ricalcolato solo
+# se cambia uno dei suoi parametri o la versione di uno stadio a monte.
+# La versione cresce solo se l'uscita cambia davvero: se ad es. una nuova Ib
+# lascia invariata In, gli stadi che dipendono solo da In non sono ricalcolati.
+
+
+def _controlla_input(p: dict) -> None:
+    """Controlli sugli input eseguiti a ogni chiamata (prima di usare la cache)."""
+    if p["potenza_kw"] <= 0 or p["distanza_m"] <= 0:
         raise ValueError("Potenza e distanza devono essere > 0.")
-    if tipo_posa not in PORTATA_BASE:
-        raise ValueError(f"Tipo posa non gestito: {tipo_posa}")
-    if rcd_idn_ma not in (30, 100, 300):
+    dati_cavo(p["tipo_cavo"])
+    if p["tipo_posa"] not in tipi_posa(p["tipo_cavo"]):
+        raise ValueError(f"Tipo posa non gestito: {p['tipo_posa']}")
+    if p["rcd_idn_ma"] not in IDN_AMMESSE_MA:
         raise ValueError("IΔn tipica: 30/100/300 mA.")
 
-    trifase = "trifase" in alimentazione.lower()
-    tensione = 400 if trifase else 220
-
     # Monofase max 7.4 kW
-    if (not trifase) and (potenza_kw > 7.4):
+    if ("trifase" not in p["alimentazione"].lower()) and (p["potenza_kw"] > POTENZA_MAX_MONOFASE_KW):
         raise ValueError("In monofase la potenza massima ammessa è 7,4 kW. Seleziona trifase o riduci la potenza.")
 
-    # ---------------------------
-    # Ib
-    # ---------------------------
+
+def _stadio_corrente(p: dict, s: dict) -> dict:
+    """Tensione e corrente d'impiego Ib."""
+    trifase = "trifase" in p["alimentazione"].lower()
+    tensione = TENSIONE_TRIFASE_V if trifase else TENSIONE_MONOFASE_V
     if trifase:
-        Ib = (potenza_kw * 1000) / (math.sqrt(3) * tensione * cosphi)
+        Ib = (p["potenza_kw"] * 1000) / (math.sqrt(3) * tensione * p["cosphi"])
     else:
-        Ib = (potenza_kw * 1000) / (tensione * cosphi)
+        Ib = (p["potenza_kw"] * 1000) / (tensione * p["cosphi"])
+    return {"trifase": trifase, "tensione": tensione, "u0": tensione / math.sqrt(3) if trifase else tensione, "Ib": Ib}
 
-    # ---------------------------
-    # In
-    # ---------------------------
-    In = next((i for i in INTERRUTTORI if i >= Ib), None)
+
+def _stadio_protezione(p: dict, s: dict) -> dict:
+    """Taglia In dell'interruttore (prima taglia ≥ Ib)."""
+    In = seleziona_interruttore(s["corrente"]["Ib"])
     if In is None:
         raise ValueError("Ib troppo elevata: nessuna taglia interruttore disponibile in tabella.")
+    return {"In": In}
 
-    # ---------------------------
-    # Sezione per caduta di tensione (ΔV ≤ 4%) – modello semplificato
-    # ---------------------------
-    cond_rame = 56
-    dv_max = tensione * 0.04
 
-    if trifase:
-        S_cad = (math.sqrt(3) * distanza_m * Ib * cosphi) / (cond_rame * dv_max)
-    else:
-        S_cad = (2 * distanza_m * Ib * cosphi) / (cond_rame * dv_max)
+def _stadio_sezione(p: dict, s: dict) -> dict:
+    """Derating, portata (eventualmente ciclica) e scelta della sezione per ΔV e Ib ≤ In ≤ Iz."""
+    tipo_cavo, tipo_posa = p["tipo_cavo"], p["tipo_posa"]
+    profilo_ciclico = p["profilo_ciclico"]
+    trifase, tensione, Ib = s["corrente"]["trifase"], s["corrente"]["tensione"], s["corrente"]["Ib"]
+    In = s["protezione"]["In"]
 
     # ---------------------------
     # Iz con derating
     # ---------------------------
-    k_temp, T_usata = _fattore_temp(tipo_posa, temp_amb, temp_terreno)
-    k_rho, rho_usata = _fattore_rho_terreno(rho_terreno_km_w) if tipo_posa == "Interrata" else (1.0, 2.5)
-    k_ragg = _fattore_raggr(n_linee)
-    note_rho = (f"• Resistività terreno ρ={rho_usata:.1f} K·m/W → kρ={k_rho:.2f}\n      " if tipo_posa == "Interrata" else "")
-
-    sezione = None
-    Iz_corr = None
-    Iz_base_sel = None
+    k_temp, T_usata = _fattore_temp(tipo_posa, p["temp_amb"], p["temp_terreno"])
+    interrata = posa_interrata(tipo_posa)
+    k_rho, rho_usata = _fattore_rho_terreno(p["rho_terreno_km_w"]) if interrata else (1.0, 2.5)
+    k_ragg = _fattore_raggr(p["n_linee"])
+    k_der = k_temp * k_rho * k_ragg
+
+    cand = candidati(tipo_cavo, tipo_posa, int(p["n_paralleli_max"]))
+    k_ciclico = np.ones(len(cand["sezione"]))
+    if profilo_ciclico is not None:
+        carico = np.asarray(profilo_ciclico.get("carico", ()), dtype=float)
+        passo_ciclo = float(profilo_ciclico.get("passo_min", 60.0))
+        if carico.size < 1 or np.any(carico < 0) or carico.max() <= 0:
+            raise ValueError("Profilo ciclico: servono frazioni di Ib ≥ 0 (almeno una > 0).")
+        sez_u, inv = np.unique(cand["sezione"], return_inverse=True)
+        par_t = costanti_tempo(tipo_cavo, tipo_posa, sez_u)
+        k_ciclico = fattore_ciclico(
+            carico, passo_ciclo, par_t["tau_cavo_s"], par_t["quota_ambiente"], par_t["tau_ambiente_s"]
+        )[inv]
 
-    for S in SEZIONI:
-        if S < S_cad:
-            continue
-        Iz_base = PORTATA_BASE[tipo_posa].get(S)
-        if not Iz_base:
-            continue
-        Iz = Iz_base * k_temp * k_rho * k_ragg
-        if Ib <= In <= Iz:
-            sezione = S
-            Iz_corr = Iz
-            Iz_base_sel = Iz_base
-            break
-
-    if sezione is None:
+    # ---------------------------
+    # Caduta di tensione (R a temperatura di esercizio + X) su tutti i candidati,
+    # scelta = maschera (ΔV ≤ 4% e In ≤ Iz) + argmin sull'ordine dei candidati
+    # ---------------------------
+    iz_cand = cand["iz_base"] * k_der * k_ciclico
+    dv_cand, theta_cand = caduta_tensione_vett(
+        cand["r20_ohm_km"], cand["x_ohm_km"], iz_cand, Ib, p["distanza_m"], p["cosphi"],
+        trifase, tensione, alfa_cavo(tipo_cavo), temp_rif_c=T_usata,
+    )
+    ok_dv = dv_cand <= LIMITE_DV_PERCENTO
+    i_sel = indice_scelta(ok_dv & (In <= iz_cand))
+    if i_sel is None:
         raise ValueError("Nessuna sezione soddisfa ΔV≤4% e Ib ≤ In ≤ Iz (con derating).")
+    i_dv = indice_scelta(ok_dv)
+    k_cicl_sel = float(k_ciclico[i_sel])
+    Iz_corr = float(cand["iz_base"][i_sel]) * k_der * k_cicl_sel
+    riga_ciclica = ""
+    theta_ciclo = None
+    if profilo_ciclico is not None:
+        theta_ciclo = min(T_usata + (TEMP_MAX_ESERCIZIO - T_usata) * (carico.max() * Ib / Iz_corr) ** 2, TEMP_MAX_ESERCIZIO)
+        riga_ciclica = "\n    " + testo_portata_ciclica(k_cicl_sel, theta_ciclo, passo_ciclo, carico.size)
+    return {
+        "k_temp": k_temp,
+        "T_usata": T_usata,
+        "interrata": interrata,
+        "k_rho": k_rho,
+        "rho_usata": rho_usata,
+        "k_ragg": k_ragg,
+        "S_cad": float(cand["sezione"][i_dv] * cand["n_paralleli"][i_dv]),
+        "sezione": cand["sezione"][i_sel].item(),
+        "n_paralleli": int(cand["n_paralleli"][i_sel]),
+        "Iz_base_sel": float(cand["iz_base"][i_sel]),
+        "dv_percento": float(dv_cand[i_sel]),
+        "theta_c": float(theta_cand[i_sel]),
+        "k_cicl_sel": k_cicl_sel,
+        "Iz_corr": Iz_corr,
+        "theta_ciclo": theta_ciclo,
+        "riga_ciclica": riga_ciclica,
+    }
+
+
+def _stadio_pe(p: dict, s: dict) -> dict:
+    """PE (5-54) – regola semplificata."""
+    return {"sezione_pe": _pe_da_fase(int(s["sezione"]["sezione"]))}
+
+
+def _stadio_i2t(p: dict, s: dict) -> dict:
+    """Cortocircuito e anello di guasto, Icn, verifiche 4-43 (I²t) e 4-41 TN da curva."""
+    tipo_cavo, tipo_posa = p["tipo_cavo"], p["tipo_posa"]
+    sistema, icc_ka, impedenze_monte = p["sistema"], p["icc_ka"], p["impedenze_monte"]
+    trifase, u0 = s["corrente"]["trifase"], s["corrente"]["u0"]
+    In = s["protezione"]["In"]
+    sezione, n_paralleli = s["sezione"]["sezione"], s["sezione"]["n_paralleli"]
 
     # ---------------------------
-    # PE (5-54) – regola semplificata
+    # Cortocircuito e anello di guasto (rete: origine → fine linea, R/X da catalogo)
     # ---------------------------
-    sezione_pe = _pe_da_fase(int(sezione))
+    r_f, x_f = impedenza_tratto(tipo_cavo, tipo_posa, sezione, n_paralleli)
+    r_pe, x_pe = impedenza_tratto(tipo_cavo, tipo_posa, s["pe"]["sezione_pe"], n_paralleli)
+    rete = cortocircuito_rete(
+        [-1], [p["distanza_m"]], [r_f], [x_f], [r_pe], [x_pe], [trifase],
+        icc_ka=icc_ka,
+        tensione_fase_v=u0,
+        tn=not sistema.strip().upper().startswith("TT"),
+        alfa_r=alfa_cavo(tipo_cavo),
+        impedenze_monte=impedenze_monte,
+        zs_monte_ohm=(p["zs_ohm"] if impedenze_monte is None else None),
+        sorgente_trifase=trifase,
+    )
+    cc = {k: float(v[0]) for k, v in rete.items() if k != "impedenze_fine"}
+    cc["impedenze_fine"] = {k: float(v[0]) for k, v in rete["impedenze_fine"].items()}
+    icc_locale_ka = icc_ka if impedenze_monte is None else cc["icc_max_inizio_a"] / 1000.0
 
     # ---------------------------
     # Icn vs Icc (semplificato)
     # ---------------------------
-    if icc_ka <= 6:
+    if icc_locale_ka <= 6:
         icn_note = "Icn minimo 6 kA (verifica puntuale con dati di fornitura)."
-    elif icc_ka <= 10:
+    elif icc_locale_ka <= 10:
         icn_note = "Richiedere interruttore con Icn ≥ 10 kA."
     else:
         icn_note = "Richiedere interruttore con Icn adeguato (≥ Icc presunta)."
 
     # ---------------------------
-    # Verifica termica corto (I²t) – se t disponibile
-    # Icc (kA) -> A
-    # Smin = I * sqrt(t) / k
+    # Verifiche 4-41 (TN) e 4-43 con i valori calcolati e le curve di intervento
+    # Smin = sqrt(I²t) / k, I²t da curva (o Icc_max_inizio² * t se t fornito)
     # ---------------------------
+    t_intervento_s = p["t_intervento_s"]
+    if t_intervento_s is not None and t_intervento_s <= 0:
+        raise ValueError("Tempo intervento deve essere > 0")
+    verifiche = verifica_linea(
+        cc, In, sezione, n_paralleli, dati_cavo(tipo_cavo)["k_i2t"], u0,
+        sistema=sistema, t_intervento_s=t_intervento_s, curva=p["curva_interruttore"],
+        rcd_idn_ma=p["rcd_idn_ma"], terminale=p["circuito_terminale"],
+    )
+    return {"cc": cc, "icc_locale_ka": icc_locale_ka, "icn_note": icn_note, "verifiche": verifiche}
+
+
+def _stadio_441(p: dict, s: dict) -> dict:
+    """Esiti 4-41 (contatti indiretti) e note per le prove in campo."""
+    sistema, rcd_idn_ma, ul_v, ra_ohm = p["sistema"], p["rcd_idn_ma"], p["ul_v"], p["ra_ohm"]
     note_verifiche_campo = []
-    smin_i2t = None
-    if t_intervento_s is not None:
-        if t_intervento_s <= 0:
-            raise ValueError("Tempo intervento deve essere > 0")
-        Icc_A = icc_ka * 1000
-        smin_i2t = (Icc_A * math.sqrt(t_intervento_s)) / K_CU_XLPE
-        # Nota: è una verifica cautelativa se Icc riferita al punto; per correttezza serve Icc alla fine linea.
-    else:
-        note_verifiche_campo.append("Verifica termica corto circuito (I²t) da eseguire con Icc locale e tempi reali dell’interruttore (CEI 64-8/4-43).")
-
-    # ---------------------------
-    # CHECK 4-41 (contatti indiretti)
-    # ---------------------------
     esito_441 = {"ok": [], "warning": [], "nonconf": []}
 
     # TT: Ra * IΔn ≤ UL
@@ -253,24 +435,27 @@ def genera_progetto_ev(
             esito_441["warning"].append("TT: inserire Ra (Ω) per verifica Ra·IΔn ≤ UL; in alternativa verificare in campo (CEI 64-8/4-41).")
             note_verifiche_campo.append("Misurare Ra e verificare intervento differenziale/tempi (CEI 64-8/6 prove).")
 
-    # TN: serve Zs e curva/tempi – qui se Zs manca mettiamo nota
+    # TN: Zs calcolata lungo la rete (Ia = soglia magnetica dell'interruttore)
     else:
-        if zs_ohm is not None:
-            esito_441["warning"].append("TN: Zs fornita, ma per verifica completa servono Ia/curve e tempi di intervento (CEI 64-8/4-41). Verificare con dati del dispositivo.")
-        else:
-            esito_441["warning"].append("TN: verificare in campo impedenza anello di guasto (Zs) e tempi di intervento (CEI 64-8/4-41).")
-            note_verifiche_campo.append("Misurare Zs e verificare tempi di intervento per la protezione contro i contatti indiretti (CEI 64-8/6).")
-
-    # ---------------------------
-    # CHECKLIST 722 (pulita)
-    # ---------------------------
+        for c in ("ok", "warning", "nonconf"):
+            esito_441[c].extend(s["i2t"]["verifiche"]["441"][c])
+        if p["zs_ohm"] is None:
+            note_verifiche_campo.append("Misurare Zs e confermare il valore calcolato e i tempi di intervento (CEI 64-8/6).")
+    return {"esito_441": esito_441, "note_verifiche_campo": note_verifiche_campo}
+
+
+def _stadio_722(p: dict, s: dict) -> dict:
+    """CHECKLIST 722 (pulita)."""
+    In = s["protezione"]["In"]
+    rcd_tipo, rcd_idn_ma, evse_rdcdd_integrato = p["rcd_tipo"], p["rcd_idn_ma"], p["evse_rdcdd_integrato"]
+    esterno, ip_rating, ik_rating = p["esterno"], p["ip_rating"], p["ik_rating"]
     warning_722, nonconf_722, ok_722 = [], [], []
-    modo_norm = modo_ricarica.strip().lower()
+    modo_norm = p["modo_ricarica"].strip().lower()
 
     ok_722.append("Circuito dedicato per punto di ricarica (linea dedicata dimensionata).")
 
-    if n_linee > 1:
-        if gestione_carichi:
+    if p["n_linee"] > 1:
+        if p["gestione_carichi"]:
             ok_722.append("Gestione carichi/contemporaneità: prevista.")
         else:
             warning_722.append("Più linee/punti senza gestione carichi: assumere contemporaneità = 1 e verificare potenza disponibile.")
@@ -299,13 +484,13 @@ def genera_progetto_ev(
                 ok_722.append("Modo 3: protezione guasti DC coerente (Tipo B o A+6mA).")
 
     # Modo 1/2 presa domestica
-    if modo_norm in ("modo 1", "modo 2") and tipo_punto == "Presa domestica":
+    if modo_norm in ("modo 1", "modo 2") and p["tipo_punto"] == "Presa domestica":
         if In > 16:
             nonconf_722.append("Modo 1/2 con presa domestica: corrente > 16 A non ammessa (adeguare).")
         else:
             warning_722.append("Modo 1/2 con presa domestica: raccomandato solo per ricariche occasionali.")
 
-    if not spd_previsto:
+    if not p["spd_previsto"]:
         warning_722.append("SPD non previsto: valutare protezione da sovratensioni in base a rischio e impianto.")
     else:
         ok_722.append("SPD previsto/valutato.")
@@ -320,11 +505,36 @@ def genera_progetto_ev(
         else:
             ok_722.append(f"Protezione meccanica: IK{ik_rating} adeguato (≥ IK07).")
 
-    if not (0.5 <= altezza_presa_m <= 1.5):
+    if not (0.5 <= p["altezza_presa_m"] <= 1.5):
         warning_722.append("Altezza punto di connessione fuori intervallo raccomandato 0,5–1,5 m.")
     else:
         ok_722.append("Altezza punto di connessione in intervallo raccomandato (0,5–1,5 m).")
+    return {"ok_722": ok_722, "warning_722": warning_722, "nonconf_722": nonconf_722}
+
 
+def _stadio_testi(p: dict, s: dict) -> dict:
+    """Relazione tecnica, dati per unifilare e note planimetria."""
+    (nome, cognome, indirizzo, sistema, alimentazione, tipo_posa, potenza_kw, distanza_m, cosphi, n_linee,
+     modo_ricarica, tipo_punto, esterno, ip_rating, ik_rating, altezza_presa_m, spd_previsto, rcd_tipo,
+     rcd_idn_ma, evse_rdcdd_integrato, t_intervento_s, impedenze_monte) = (p[k] for k in _INGRESSI_TESTI)
+    cavo = dati_cavo(p["tipo_cavo"])
+    modo_norm = modo_ricarica.strip().lower()
+    trifase, tensione, Ib = s["corrente"]["trifase"], s["corrente"]["tensione"], s["corrente"]["Ib"]
+    In = s["protezione"]["In"]
+    sez = s["sezione"]
+    T_usata, interrata, k_temp, k_ragg = sez["T_usata"], sez["interrata"], sez["k_temp"], sez["k_ragg"]
+    Iz_base_sel, Iz_corr, riga_ciclica = sez["Iz_base_sel"], sez["Iz_corr"], sez["riga_ciclica"]
+    dv_percento, theta_c, S_cad = sez["dv_percento"], sez["theta_c"], sez["S_cad"]
+    note_rho = (f"• Resistività terreno ρ={sez['rho_usata']:.1f} K·m/W → kρ={sez['k_rho']:.2f}\n      " if interrata else "")
+    sezione_txt = f"{sez['sezione']}" if sez["n_paralleli"] == 1 else f"{sez['n_paralleli']} × {sez['sezione']}"
+    sezione_pe = s["pe"]["sezione_pe"]
+    cc, verifiche = s["i2t"]["cc"], s["i2t"]["verifiche"]
+    icc_locale_ka, icn_note = s["i2t"]["icc_locale_ka"], s["i2t"]["icn_note"]
+    smin_i2t = verifiche["smin_i2t_mm2"]
+    esito_443 = verifiche["443"]
+    curva_txt = f"curva {verifiche['curva']}" if In <= 160 else "sganciatore regolabile"
+    esito_441, note_verifiche_campo = s["441"]["esito_441"], s["441"]["note_verifiche_campo"]
+    ok_722, warning_722, nonconf_722 = s["722"]["ok_722"], s["722"]["warning_722"], s["722"]["nonconf_722"]
     # ---------------------------
     # TESTI PULITI (solo note pertinenti)
     # ---------------------------
@@ -373,14 +583,17 @@ def genera_progetto_ev(
     {("- " + BULLET_JOIN.join(esito_441["nonconf"])) if esito_441["nonconf"] else "- (nessuna)"}
     """).strip()
 
-    # I²t blocco
-    blocco_i2t = ""
-    if smin_i2t is not None:
-        blocco_i2t = (
-            "VERIFICA TERMICA CORTOCIRCUITO (CEI 64-8/4-43)\n"
-            f"- Dati: Icc={icc_ka:.1f} kA, t={t_intervento_s:.3f} s, k≈{K_CU_XLPE}\n"
-            f"- Sezione minima teorica Smin≈{smin_i2t:.1f} mm² (verificare con Icc reale a fine linea e curva del dispositivo)."
-        )
+    # blocco 4-43
+    righe_443 = [
+        "VERIFICA CORTOCIRCUITO (CEI 64-8/4-43)",
+        f"- Icc max inizio linea = {cc['icc_max_inizio_a'] / 1000:.2f} kA | Icc max fine linea = {cc['icc_max_fine_a'] / 1000:.2f} kA",
+        f"- Icc min fine linea = {cc['icc_min_fine_a'] / 1000:.3f} kA | Zs fine linea = {cc['zs_fine_ohm']:.3f} Ω"
+        f" | Ia ({verifiche['t_limite_s']:g} s) ≈ {verifiche['ia_a']:.0f} A",
+        f"- Smin I²t ≈ {smin_i2t:.1f} mm² (k≈{cavo['k_i2t']:.0f}, "
+        + (f"t={t_intervento_s:.3f} s)" if t_intervento_s is not None else f"energia passante {curva_txt})"),
+    ]
+    righe_443 += [f"- {m}" for c in ("ok", "warning", "nonconf") for m in esito_443[c]]
+    blocco_443 = "\n".join(righe_443)
 
     relazione = dedent(f"""
     RELAZIONE TECNICA – INFRASTRUTTURA DI RICARICA VEICOLI ELETTRICI - Software eV Field Service 
@@ -499,31 +712,32 @@ def genera_progetto_ev(
     - Caduta di tensione di progetto: ΔV ≤ 4% (CEI 64-8 §525).
     - Verifica sovraccarico: Ib ≤ In ≤ Iz (CEI 64-8 §433).
     - Portate cavo: condizioni standard con fattori correttivi:
-      • Temperatura {T_usata} °C ({'terreno' if tipo_posa=='Interrata' else 'aria'}) → kT={k_temp:.2f}
+      • Temperatura {T_usata} °C ({'terreno' if interrata else 'aria'}) → kT={k_temp:.2f}
       {note_rho}• Raggruppamento n={n_linee} → kG={k_ragg:.2f}
-    - Cavo: FG16(O)R16 0,6/1 kV (rame).
+    - Cavo: {cavo['descrizione']}.
 
     DIMENSIONAMENTO LINEA
     - Tensione: {tensione} V
     - cosφ: {cosphi:.2f}
     - Lunghezza: {distanza_m:.1f} m
     - Ib = {Ib:.2f} A
-    - In = {In} A (curva C)
-    - Sezione fase: {sezione} mm²
+    - In = {In} A ({curva_txt if In <= 160 else "interruttore scatolato, sganciatore regolabile"})
+    - Sezione fase: {sezione_txt} mm²
     - Sezione PE (criterio 5-54): {sezione_pe} mm²
-    - Iz_base = {Iz_base_sel} A | Iz_corr = {Iz_corr:.1f} A
+    - Iz_base = {Iz_base_sel:g} A | Iz_corr = {Iz_corr:.1f} A{riga_ciclica}
+    - ΔV = {dv_percento:.2f}% (R a θ ≈ {theta_c:.0f} °C + X) | sezione minima per ΔV: {S_cad:g} mm²
     - Verifica Ib ≤ In ≤ Iz: {"OK" if (Ib <= In <= Iz_corr) else "NON OK"}
 
     PROTEZIONI
     - Sovracorrenti: interruttore MT dedicato alla linea EV.
-    - Cortocircuito: Icc presunta = {icc_ka:.1f} kA → {icn_note}
+    - Cortocircuito: Icc {"presunta" if impedenze_monte is None else "max inizio linea"} = {icc_locale_ka:.1f} kA → {icn_note}
     - Differenziale: {rcd_tipo}, IΔn = {rcd_idn_ma} mA.
     - RDC-DD 6 mA DC integrato EVSE: {"Sì" if evse_rdcdd_integrato else "No"}.
     {nota_dc_fault if nota_dc_fault else ""}
     {nota_spd}
 
     {blocco_441}
-    {(blocco_i2t if blocco_i2t else "")}
+    {blocco_443}
 
     PRESCRIZIONI CEI 64-8/7 – SEZIONE 722 (CHECK-LIST)
     Esiti OK:
@@ -551,8 +765,9 @@ def genera_progetto_ev(
     QUADRO → LINEA DEDICATA EVSE → EVSE
 
     1) Protezione di linea:
-       - Magnetotermico: In = {In} A, curva C, poli: {"4P" if trifase else "2P"}
+       - {"Magnetotermico" if In <= 160 else "Interruttore scatolato"}: In = {In} A, {curva_txt}, poli: {"4P" if trifase else "2P"}
        - Potere interruzione: {icn_note}
+       - Icc max inizio linea: {cc['icc_max_inizio_a'] / 1000:.2f} kA | Icc min fine linea: {cc['icc_min_fine_a'] / 1000:.3f} kA
        - Verifica: Ib={Ib:.2f} A ≤ In={In} A ≤ Iz={Iz_corr:.1f} A (OK)
 
     2) Differenziale per punto:
@@ -562,12 +777,12 @@ def genera_progetto_ev(
     {("   - " + nota_dc_fault) if nota_dc_fault else ""}
 
     3) Linea:
-       - Cavo: FG16(O)R16 0,6/1 kV (rame)
-       - Sezione fase: {sezione} mm²
+       - Cavo: {cavo['descrizione']}
+       - Sezione fase: {sezione_txt} mm²
        - Sezione PE: {sezione_pe} mm²
        - Posa: {tipo_posa}
        - Lunghezza: {distanza_m:.1f} m
-       - Caduta di tensione: ΔV ≤ 4% (criterio di progetto)
+       - Caduta di tensione: ΔV = {dv_percento:.2f}% (≤ 4%)
 
     4) SPD:
        - {"Previsto/valutato" if spd_previsto else "Non previsto"}
@@ -593,31 +808,83 @@ def genera_progetto_ev(
     Altezza punto di connessione: {altezza_presa_m:.2f} m (raccomandato 0,5–1,5 m).
     """).strip()
 
-    return {
-        # numeri
-        "tensione_v": tensione,
-        "Ib_a": round(Ib, 2),
-        "In_a": In,
-        "Iz_a": round(Iz_corr, 1),
-        "sezione_mm2": sezione,
-        "sezione_pe_mm2": sezione_pe,
-        "S_cad_min_mm2": round(S_cad, 2),
-        "k_temp": round(k_temp, 2),
-        "k_ragg": round(k_ragg, 2),
-        "Smin_i2t_mm2": round(smin_i2t, 1) if smin_i2t is not None else None,
-        # testi
-        "relazione": relazione,
-        "unifilare": unifilare,
-        "planimetria": planimetria,
-        # 722
-        "ok_722": ok_722,
-        "warning_722": warning_722,
-        "nonconf_722": nonconf_722,
-        # 4-41
-        "ok_441": esito_441["ok"],
-        "warning_441": esito_441["warning"],
-        "nonconf_441": esito_441["nonconf"],
-    }
+    return {"relazione": relazione, "unifilare": unifilare, "planimetria": planimetria}
+
+
+_INGRESSI_TESTI = (
+    "nome", "cognome", "indirizzo", "sistema", "alimentazione", "tipo_posa", "potenza_kw", "distanza_m", "cosphi",
+    "n_linee", "modo_ricarica", "tipo_punto", "esterno", "ip_rating", "ik_rating", "altezza_presa_m",
+    "spd_previsto", "rcd_tipo", "rcd_idn_ma", "evse_rdcdd_integrato", "t_intervento_s", "impedenze_monte",
+)
+
+# stadio: (funzione, parametri di ingresso, stadi a monte), in ordine di esecuzione
+STADI_PROGETTO = MappingProxyType({
+    "corrente": (_stadio_corrente, ("potenza_kw", "alimentazione", "cosphi"), ()),
+    "protezione": (_stadio_protezione, (), ("corrente",)),
+    "sezione": (
+        _stadio_sezione,
+        ("tipo_cavo", "tipo_posa", "temp_amb", "temp_terreno", "rho_terreno_km_w", "n_linee",
+         "n_paralleli_max", "profilo_ciclico", "distanza_m", "cosphi"),
+        ("corrente", "protezione"),
+    ),
+    "pe": (_stadio_pe, (), ("sezione",)),
+    "i2t": (
+        _stadio_i2t,
+        ("tipo_cavo", "tipo_posa", "distanza_m", "sistema", "icc_ka", "impedenze_monte", "zs_ohm",
+         "t_intervento_s", "curva_interruttore", "rcd_idn_ma", "circuito_terminale"),
+        ("corrente", "protezione", "sezione", "pe"),
+    ),
+    "441": (_stadio_441, ("sistema", "ra_ohm", "ul_v", "rcd_idn_ma", "zs_ohm"), ("i2t",)),
+    "722": (
+        _stadio_722,
+        ("modo_ricarica", "tipo_punto", "n_linee", "gestione_carichi", "rcd_tipo", "rcd_idn_ma",
+         "evse_rdcdd_integrato", "spd_previsto", "esterno", "ip_rating", "ik_rating", "altezza_presa_m"),
+        ("protezione",),
+    ),
+    "testi": (
+        _stadio_testi,
+        _INGRESSI_TESTI + ("tipo_cavo",),
+        ("corrente", "protezione", "sezione", "pe", "i2t", "441", "722"),
+    ),
+})
+
+
+def _chiave_cache(v):
+    """Rappresentazione confrontabile (hashable) di parametri e uscite, anche con dict e array."""
+    if isinstance(v, (dict, MappingProxyType)):
+        return tuple((k, _chiave_cache(x)) for k, x in sorted(v.items(), key=lambda kv: str(kv[0])))
+    if isinstance(v, (list, tuple)):
+        return tuple(_chiave_cache(x) for x in v)
+    if isinstance(v, np.ndarray):
+        return (v.shape, v.dtype.str, v.tobytes())
+    return v
+
+
+def _esegui_stadi(p: dict, cache: dict) -> tuple[dict, list[str]]:
+    """
+    Esegue gli stadi di STADI_PROGETTO riusando le uscite in cache quando parametri
+    e versioni degli stadi a monte sono invariati.
+
+    cache: {stadio: {"chiave", "versione", "uscita"}}, aggiornata sul posto.
+    Restituisce (uscite per stadio, stadi ricalcolati in questa chiamata).
+    """
+    uscite = {}
+    ricalcolati = []
+    for nome, (funz, ingressi, monte) in STADI_PROGETTO.items():
+        chiave = (_chiave_cache([p[k] for k in ingressi]), tuple(cache[m]["versione"] for m in monte))
+        voce = cache.get(nome)
+        if voce is None or voce["chiave"] != chiave:
+            uscita = funz(p, uscite)
+            if voce is None:
+                versione = 0
+            elif _chiave_cache(uscita) == _chiave_cache(voce["uscita"]):
+                versione = voce["versione"]  # uscita invariata: gli stadi a valle restano validi
+            else:
+                versione = voce["versione"] + 1
+            voce = cache[nome] = {"chiave": chiave, "versione": versione, "uscita": uscita}
+            ricalcolati.append(nome)
+        uscite[nome] = voce["uscita"]
+    return uscite, ricalcolati
 
 def _fattore_rho_terreno(rho_km_w: float | None) -> tuple[float, float]:
     """
@@ -628,9 +895,109 @@ def _fattore_rho_terreno(rho_km_w: float | None) -> tuple[float, float]:
     return (_interp_dict(rho, FATT_RHO_TERRA), rho)
 
 
+def _compatta_intervalli(indici: list[int]) -> str:
+    """
+    Converte una lista crescente di indici in intervalli compatti.
+    Es.: [1, 2, 3, 5, 7, 8] -> "1–3, 5, 7–8".
+    """
+    parti = []
+    inizio = prec = None
+    for i in indici:
+        if prec is not None and i == prec + 1:
+            prec = i
+            continue
+        if inizio is not None:
+            parti.append(f"{inizio}" if inizio == prec else f"{inizio}–{prec}")
+        inizio = prec = i
+    if inizio is not None:
+        parti.append(f"{inizio}" if inizio == prec else f"{inizio}–{prec}")
+    return ", ".join(parti)
+
+
+def _etichetta_provenienza(dorsale: bool, colonnine: list[int]) -> str:
+    """Etichetta leggibile della provenienza, es. "dorsale, colonnine 1–40"."""
+    parti = []
+    if dorsale:
+        parti.append("dorsale")
+    if colonnine:
+        parti.append(("colonnina " if len(colonnine) == 1 else "colonnine ") + _compatta_intervalli(colonnine))
+    return ", ".join(parti)
+
+
+def _aggrega_checklist_722(sorgenti, sezione: str = "722") -> tuple[list[str], list[str], list[str], dict]:
+    """
+    Aggrega in un solo passaggio le checklist 722 di dorsale e linee
+    (sezione="441"/"443" per gli esiti 4-41/4-43, stesso formato).
+
+    sorgenti: iterabile di (chiave, risultato) dove chiave è "dorsale" oppure
+    l'indice (int, crescente) della colonnina.
+
+    Ogni messaggio compare una sola volta per categoria (chiave = testo del
+    messaggio), con l'elenco delle linee che lo hanno generato compattato in
+    intervalli: la dimensione delle liste non cresce con il numero di linee.
+
+    Restituisce (ok_722, warning_722, nonconf_722, provenienza_722) dove
+    provenienza_722 = {categoria: {messaggio: {"dorsale": bool, "colonnine": [idx...]}}}.
+    """
+    categorie = (f"ok_{sezione}", f"warning_{sezione}", f"nonconf_{sezione}")
+    prov = {c: {} for c in categorie}
+
+    for chiave, res in sorgenti:
+        for c in categorie:
+            tab = prov[c]
+            messaggi = res.get(c)
+            if not isinstance(messaggi, list):
+                continue  # es. dorsale non prevista ("ok_441": True)
+            for msg in messaggi:
+                voce = tab.get(msg)
+                if voce is None:
+                    voce = tab[msg] = {"dorsale": False, "colonnine": []}
+                if chiave == "dorsale":
+                    voce["dorsale"] = True
+                else:
+                    col = voce["colonnine"]
+                    # stessa linea che ripete lo stesso messaggio: nessun duplicato
+                    if not col or col[-1] != chiave:
+                        col.append(chiave)
+
+    def _righe(c: str) -> list[str]:
+        return [
+            f"{msg} [{_etichetta_provenienza(v['dorsale'], v['colonnine'])}]"
+            for msg, v in prov[c].items()
+        ]
+
+    return _righe(categorie[0]), _righe(categorie[1]), _righe(categorie[2]), prov
+
+
 # ==============================================================
 # ESTENSIONE MULTI-COLONNINA (aggiunta - non sostituisce nulla)
 # ==============================================================
+MAX_COLONNINE = 500
+ARCHITETTURE = (
+    "Dorsale unica + sottoquadro in prossimità",
+    "Sottoquadro con linee uniche",
+    "Linee separate dal contatore",
+)
+
+
+def normalizza_architettura(architettura: str | None) -> str:
+    """
+    Nome canonico dell'architettura (uno di ARCHITETTURE) riconosciuto dalle parole chiave;
+    un valore non riconosciuto è restituito com'è (vuoto -> "Architettura non specificata").
+    """
+    arch = (architettura or "").strip()
+    arch_key = arch.lower()
+    if "dorsale" in arch_key and "prossimit" in arch_key:
+        return ARCHITETTURE[0]
+    if ("linee" in arch_key and "uniche" in arch_key) or ("sottoquadro" in arch_key and "uniche" in arch_key):
+        return ARCHITETTURE[1]
+    if "contatore" in arch_key or ("linee" in arch_key and "separate" in arch_key):
+        # linee dedicate dal contatore/quadro principale (senza sottoquadro EV)
+        return ARCHITETTURE[2]
+    # lascia passare valori custom ma segnala nelle note
+    return arch if arch else "Architettura non specificata"
+
+
 def genera_progetto_ev_multi(
     # anagrafica
     nome: str,
@@ -668,9 +1035,22 @@ def genera_progetto_ev_multi(
     ul_v: float = 50.0,
     zs_ohm: float | None = None,
     t_intervento_s: float | None = None,
+    profilo_carichi: dict | None = None,
+    alimentazione_dorsale: str | None = None,
+    distanze_linee_m: list[float] | None = None,
+    planimetria_percorsi: str | None = None,
+    n_linee_per_linea: list[int] | None = None,
+    tipo_cavo: str = CAVO_DEFAULT,
+    n_paralleli_max: int = 4,
+    curva_interruttore: str = "C",
+    portata_ciclica_dorsale: bool = False,
+    profilo_ciclico_linee: dict | None = None,
+    potenze_colonnine_kw: list[float] | None = None,
+    priorita_colonnine: list[float] | None = None,
+    cache_stadi: dict | None = None,
 ):
     """
-    Estensione per più colonnine (fino a 5) con due architetture:
+    Estensione per più colonnine (fino a MAX_COLONNINE) con due architetture:
 
     A) 'Dorsale unica + sottoquadro in prossimità':
        - Una dorsale (quadro principale -> sottoquadro in prossimità colonnine) di lunghezza distanza_dorsale_m.
@@ -680,33 +1060,75 @@ def genera_progetto_ev_multi(
        - Sottoquadro vicino al quadro principale (dorsale tipicamente breve, comunque parametrizzata da distanza_dorsale_m).
        - Dal sottoquadro partono n_colonnine linee dedicate, ciascuna di lunghezza distanza_linea_m (tipicamente lunga).
 
-    Nota: per semplicità progettuale (pre-dimensionamento) la dorsale è calcolata a potenza totale
-    (somma delle potenze), senza fattori di contemporaneità. Se è presente gestione carichi a monte,
-    è possibile riparametrizzare potenza_kw e/o introdurre un fattore esterno.
+    Nota: senza profilo_carichi la dorsale è calcolata a potenza totale (somma delle potenze),
+    senza fattori di contemporaneità.
+    Con profilo_carichi (dizionario di parametri per simulazione_carichi_ev.simula_anno:
+    politica, limite_kw, sessioni_giorno, arrivo, durata, energia, percentile_progetto, seed, ...)
+    la potenza della dorsale è quella di progetto ricavata dalla simulazione annuale.
+    Se gestione_carichi è False la politica è forzata a "nessuna" (contemporaneità reale
+    delle sessioni, senza limitazione).
+
+    Colonnine monofase con alimentazione_dorsale trifase: le colonnine sono assegnate
+    alle fasi con fasi_ev.bilancia_fasi e la dorsale è dimensionata sulla fase più
+    caricata (potenza equivalente = 3 × potenza della fase peggiore).
+
+    potenze_colonnine_kw: potenza per singola colonnina; se presente sostituisce
+    potenza_kw per le linee, la dorsale, la simulazione e il bilanciamento fasi.
+    priorita_colonnine: pesi (> 0) per colonnina del bilanciamento fasi (fasi_ev.bilancia_fasi).
+
+    distanze_linee_m: lunghezze per singola linea (es. da percorsi_ev.distanze_progetto);
+    se presente sostituisce distanza_linea_m per ciascuna colonnina.
+    planimetria_percorsi: riepilogo percorsi aggiunto alla planimetria.
+    n_linee_per_linea: raggruppamento peggiore per singola linea (es. da
+    raggruppamento_ev.raggruppamento_percorsi); se presente sostituisce n_linee = n_colonnine.
+
+    Portata ciclica (termico_ev): con portata_ciclica_dorsale e profilo_carichi la dorsale
+    usa come profilo il giorno di massima energia della simulazione annuale;
+    profilo_ciclico_linee (formato di genera_progetto_ev.profilo_ciclico) vale per tutte le linee.
+
+    cache_stadi: dict persistente tra chiamate; dorsale e singole linee usano ciascuna
+    la propria cache degli stadi di genera_progetto_ev (chiavi "dorsale" e indice colonnina).
     """
-    if n_colonnine < 1 or n_colonnine > 5:
-        raise ValueError("Numero colonnine ammesso: 1..5")
+    if n_colonnine < 1 or n_colonnine > MAX_COLONNINE:
+        raise ValueError(f"Numero colonnine ammesso: 1..{MAX_COLONNINE}")
     if distanza_dorsale_m <= 0 or distanza_linea_m <= 0:
         raise ValueError("Le distanze devono essere > 0.")
-    arch = (architettura or "").strip()
-
+    if distanze_linee_m is not None:
+        if len(distanze_linee_m) != int(n_colonnine):
+            raise ValueError("distanze_linee_m: serve una distanza per ciascuna colonnina.")
+        if any(float(x) <= 0 for x in distanze_linee_m):
+            raise ValueError("Le distanze devono essere > 0.")
+    if potenze_colonnine_kw is not None:
+        if len(potenze_colonnine_kw) != int(n_colonnine):
+            raise ValueError("potenze_colonnine_kw: serve una potenza per ciascuna colonnina.")
+        if any(float(x) <= 0 for x in potenze_colonnine_kw):
+            raise ValueError("Potenza colonnine deve essere > 0.")
+    if priorita_colonnine is not None:
+        if len(priorita_colonnine) != int(n_colonnine):
+            raise ValueError("priorita_colonnine: serve una priorità per ciascuna colonnina.")
+        if any(float(x) <= 0 for x in priorita_colonnine):
+            raise ValueError("Priorità devono essere > 0.")
+    if n_linee_per_linea is not None:
+        if len(n_linee_per_linea) != int(n_colonnine):
+            raise ValueError("n_linee_per_linea: serve un valore per ciascuna colonnina.")
+        if any(int(x) < 1 for x in n_linee_per_linea):
+            raise ValueError("n_linee_per_linea: valori ammessi ≥ 1.")
     # Normalizza stringhe architettura per robustezza
-    arch_key = arch.lower()
-    if "dorsale" in arch_key and "prossimit" in arch_key:
-        arch_norm = "Dorsale unica + sottoquadro in prossimità"
-    elif ("linee" in arch_key and "uniche" in arch_key) or ("sottoquadro" in arch_key and "uniche" in arch_key):
-        arch_norm = "Sottoquadro con linee uniche"
-    elif "contatore" in arch_key or ("linee" in arch_key and "separate" in arch_key):
-        # Nuova opzione: linee dedicate dal contatore/quadro principale (senza sottoquadro EV)
-        arch_norm = "Linee separate dal contatore"
-    else:
-        # lascia passare valori custom ma segnala nelle note
-        arch_norm = arch if arch else "Architettura non specificata"
+    arch_norm = normalizza_architettura(architettura)
+    potenze = (
+        [float(potenza_kw)] * int(n_colonnine) if potenze_colonnine_kw is None
+        else [float(x) for x in potenze_colonnine_kw]
+    )
 
     # ---------------------------
     # Calcolo dorsale (quadro principale -> sottoquadro)
     # ---------------------------
     # - per 'Linee separate dal contatore' NON esiste una dorsale dedicata (si va direttamente alle colonnine)
+    simulazione = None
+    bilanciamento = None
+    profilo_dorsale = None
+    alim_dorsale = (alimentazione_dorsale or alimentazione).strip()
+    linee_monofase = "trifase" not in alimentazione.lower()
     if arch_norm == "Linee separate dal contatore":
         potenza_dorsale_kw = 0.0
         dorsale = {
@@ -719,7 +1141,34 @@ def genera_progetto_ev_multi(
             "ok_441": True,
         }
     else:
-        potenza_dorsale_kw = float(potenza_kw) * int(n_colonnine)
+        potenza_dorsale_kw = sum(potenze)
+
+        if profilo_carichi is not None:
+            par_sim = dict(profilo_carichi)
+            if not gestione_carichi:
+                par_sim["politica"] = "nessuna"
+            elif par_sim.get("politica", "nessuna") == "nessuna":
+                par_sim["politica"] = "proporzionale"
+            if portata_ciclica_dorsale:
+                par_sim["restituisci_serie"] = True
+            simulazione = simula_anno(n_colonnine=int(n_colonnine), potenza_kw=potenze, **par_sim)
+            if simulazione["potenza_progetto_kw"] > 0:
+                potenza_dorsale_kw = min(potenza_dorsale_kw, float(simulazione["potenza_progetto_kw"]))
+            serie_kw = simulazione.pop("serie_kw", None)
+            if serie_kw is not None and potenza_dorsale_kw > 0 and serie_kw.max() > 0:
+                passo_sim = 15
+                profilo_dorsale = {
+                    "carico": np.minimum(profilo_da_serie(serie_kw, "giorno", passo_sim) / potenza_dorsale_kw, 1.0),
+                    "passo_min": passo_sim,
+                }
+
+        if linee_monofase and "trifase" in alim_dorsale.lower():
+            # contemporaneità (eventuale simulazione) applicata alla fase più caricata
+            contemp = potenza_dorsale_kw / sum(potenze)
+            bilanciamento = bilancia_fasi(
+                potenze, priorita=priorita_colonnine, cosphi=cosphi, tensione_fase_v=TENSIONE_MONOFASE_V
+            )
+            potenza_dorsale_kw = 3.0 * max(bilanciamento["potenza_fase_kw"].values()) * contemp
 
         dorsale = genera_progetto_ev(
             nome=nome,
@@ -727,7 +1176,7 @@ def genera_progetto_ev_multi(
             indirizzo=indirizzo,
             potenza_kw=potenza_dorsale_kw,
             distanza_m=float(distanza_dorsale_m),
-            alimentazione=alimentazione,
+            alimentazione=alim_dorsale,
             tipo_posa=tipo_posa,
             sistema=sistema,
             cosphi=cosphi,
@@ -751,6 +1200,12 @@ def genera_progetto_ev_multi(
             ul_v=ul_v,
             zs_ohm=zs_ohm,
             t_intervento_s=t_intervento_s,
+            tipo_cavo=tipo_cavo,
+            n_paralleli_max=n_paralleli_max,
+            curva_interruttore=curva_interruttore,
+            circuito_terminale=False,
+            profilo_ciclico=profilo_dorsale,
+            cache_stadi=(None if cache_stadi is None else cache_stadi.setdefault("dorsale", {})),
         )
 
     # ---------------------------
@@ -763,8 +1218,8 @@ def genera_progetto_ev_multi(
             nome=nome,
             cognome=cognome,
             indirizzo=indirizzo,
-            potenza_kw=float(potenza_kw),
-            distanza_m=float(distanza_linea_m),
+            potenza_kw=potenze[i - 1],
+            distanza_m=float(distanza_linea_m if distanze_linee_m is None else distanze_linee_m[i - 1]),
             alimentazione=alimentazione,
             tipo_posa=tipo_posa,
             sistema=sistema,
@@ -772,7 +1227,10 @@ def genera_progetto_ev_multi(
             temp_amb=temp_amb,
             temp_terreno=temp_terreno,
             rho_terreno_km_w=rho_terreno_km_w,
-            n_linee=(1 if arch_norm == "Linee separate dal contatore" else int(n_colonnine)),
+            n_linee=(
+                int(n_linee_per_linea[i - 1]) if n_linee_per_linea is not None
+                else (1 if arch_norm == "Linee separate dal contatore" else int(n_colonnine))
+            ),
             icc_ka=icc_ka,
             modo_ricarica=modo_ricarica,
             tipo_punto=tipo_punto,
@@ -789,41 +1247,83 @@ def genera_progetto_ev_multi(
             ul_v=ul_v,
             zs_ohm=zs_ohm,
             t_intervento_s=t_intervento_s,
+            tipo_cavo=tipo_cavo,
+            n_paralleli_max=n_paralleli_max,
+            impedenze_monte=(dorsale["cortocircuito"]["impedenze_fine"] if "cortocircuito" in dorsale else None),
+            curva_interruttore=curva_interruttore,
+            profilo_ciclico=profilo_ciclico_linee,
+            cache_stadi=(None if cache_stadi is None else cache_stadi.setdefault(i, {})),
         )
         r["colonnina_idx"] = i
+        if bilanciamento is not None:
+            r["fase"] = bilanciamento["assegnazione"][i - 1]
         linee.append(r)
 
     # ---------------------------
-    # Merge checklist (unione, dedup)
+    # Merge checklist (aggregazione con provenienza per linea)
     # ---------------------------
-    def _uniq(seq):
-        seen = set()
-        out = []
-        for x in seq:
-            if x not in seen:
-                seen.add(x)
-                out.append(x)
-        return out
-
-    ok_722 = _uniq(list(dorsale.get("ok_722", [])) + [x for rr in linee for x in rr.get("ok_722", [])])
-    warning_722 = _uniq(list(dorsale.get("warning_722", [])) + [x for rr in linee for x in rr.get("warning_722", [])])
-    nonconf_722 = _uniq(list(dorsale.get("nonconf_722", [])) + [x for rr in linee for x in rr.get("nonconf_722", [])])
+    sorgenti_722 = [("dorsale", dorsale)] + [(rr["colonnina_idx"], rr) for rr in linee]
+    ok_722, warning_722, nonconf_722, provenienza_722 = _aggrega_checklist_722(sorgenti_722)
 
     ok_441 = all([bool(dorsale.get("ok_441", False))] + [bool(rr.get("ok_441", False)) for rr in linee])
+    _, warning_441, nonconf_441, _ = _aggrega_checklist_722(sorgenti_722, "441")
+    ok_443, warning_443, nonconf_443, _ = _aggrega_checklist_722(sorgenti_722, "443")
+
+    # ---------------------------
+    # Cortocircuito su tutta la rete (dorsale + linee) in un solo passaggio
+    # ---------------------------
+    cortocircuito = _cortocircuito_multi(dorsale, linee, sistema, icc_ka, zs_ohm)
+
+    # ---------------------------
+    # Selettività dorsale -> linee (limite Is per ciascuna linea)
+    # ---------------------------
+    selettivita = None
+    testo_sel = ""
+    if "cortocircuito" in dorsale:
+        icc_linee = [rr["cortocircuito"]["icc_max_inizio_a"] for rr in linee]
+        sel = analisi_selettivita(
+            dorsale["curva_interruttore"],
+            dorsale["In_a"],
+            [rr["curva_interruttore"] for rr in linee],
+            [rr["In_a"] for rr in linee],
+            icc_linee,
+        )
+        selettivita = {
+            "curva_monte": sel["curva_monte"],
+            "In_monte_a": sel["In_monte_a"],
+            "n_totale": int(sel["totale"].sum()),
+            "linee": [
+                {
+                    "colonnina_idx": rr["colonnina_idx"],
+                    "totale": bool(t),
+                    "limite_a": None if t else round(float(lim), 0),
+                }
+                for rr, t, lim in zip(linee, sel["totale"], sel["limite_a"])
+            ],
+        }
+        testo_sel = testo_selettivita(sel, [f"colonnina {rr['colonnina_idx']}" for rr in linee], icc_linee)
 
     # ---------------------------
     # Testi combinati (relazione/unifilare/planimetria) per PDF unico
     # ---------------------------
+    if distanze_linee_m is None:
+        testo_dist_linee = f"{distanza_linea_m:.1f} m"
+    else:
+        testo_dist_linee = f"da percorso, {min(distanze_linee_m):.1f}–{max(distanze_linee_m):.1f} m"
+    if min(potenze) == max(potenze):
+        testo_potenza = f"{potenze[0]:.1f} kW"
+    else:
+        testo_potenza = f"per colonnina, {min(potenze):.1f}–{max(potenze):.1f} kW"
     header = dedent(f"""
     PROGETTO MULTI-COLONNINA
     =======================
     Architettura: {arch_norm}
     Numero colonnine: {n_colonnine}
-    Potenza per colonnina: {potenza_kw:.1f} kW
+    Potenza per colonnina: {testo_potenza}
     Potenza totale (dorsale): {potenza_dorsale_kw:.1f} kW
 
     Distanza dorsale (quadro principale -> sottoquadro): {distanza_dorsale_m:.1f} m\n    (N/A se 'Linee separate dal contatore')
-    Distanza linee (sottoquadro -> colonnina): {distanza_linea_m:.1f} m
+    Distanza linee (sottoquadro -> colonnina): {testo_dist_linee}
     """).strip()
 
     relazione = header + "\n\n" + dedent("""
@@ -835,16 +1335,33 @@ def genera_progetto_ev_multi(
     - Raggruppamento: se le linee condividono lo stesso percorso/cavidotto, il derating è considerato con n_linee = n_colonnine.
       Se le linee sono separate dal contatore (percorsi indipendenti), viene usato n_linee = 1 per ciascuna linea.
     """).strip()
+    if n_linee_per_linea is not None:
+        relazione += (
+            "\n- Raggruppamento per tratti: per ogni linea è usato il numero di circuiti del tratto di percorso"
+            " più affollato (n_linee da percorsi condivisi)."
+        )
+
+    if simulazione is not None:
+        relazione += "\n\n" + testo_simulazione(simulazione)
+    if bilanciamento is not None:
+        relazione += "\n\n" + testo_fasi(bilanciamento)
+    relazione += "\n\n" + testo_cortocircuito(cortocircuito)
+    if testo_sel:
+        relazione += "\n\n" + testo_sel
 
     relazione += "\n\n" + "=== DORSALE (QUADRO PRINCIPALE -> SOTTOQUADRO EV) ===\n" + dorsale.get("relazione", "")
     for rr in linee:
         relazione += "\n\n" + f"=== LINEA COLONNINA {rr['colonnina_idx']} (SOTTOQUADRO -> EVSE) ===\n" + rr.get("relazione", "")
 
     unifilare = header + "\n\n" + "=== SCHEMA DORSALE ===\n" + dorsale.get("unifilare", "")
+    if bilanciamento is not None:
+        unifilare += "\n\n" + testo_fasi(bilanciamento)
     for rr in linee:
         unifilare += "\n\n" + f"=== SCHEMA LINEA COLONNINA {rr['colonnina_idx']} ===\n" + rr.get("unifilare", "")
 
     planimetria = header + "\n\n" + "=== NOTE PERCORSO DORSALE ===\n" + dorsale.get("planimetria", "")
+    if planimetria_percorsi:
+        planimetria += "\n\n" + planimetria_percorsi
     for rr in linee:
         planimetria += "\n\n" + f"=== NOTE PERCORSO LINEA COLONNINA {rr['colonnina_idx']} ===\n" + rr.get("planimetria", "")
 
@@ -858,16 +1375,80 @@ def genera_progetto_ev_multi(
         "n_colonnine": int(n_colonnine),
         "dorsale": dorsale,
         "linee": linee,
+        "potenza_dorsale_kw": round(potenza_dorsale_kw, 2),
+        "simulazione_carichi": simulazione,
+        "bilanciamento_fasi": bilanciamento,
         "relazione": relazione,
         "unifilare": unifilare,
         "planimetria": planimetria,
         "ok_722": ok_722,
         "warning_722": warning_722,
         "nonconf_722": nonconf_722,
+        "provenienza_722": provenienza_722,
         "ok_441": ok_441,
+        "warning_441": warning_441,
+        "nonconf_441": nonconf_441,
+        "ok_443": ok_443,
+        "warning_443": warning_443,
+        "nonconf_443": nonconf_443,
+        "cortocircuito_rete": cortocircuito,
+        "selettivita": selettivita,
     })
     return base
 
+
+def _cortocircuito_multi(dorsale: dict, linee: list[dict], sistema: str, icc_ka: float, zs_ohm: float | None) -> list[dict]:
+    """
+    Icc max/min e Zs di dorsale e linee con un solo calcolo vettoriale sull'albero
+    (tratto 0 = dorsale, se presente; linee figlie della dorsale).
+    """
+    tratti = ([("Dorsale", dorsale)] if "cortocircuito" in dorsale else []) + [
+        (f"Linea colonnina {rr['colonnina_idx']}", rr) for rr in linee
+    ]
+    ha_dorsale = "cortocircuito" in dorsale
+    padre, lung, r_f, x_f, r_pe, x_pe, tri, u0, alfa = [], [], [], [], [], [], [], [], []
+    for j, (_, r) in enumerate(tratti):
+        tipo_posa = r["tipo_posa"]
+        a, b = impedenza_tratto(r["tipo_cavo"], tipo_posa, r["sezione_mm2"], r["n_paralleli"])
+        c, d = impedenza_tratto(r["tipo_cavo"], tipo_posa, r["sezione_pe_mm2"], r["n_paralleli"])
+        padre.append(0 if (ha_dorsale and j > 0) else -1)
+        lung.append(r["distanza_m"])
+        r_f.append(a)
+        x_f.append(b)
+        r_pe.append(c)
+        x_pe.append(d)
+        tri.append(r["tensione_v"] == 400)
+        u0.append(r["tensione_v"] / math.sqrt(3) if tri[-1] else r["tensione_v"])
+        alfa.append(alfa_cavo(r["tipo_cavo"]))
+    rete = cortocircuito_rete(
+        padre, lung, r_f, x_f, r_pe, x_pe, tri,
+        icc_ka=icc_ka,
+        tensione_fase_v=u0,
+        tn=not sistema.strip().upper().startswith("TT"),
+        alfa_r=alfa,
+        zs_monte_ohm=zs_ohm,
+        sorgente_trifase=tri[0],
+    )
+    # tempi di intervento alla corrente di guasto U0/Zs, vettoriali per curva
+    t_guasto = np.full(len(tratti), np.inf)
+    curve = np.array([r["curva_interruttore"] for _, r in tratti])
+    In = np.array([float(r["In_a"]) for _, r in tratti])
+    ig = np.asarray(u0) / rete["zs_fine_ohm"]
+    for c in np.unique(curve):
+        m = curve == c
+        t_guasto[m] = tempo_intervento(str(c), In[m], ig[m])
+    return [
+        {
+            "nome": nome,
+            "icc_max_inizio_a": round(float(rete["icc_max_inizio_a"][j]), 1),
+            "icc_max_fine_a": round(float(rete["icc_max_fine_a"][j]), 1),
+            "icc_min_fine_a": round(float(rete["icc_min_fine_a"][j]), 1),
+            "zs_fine_ohm": round(float(rete["zs_fine_ohm"][j]), 4),
+            "t_guasto_s": round(float(t_guasto[j]), 3),
+        }
+        for j, (nome, _) in enumerate(tratti)
+    ]
+
 def _fattore_rho_terreno(rho_km_w: float | None) -> tuple[float, float]:
     """
     Restituisce (k_rho, rho_usata). Riferimento tipico ρ=2.5 K·m/W.
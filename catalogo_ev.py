@@ -0,0 +1,176 @@
+"""
+Catalogo cavi e interruttori (file dati catalogo_cavi.json).
+
+Al caricamento il JSON viene validato e compilato in tuple ordinate per
+(tipo cavo, posa): sezioni, portate base, R20 e X. La forma compilata è
+salvata in una cache binaria (pickle in __pycache__, chiave = hash del JSON)
+per un avvio rapido; se la cache manca o non è scrivibile si ricompila.
+
+Il catalogo restituito è immutabile (MappingProxyType e tuple) e il caricamento
+pigro è protetto da un lock: può essere letto da più thread contemporaneamente.
+
+La scelta di In è una ricerca binaria (bisect) sulle tuple ordinate; la
+scelta della sezione (con i conduttori in parallelo) è in
+caduta_tensione_ev.candidati / indice_scelta, sulle stesse tabelle.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from bisect import bisect_left
+from types import MappingProxyType
+
+FILE_CATALOGO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalogo_cavi.json")
+CAVO_DEFAULT = "FG16(O)R16"
+
+_VERSIONE_CACHE = 1
+_catalogo = None
+_lock_catalogo = threading.Lock()
+
+
+def _compila(dati: dict) -> dict:
+    """Valida il JSON e lo trasforma in strutture immutabili ordinate."""
+    interruttori = tuple(sorted(int(x) for x in dati["interruttori_a"]))
+    posa = {nome: {"interrata": bool(v.get("interrata", False)), "descrizione": v.get("descrizione", nome)}
+            for nome, v in dati["posa"].items()}
+    paralleli = tuple(sorted((int(n), float(k)) for n, k in dati.get("fattore_paralleli", {"1": 1.0}).items()))
+
+    cavi = {}
+    tabelle = {}
+    for nome, c in dati["cavi"].items():
+        sez = [float(s) for s in c["sezioni"]]
+        n = len(sez)
+        for campo in ("r20_ohm_km", "x_ohm_km"):
+            if len(c[campo]) != n:
+                raise ValueError(f"Catalogo: {nome}.{campo} deve avere {n} valori.")
+        ordine = sorted(range(n), key=lambda i: sez[i])
+        cavi[nome] = {
+            "descrizione": c.get("descrizione", nome),
+            "materiale": c.get("materiale", "rame"),
+            "conducibilita": float(c["conducibilita"]),
+            "k_i2t": float(c["k_i2t"]),
+        }
+        for nome_posa, portate in c["portate"].items():
+            if nome_posa not in posa:
+                raise ValueError(f"Catalogo: posa '{nome_posa}' del cavo {nome} non definita.")
+            if len(portate) != n:
+                raise ValueError(f"Catalogo: {nome}/{nome_posa} deve avere {n} portate.")
+            iz = [float(portate[i]) for i in ordine]
+            if any(b < a for a, b in zip(iz, iz[1:])):
+                raise ValueError(f"Catalogo: portate non crescenti con la sezione per {nome}/{nome_posa}.")
+            tabelle[(nome, nome_posa)] = {
+                "sezioni": tuple(int(sez[i]) if sez[i].is_integer() else sez[i] for i in ordine),
+                "iz": tuple(iz),
+                "r20_ohm_km": tuple(float(c["r20_ohm_km"][i]) for i in ordine),
+                "x_ohm_km": tuple(float(c["x_ohm_km"][i]) for i in ordine),
+            }
+    return {
+        "interruttori": interruttori,
+        "posa": posa,
+        "paralleli": paralleli,
+        "cavi": cavi,
+        "tabelle": tabelle,
+        "note": dati.get("note", ""),
+    }
+
+
+def _congela(v):
+    """Copia in sola lettura: dict -> MappingProxyType, list -> tuple (ricorsivo)."""
+    if isinstance(v, dict):
+        return MappingProxyType({k: _congela(x) for k, x in v.items()})
+    if isinstance(v, (list, tuple)):
+        return tuple(_congela(x) for x in v)
+    return v
+
+
+def carica_catalogo(percorso: str | None = None, usa_cache: bool = True) -> dict:
+    """Carica (e compila) il catalogo, usando la cache binaria se valida. Risultato in sola lettura."""
+    percorso = percorso or FILE_CATALOGO
+    with open(percorso, "rb") as f:
+        grezzo = f.read()
+    firma = hashlib.sha256(grezzo).hexdigest()[:16]
+    cache = os.path.join(os.path.dirname(percorso), "__pycache__", f"catalogo_cavi.{firma}.v{_VERSIONE_CACHE}.pickle")
+
+    if usa_cache and os.path.exists(cache):
+        try:
+            with open(cache, "rb") as f:
+                return _congela(pickle.load(f))
+        except Exception:
+            pass  # cache corrotta: si ricompila
+
+    compilato = _compila(json.loads(grezzo.decode("utf-8")))
+    if usa_cache:
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok=True)
+            tmp = f"{cache}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(compilato, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache)
+        except OSError:
+            pass  # file system in sola lettura: nessuna cache
+    return _congela(compilato)
+
+
+def catalogo() -> dict:
+    """Catalogo di default (caricato una sola volta per processo)."""
+    global _catalogo
+    if _catalogo is None:
+        with _lock_catalogo:
+            if _catalogo is None:
+                _catalogo = carica_catalogo()
+    return _catalogo
+
+
+def tipi_cavo() -> list[str]:
+    return list(catalogo()["cavi"].keys())
+
+
+def tipi_posa(tipo_cavo: str = CAVO_DEFAULT) -> list[str]:
+    return [p for (c, p) in catalogo()["tabelle"] if c == tipo_cavo]
+
+
+def posa_interrata(tipo_posa: str) -> bool:
+    """True se la posa è interrata (fattori terreno: temperatura 20 °C e resistività ρ)."""
+    p = catalogo()["posa"].get(tipo_posa)
+    return bool(p and p["interrata"])
+
+
+def dati_cavo(tipo_cavo: str) -> dict:
+    c = catalogo()["cavi"].get(tipo_cavo)
+    if c is None:
+        raise ValueError(f"Tipo cavo non presente in catalogo: {tipo_cavo}")
+    return c
+
+
+def tabella(tipo_cavo: str, tipo_posa: str) -> dict:
+    t = catalogo()["tabelle"].get((tipo_cavo, tipo_posa))
+    if t is None:
+        raise ValueError(f"Tipo posa non gestito per {tipo_cavo}: {tipo_posa}")
+    return t
+
+
+def fattore_paralleli(n: int) -> float:
+    for k, v in catalogo()["paralleli"]:
+        if k == n:
+            return v
+    raise ValueError(f"Numero conduttori in parallelo non gestito: {n}")
+
+
+def n_paralleli_ammessi() -> list[int]:
+    return [k for k, _ in catalogo()["paralleli"]]
+
+
+def seleziona_interruttore(ib: float) -> int | None:
+    """Taglia minima In ≥ Ib (ricerca binaria)."""
+    tagli = catalogo()["interruttori"]
+    i = bisect_left(tagli, ib)
+    return tagli[i] if i < len(tagli) else None
+
+
+def portata_base(tipo_cavo: str, tipo_posa: str) -> dict:
+    """Tabella {sezione: Iz_base} (formato di PORTATA_BASE)."""
+    t = tabella(tipo_cavo, tipo_posa)
+    return dict(zip(t["sezioni"], (int(x) if float(x).is_integer() else x for x in t["iz"])))
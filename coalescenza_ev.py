@@ -0,0 +1,127 @@
+"""
+Coalescenza di chiamate identiche concorrenti ("single flight").
+
+Quando più sessioni chiedono nello stesso momento lo stesso calcolo (stessi
+input canonicalizzati), solo la prima lo esegue: le altre attendono il lavoro
+in corso e ne ricevono una copia del risultato (o la stessa eccezione).
+Terminato il lavoro la chiave è liberata: non è una cache, una richiesta
+successiva ricalcola.
+
+- SingoloVolo.esegui: chiamata sincrona (calcolo del progetto).
+- SingoloVolo.condividi / rilascia: lavori in background già avviati
+  (es. documenti_ev.avvia_pdf_background) condivisi per conteggio degli
+  utenti; il lavoro è annullato solo quando l'ultimo utente lo abbandona.
+
+Le metriche (chiamate, eseguite, coalescenti, errori) sono per istanza.
+"""
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import threading
+from collections.abc import Mapping
+from concurrent.futures import Future
+from typing import Callable
+
+
+def _canonico(v):
+    if isinstance(v, bool) or v is None or isinstance(v, str):
+        return v
+    if isinstance(v, (int, float)):
+        return float(v)
+    if isinstance(v, Mapping):
+        return {str(k): _canonico(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_canonico(x) for x in v]
+    if hasattr(v, "tolist"):  # numpy
+        return _canonico(v.tolist())
+    return repr(v)
+
+
+def chiave_canonica(*parti) -> str:
+    """Hash stabile degli input: chiavi ordinate, 22 e 22.0 equivalenti, tuple = liste."""
+    testo = json.dumps([_canonico(p) for p in parti], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(testo.encode("utf-8")).hexdigest()
+
+
+class SingoloVolo:
+    """Registro thread-safe dei lavori in volo, per chiave."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_volo: dict[str, Future] = {}
+        self._condivisi: dict[str, list] = {}  # chiave -> [lavoro, utenti, annulla]
+        self._metriche = {"chiamate": 0, "eseguite": 0, "coalescenti": 0, "errori": 0}
+
+    def metriche(self) -> dict:
+        with self._lock:
+            return {**self._metriche, "in_volo": len(self._in_volo) + len(self._condivisi)}
+
+    def esegui(self, chiave: str, funz: Callable, *args, **kwargs):
+        """
+        funz(*args, **kwargs) una sola volta per le chiamate concorrenti con la stessa chiave.
+        Ogni chiamante riceve una copia profonda del risultato (può modificarla liberamente).
+        """
+        with self._lock:
+            self._metriche["chiamate"] += 1
+            fut = self._in_volo.get(chiave)
+            primo = fut is None
+            if primo:
+                fut = self._in_volo[chiave] = Future()
+                self._metriche["eseguite"] += 1
+            else:
+                self._metriche["coalescenti"] += 1
+        if primo:
+            try:
+                fut.set_result(funz(*args, **kwargs))
+            except BaseException as e:
+                fut.set_exception(e)
+                with self._lock:
+                    self._metriche["errori"] += 1
+            finally:
+                with self._lock:
+                    del self._in_volo[chiave]
+        return copy.deepcopy(fut.result())
+
+    def condividi(self, chiave: str, avvia: Callable[[], dict], annulla: Callable[[dict], None]) -> dict:
+        """
+        Lavoro in background condiviso: se per la chiave ce n'è uno in corso lo restituisce,
+        altrimenti lo crea con avvia() (dizionario con "future"). Va abbinato a rilascia().
+        """
+        with self._lock:
+            self._metriche["chiamate"] += 1
+            voce = self._condivisi.get(chiave)
+            nuovo = voce is None
+            if nuovo:
+                voce = self._condivisi[chiave] = [avvia(), 0, annulla]
+                self._metriche["eseguite"] += 1
+            else:
+                self._metriche["coalescenti"] += 1
+            voce[1] += 1
+            lavoro = voce[0]
+        if nuovo:
+            # fuori dal lock: se il lavoro è già concluso il callback gira subito qui
+            lavoro["future"].add_done_callback(lambda f: self._concluso(chiave, lavoro, f))
+        return lavoro
+
+    def _concluso(self, chiave: str, lavoro: dict, fut: Future):
+        with self._lock:
+            voce = self._condivisi.get(chiave)
+            if voce is not None and voce[0] is lavoro:
+                del self._condivisi[chiave]
+            if not fut.cancelled() and fut.exception() is not None and voce is not None:
+                self._metriche["errori"] += 1
+
+    def rilascia(self, lavoro: dict) -> bool:
+        """Un utente abbandona il lavoro; l'ultimo lo annulla. True se annullato."""
+        with self._lock:
+            voce = next((v for v in self._condivisi.values() if v[0] is lavoro), None)
+            if voce is None:
+                return False
+            voce[1] -= 1
+            if voce[1] > 0:
+                return False
+            self._condivisi = {c: v for c, v in self._condivisi.items() if v is not voce}
+        voce[2](lavoro)
+        return True
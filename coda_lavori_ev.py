@@ -0,0 +1,292 @@
+"""
+Coda lavori persistente (SQLite) per lotti lunghi di calcoli e PDF.
+
+Tipi di lavoro (le funzioni del motore sono chiamate senza modificarne la firma):
+- "calcolo": genera_progetto_ev(**parametri)
+- "calcolo_multi": genera_progetto_ev_multi(**parametri)
+- "pdf": scrivi_pdf_unico su file (parametri di genera_pdf_unico_bytes)
+
+La chiave di un lavoro è l'hash SHA-256 di tipo e parametri canonicalizzati:
+accodare due volte lo stesso input non crea un secondo lavoro e un lotto
+rilanciato salta i lavori già conclusi. Ogni lavoro concluso è registrato
+subito nel database (checkpoint): se il processo muore, al riavvio i lavori
+rimasti "in_corso" tornano in coda e si riparte da dove ci si era fermati.
+Un calcolo accodato con pdf=True, una volta concluso, accoda il proprio PDF.
+
+Gli errori di input del motore (ValueError/TypeError: stessi input, stesso
+errore) chiudono subito il lavoro in "errore"; gli altri (I/O, memoria, ...)
+sono ritentati con attesa esponenziale fino a max_tentativi.
+
+Uso da riga di comando:
+    python coda_lavori_ev.py accoda lotto.db portafoglio.csv --pdf
+    python coda_lavori_ev.py esegui lotto.db --processi 4
+    python coda_lavori_ev.py stato lotto.db
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import sqlite3
+import time
+
+from calcolo_ev import genera_progetto_ev, genera_progetto_ev_multi
+from documenti_ev import scrivi_pdf_unico
+from portafoglio_ev import leggi_portafoglio, parametri_pdf, valida_portafoglio
+
+TIPI_LAVORO = ("calcolo", "calcolo_multi", "pdf")
+STATI = ("in_coda", "in_corso", "fatto", "errore")
+ERRORI_DEFINITIVI = (ValueError, TypeError, KeyError)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lavori (
+    chiave TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    parametri TEXT NOT NULL,
+    pdf INTEGER NOT NULL DEFAULT 0,
+    stato TEXT NOT NULL DEFAULT 'in_coda',
+    tentativi INTEGER NOT NULL DEFAULT 0,
+    prossimo_tentativo REAL NOT NULL DEFAULT 0,
+    risultato TEXT,
+    errore TEXT,
+    worker INTEGER,
+    creato REAL NOT NULL,
+    iniziato REAL,
+    completato REAL
+);
+CREATE INDEX IF NOT EXISTS lavori_pronti ON lavori (stato, prossimo_tentativo, creato);
+"""
+
+
+def _json(v) -> str:
+    """JSON canonico (chiavi ordinate); array NumPy e scalari convertiti in liste/numeri."""
+    return json.dumps(v, sort_keys=True, ensure_ascii=False, default=lambda o: o.tolist() if hasattr(o, "tolist") else str(o))
+
+
+def chiave_lavoro(tipo: str, parametri: dict) -> str:
+    """Chiave idempotente: hash di tipo e parametri canonicalizzati."""
+    return hashlib.sha256(_json({"tipo": tipo, "parametri": parametri}).encode("utf-8")).hexdigest()
+
+
+def apri_coda(percorso_db: str) -> sqlite3.Connection:
+    """Apre (e crea se serve) il database della coda; WAL per lettori e scrittori concorrenti."""
+    con = sqlite3.connect(percorso_db, timeout=60, isolation_level=None)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.executescript(_SCHEMA)
+    return con
+
+
+def accoda(con: sqlite3.Connection, tipo: str, parametri: dict, pdf: bool = False) -> str:
+    """Accoda un lavoro se non esiste già (stessa chiave); restituisce la chiave."""
+    if tipo not in TIPI_LAVORO:
+        raise ValueError(f"Tipo lavoro non gestito: {tipo}")
+    chiave = chiave_lavoro(tipo, parametri)
+    con.execute(
+        "INSERT OR IGNORE INTO lavori (chiave, tipo, parametri, pdf, creato) VALUES (?, ?, ?, ?, ?)",
+        (chiave, tipo, _json(parametri), int(bool(pdf)), time.time()),
+    )
+    return chiave
+
+
+def riprendi(con: sqlite3.Connection) -> int:
+    """Riporta in coda i lavori rimasti "in_corso" da un'esecuzione interrotta; restituisce quanti."""
+    return con.execute("UPDATE lavori SET stato = 'in_coda', worker = NULL WHERE stato = 'in_corso'").rowcount
+
+
+def _prendi(con: sqlite3.Connection, worker: int):
+    """Assegna atomicamente al worker il primo lavoro pronto (None se nessuno)."""
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        riga = con.execute(
+            "SELECT chiave, tipo, parametri, pdf, tentativi FROM lavori"
+            " WHERE stato = 'in_coda' AND prossimo_tentativo <= ? ORDER BY creato LIMIT 1",
+            (time.time(),),
+        ).fetchone()
+        if riga is not None:
+            con.execute(
+                "UPDATE lavori SET stato = 'in_corso', worker = ?, iniziato = ? WHERE chiave = ?",
+                (worker, time.time(), riga[0]),
+            )
+        con.execute("COMMIT")
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return riga
+
+
+def _esegui_lavoro(con, tipo: str, parametri: dict, pdf: bool, cartella_pdf: str, chiave: str) -> dict:
+    if tipo == "pdf":
+        os.makedirs(cartella_pdf, exist_ok=True)
+        nome = parametri.pop("file", None) or f"{chiave[:16]}.pdf"
+        percorso = os.path.join(cartella_pdf, nome)
+        provvisorio = percorso + ".parziale"
+        scrivi_pdf_unico(provvisorio, **parametri)
+        os.replace(provvisorio, percorso)  # il PDF esiste solo se completo
+        return {"file": percorso, "byte": os.path.getsize(percorso)}
+
+    res = genera_progetto_ev_multi(**parametri) if tipo == "calcolo_multi" else genera_progetto_ev(**parametri)
+    if pdf:
+        accoda(con, "pdf", {**parametri_pdf(res, parametri), "file": f"{chiave[:16]}.pdf"})
+    return res
+
+
+def _worker(percorso_db: str, cartella_pdf: str, max_tentativi: int, backoff_s: float, attesa_s: float):
+    """Ciclo di un processo worker: prende lavori finché la coda non è vuota."""
+    con = apri_coda(percorso_db)
+    pid = os.getpid()
+    while True:
+        riga = _prendi(con, pid)
+        if riga is None:
+            attivi = con.execute("SELECT COUNT(*) FROM lavori WHERE stato IN ('in_coda', 'in_corso')").fetchone()[0]
+            if attivi == 0:
+                return
+            time.sleep(attesa_s)  # lavori in attesa di ritentativo o figli (PDF) ancora da accodare
+            continue
+        chiave, tipo, parametri, pdf, tentativi = riga
+        try:
+            risultato = _esegui_lavoro(con, tipo, json.loads(parametri), bool(pdf), cartella_pdf, chiave)
+        except Exception as e:
+            tentativi += 1
+            errore = f"{type(e).__name__}: {e}"
+            if isinstance(e, ERRORI_DEFINITIVI) or tentativi >= max_tentativi:
+                con.execute(
+                    "UPDATE lavori SET stato = 'errore', tentativi = ?, errore = ?, completato = ? WHERE chiave = ?",
+                    (tentativi, errore, time.time(), chiave),
+                )
+            else:
+                con.execute(
+                    "UPDATE lavori SET stato = 'in_coda', tentativi = ?, errore = ?, prossimo_tentativo = ?, worker = NULL"
+                    " WHERE chiave = ?",
+                    (tentativi, errore, time.time() + backoff_s * 2 ** (tentativi - 1), chiave),
+                )
+            continue
+        # checkpoint: il lavoro concluso è registrato prima di prendere il successivo
+        con.execute(
+            "UPDATE lavori SET stato = 'fatto', risultato = ?, errore = NULL, completato = ? WHERE chiave = ?",
+            (_json(risultato), time.time(), chiave),
+        )
+
+
+def _recupera_worker(con: sqlite3.Connection, pid: int, exitcode: int, max_tentativi: int, backoff_s: float) -> None:
+    """Lavoro di un worker terminato in modo anomalo (crash, kill): conta il tentativo e lo rimette in coda."""
+    con.execute(
+        "UPDATE lavori SET tentativi = tentativi + 1, errore = ?, worker = NULL,"
+        " stato = CASE WHEN tentativi + 1 >= ? THEN 'errore' ELSE 'in_coda' END,"
+        " prossimo_tentativo = ? + ? * (1 << tentativi), completato = CASE WHEN tentativi + 1 >= ? THEN ? END"
+        " WHERE stato = 'in_corso' AND worker = ?",
+        (f"worker terminato (exit {exitcode})", max_tentativi, time.time(), backoff_s, max_tentativi, time.time(), pid),
+    )
+
+
+def stato_coda(con: sqlite3.Connection, finestra_s: float = 300.0) -> dict:
+    """
+    Profondità della coda e throughput: conteggi per stato e per tipo, lavori conclusi
+    al minuto nell'ultima finestra_s e durata media dei lavori conclusi.
+    """
+    per_stato = dict.fromkeys(STATI, 0)
+    per_stato.update(dict(con.execute("SELECT stato, COUNT(*) FROM lavori GROUP BY stato").fetchall()))
+    per_tipo = {
+        f"{t}/{s}": n for t, s, n in con.execute("SELECT tipo, stato, COUNT(*) FROM lavori GROUP BY tipo, stato")
+    }
+    ora = time.time()
+    recenti, durata = con.execute(
+        "SELECT COUNT(*), AVG(completato - iniziato) FROM lavori WHERE stato = 'fatto' AND completato >= ?",
+        (ora - finestra_s,),
+    ).fetchone()
+    return {
+        **per_stato,
+        "profondita": per_stato["in_coda"] + per_stato["in_corso"],
+        "per_tipo": per_tipo,
+        "lavori_al_minuto": round(recenti * 60.0 / finestra_s, 2),
+        "durata_media_s": round(durata or 0.0, 3),
+    }
+
+
+def esegui_coda(
+    percorso_db: str,
+    n_processi: int | None = None,
+    cartella_pdf: str | None = None,
+    max_tentativi: int = 4,
+    backoff_s: float = 2.0,
+    attesa_s: float = 0.5,
+    report=None,
+    intervallo_report_s: float = 5.0,
+) -> dict:
+    """
+    Esegue la coda con n_processi worker fino a esaurimento, riprendendo i lavori
+    interrotti. report(stato_coda) è chiamato ogni intervallo_report_s. Una sola
+    esecuzione per database alla volta. Restituisce lo stato finale della coda.
+    """
+    n_processi = int(n_processi or os.cpu_count() or 1)
+    cartella_pdf = cartella_pdf or os.path.splitext(percorso_db)[0] + "_pdf"
+    con = apri_coda(percorso_db)
+    riprendi(con)
+    argomenti = (percorso_db, cartella_pdf, max_tentativi, backoff_s, attesa_s)
+    processi = [mp.Process(target=_worker, args=argomenti, daemon=True) for _ in range(n_processi)]
+    for p in processi:
+        p.start()
+    try:
+        while any(p.is_alive() for p in processi):
+            for p in processi:
+                p.join(timeout=intervallo_report_s / len(processi))
+            for i, p in enumerate(processi):
+                if not p.is_alive() and p.exitcode != 0:
+                    # worker caduto: il suo lavoro torna in coda e un nuovo worker prende il suo posto
+                    _recupera_worker(con, p.pid, p.exitcode, max_tentativi, backoff_s)
+                    processi[i] = mp.Process(target=_worker, args=argomenti, daemon=True)
+                    processi[i].start()
+            if report is not None:
+                report(stato_coda(con))
+    finally:
+        for p in processi:
+            if p.is_alive():
+                p.terminate()
+    return stato_coda(con)
+
+
+def _main(argv=None):
+    ap = argparse.ArgumentParser(description="Coda lavori persistente per calcoli e PDF EV.")
+    sub = ap.add_subparsers(dest="comando", required=True)
+    a = sub.add_parser("accoda", help="accoda i siti di un portafoglio CSV/XLSX")
+    a.add_argument("db")
+    a.add_argument("portafoglio")
+    a.add_argument("--pdf", action="store_true", help="genera anche il PDF di ogni sito")
+    e = sub.add_parser("esegui", help="esegue la coda (riprende i lavori interrotti)")
+    e.add_argument("db")
+    e.add_argument("--processi", type=int, default=None)
+    e.add_argument("--cartella-pdf", default=None)
+    e.add_argument("--max-tentativi", type=int, default=4)
+    s = sub.add_parser("stato", help="profondità della coda e throughput")
+    s.add_argument("db")
+    args = ap.parse_args(argv)
+
+    if args.comando == "accoda":
+        con = apri_coda(args.db)
+        with open(args.portafoglio, "rb") as f:
+            righe = leggi_portafoglio(args.portafoglio, f.read())
+        n_ok = 0
+        for sito in valida_portafoglio(righe):
+            if sito["errori"]:
+                print(f"Riga {sito['riga']} scartata: {'; '.join(sito['errori'])}")
+                continue
+            accoda(con, "calcolo_multi" if sito["multi"] else "calcolo", sito["parametri"], pdf=args.pdf)
+            n_ok += 1
+        print(f"Accodati {n_ok} siti su {len(righe)}.")
+    elif args.comando == "esegui":
+        finale = esegui_coda(
+            args.db, args.processi, args.cartella_pdf, args.max_tentativi,
+            report=lambda st: print(
+                f"in coda {st['in_coda']} | in corso {st['in_corso']} | fatti {st['fatto']} | errori {st['errore']}"
+                f" | {st['lavori_al_minuto']} lavori/min", flush=True,
+            ),
+        )
+        print(json.dumps(finale, ensure_ascii=False))
+    else:
+        print(json.dumps(stato_coda(apri_coda(args.db)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    _main()
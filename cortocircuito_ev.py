@@ -0,0 +1,317 @@
+"""
+Correnti di cortocircuito e impedenza dell'anello di guasto su tutta la rete.
+
+La rete è un albero di tratti di cavo (dorsale, linee, sottolinee): per ogni
+tratto i si indica il tratto a monte padre[i] (-1 = origine al quadro). Da Icc
+presunta all'origine si ricava l'impedenza della sorgente e la si propaga lungo
+l'albero con le R/X per km del catalogo cavi:
+
+- Icc max (inizio e fine tratto): R a 20 °C, c_max; trifase = guasto simmetrico,
+  monofase = fase-neutro (neutro di pari sezione);
+- Icc min (fine tratto): R alla temperatura di fine guasto, c_min; fase-neutro e,
+  nei sistemi TN, anche fase-PE (si prende la minore);
+- Zs (fine tratto): impedenza dell'anello fase-PE a caldo.
+
+Le somme lungo i percorsi sono calcolate con pointer jumping su array NumPy
+(O(log profondità) passi vettoriali), anche su lotti di reti con la stessa
+topologia (array (..., n_tratti)).
+"""
+from __future__ import annotations
+
+import math
+from bisect import bisect_left
+from types import MappingProxyType
+
+import numpy as np
+
+from catalogo_ev import dati_cavo, tabella
+from curve_intervento_ev import (
+    corrente_intervento,
+    curva_per_in,
+    tempo_max_interruzione,
+    verifica_interruzione,
+)
+
+# Fattori di tensione (IEC 60909, bassa tensione con tolleranza +10%)
+C_MAX = 1.10
+C_MIN = 0.95
+# Rapporto R/X della sorgente (IEC 60909: RQ = 0,1·XQ)
+RX_SORGENTE = 0.1
+# Temperatura di fine guasto per Icc min: R ≈ 1,5·R20 (metodo convenzionale)
+TEMP_CC_MIN = 145.0
+# Coefficiente di temperatura della resistenza per materiale [1/°C]
+ALFA_R = MappingProxyType({"rame": 0.00393, "alluminio": 0.00403})
+
+
+def somma_percorsi(valori, padre) -> np.ndarray:
+    """
+    Somma radice → nodo dei valori di tratto su un albero.
+
+    valori: array (..., n) (anche complesso); padre: array (n,) con -1 alla radice.
+    Pointer jumping: ad ogni passo ciascun nodo aggiunge la somma accumulata dal
+    suo antenato corrente e salta all'antenato di quest'ultimo.
+    """
+    v = np.array(valori, copy=True)
+    p = np.asarray(padre, dtype=np.int64).copy()
+    if p.ndim != 1 or v.shape[-1] != p.shape[0]:
+        raise ValueError("padre: serve un indice (o -1) per ciascun tratto.")
+    if np.any(p >= p.shape[0]) or np.any(p < -1):
+        raise ValueError("padre: indice di tratto non valido.")
+    attivi = p >= 0
+    passi = 0
+    while attivi.any():
+        idx = np.where(attivi, p, 0)
+        v = v + np.where(attivi, v[..., idx], 0)
+        p = np.where(attivi, p[idx], -1)
+        attivi = p >= 0
+        passi += 1
+        if passi > 64:
+            raise ValueError("padre: la rete contiene un ciclo.")
+    return v
+
+
+def impedenza_tratto(tipo_cavo: str, tipo_posa: str, sezione, n_paralleli: int = 1) -> tuple[float, float]:
+    """
+    (R20, X) per km del tratto [Ω/km] dal catalogo, con n conduttori in parallelo.
+
+    Sezioni non a catalogo (es. PE = S/2): R scalata dalla sezione a catalogo più
+    vicina (R·S ≈ costante), X della stessa sezione.
+    """
+    t = tabella(tipo_cavo, tipo_posa)
+    sez = t["sezioni"]
+    i = min(bisect_left(sez, sezione), len(sez) - 1)
+    if i > 0 and abs(sez[i - 1] - sezione) <= abs(sez[i] - sezione):
+        i -= 1
+    n = max(1, int(n_paralleli))
+    return t["r20_ohm_km"][i] * sez[i] / float(sezione) / n, t["x_ohm_km"][i] / n
+
+
+def cortocircuito_rete(
+    padre,
+    lunghezza_m,
+    r_fase_ohm_km,
+    x_fase_ohm_km,
+    r_pe_ohm_km,
+    x_pe_ohm_km,
+    trifase,
+    icc_ka=6.0,
+    tensione_fase_v=230.0,
+    tn: bool = False,
+    alfa_r=ALFA_R["rame"],
+    temp_cc_min: float = TEMP_CC_MIN,
+    impedenze_monte: dict | None = None,
+    zs_monte_ohm=None,
+    sorgente_trifase: bool = True,
+) -> dict:
+    """
+    Icc max/min e Zs per ogni tratto della rete in un solo passaggio vettoriale.
+
+    Tutti gli array per tratto hanno forma (..., n); icc_ka, zs_monte_ohm possono
+    avere forma (...) per lotti. trifase: bool per tratto (monofase = fase-neutro).
+    tensione_fase_v: U0 unica o per tratto; l'impedenza della sorgente usa U0 del
+      primo tratto all'origine.
+    impedenze_monte: impedenze all'origine (formato "impedenze_fine" di un calcolo
+      precedente, es. fine dorsale); se presente sostituisce Icc presunta.
+    zs_monte_ohm: impedenza anello di guasto misurata all'origine (se disponibile).
+    sorgente_trifase: Icc presunta trifase (guasto simmetrico) oppure, per forniture
+      monofase, fase-neutro.
+
+    Restituisce array (..., n) in A/Ω: icc_max_inizio_a, icc_max_fine_a,
+    icc_min_fine_a, zs_fine_ohm, più "impedenze_fine" (R/X a fine tratto di fase
+    a 20 °C, anello fase-neutro a 20 °C e a caldo, anello fase-PE a caldo),
+    riutilizzabili come impedenze_monte).
+    """
+    padre = np.asarray(padre, dtype=np.int64)
+    L = np.asarray(lunghezza_m, dtype=float) / 1000.0
+    if np.any(L <= 0):
+        raise ValueError("Le lunghezze dei tratti devono essere > 0.")
+    tri = np.broadcast_to(np.asarray(trifase, dtype=bool), L.shape)
+    u0 = np.broadcast_to(np.asarray(tensione_fase_v, dtype=float), L.shape)
+    u0_sorgente = u0[..., int(np.flatnonzero(padre < 0)[0])][..., None]
+    k_caldo = 1.0 + np.asarray(alfa_r, dtype=float) * (temp_cc_min - 20.0)
+
+    z_fase = (np.asarray(r_fase_ohm_km, dtype=float) + 1j * np.asarray(x_fase_ohm_km, dtype=float)) * L
+    z_fase_caldo = (np.asarray(r_fase_ohm_km, dtype=float) * k_caldo + 1j * np.asarray(x_fase_ohm_km, dtype=float)) * L
+    z_pe_caldo = (np.asarray(r_pe_ohm_km, dtype=float) * k_caldo + 1j * np.asarray(x_pe_ohm_km, dtype=float)) * L
+
+    # ---------------------------
+    # Origine: sorgente (Icc presunta) oppure impedenze a monte note
+    # ---------------------------
+    if impedenze_monte is not None:
+        def _z(nome):
+            return (np.asarray(impedenze_monte[f"r_{nome}_ohm"], dtype=float)
+                    + 1j * np.asarray(impedenze_monte[f"x_{nome}_ohm"], dtype=float))[..., None]
+        zq, zq_fn20, zq_fn, zq_pe = _z("fase"), _z("fn20"), _z("fn"), _z("pe")
+    else:
+        icc = np.asarray(icc_ka, dtype=float)[..., None] * 1000.0
+        if np.any(icc <= 0):
+            raise ValueError("Icc presunta deve essere > 0.")
+        zq_mod = C_MAX * u0_sorgente / icc
+        xq = zq_mod / math.sqrt(1.0 + RX_SORGENTE ** 2)
+        zq = RX_SORGENTE * xq + 1j * xq
+        if not sorgente_trifase:
+            zq = zq / 2.0
+        zq_fn20 = zq_fn = zq_pe = 2.0 * zq
+    if zs_monte_ohm is not None:
+        zq_pe = np.asarray(zs_monte_ohm, dtype=float)[..., None] + 0j
+
+    # ---------------------------
+    # Somme lungo i percorsi (fase a 20 °C, anelli a caldo)
+    # ---------------------------
+    cum_fase = somma_percorsi(z_fase, padre)
+    cum_fn = somma_percorsi(2.0 * z_fase_caldo, padre)
+    cum_pe = somma_percorsi(z_fase_caldo + z_pe_caldo, padre)
+
+    z3_fine = zq + cum_fase
+    zfn_fine_freddo = zq_fn20 + 2.0 * cum_fase
+    zfn_fine = zq_fn + cum_fn
+    zpe_fine = zq_pe + cum_pe
+
+    icc_max_fine = np.where(tri, C_MAX * u0 / np.abs(z3_fine), C_MAX * u0 / np.abs(zfn_fine_freddo))
+    # inizio tratto = fine del tratto a monte (o origine)
+    z3_inizio = z3_fine - z_fase
+    zfn_inizio = zfn_fine_freddo - 2.0 * z_fase
+    icc_max_inizio = np.where(tri, C_MAX * u0 / np.abs(z3_inizio), C_MAX * u0 / np.abs(zfn_inizio))
+
+    zs = np.abs(zpe_fine)
+    icc_min_fn = C_MIN * u0 / np.abs(zfn_fine)
+    icc_min = np.minimum(icc_min_fn, C_MIN * u0 / zs) if tn else icc_min_fn
+
+    return {
+        "icc_max_inizio_a": icc_max_inizio,
+        "icc_max_fine_a": icc_max_fine,
+        "icc_min_fine_a": icc_min,
+        "zs_fine_ohm": zs,
+        "impedenze_fine": {
+            "r_fase_ohm": z3_fine.real,
+            "x_fase_ohm": z3_fine.imag,
+            "r_fn20_ohm": zfn_fine_freddo.real,
+            "x_fn20_ohm": zfn_fine_freddo.imag,
+            "r_fn_ohm": zfn_fine.real,
+            "x_fn_ohm": zfn_fine.imag,
+            "r_pe_ohm": zpe_fine.real,
+            "x_pe_ohm": zpe_fine.imag,
+        },
+    }
+
+
+def verifica_linea(
+    cc: dict,
+    In: float,
+    sezione_mm2: float,
+    n_paralleli: int,
+    k_i2t: float,
+    tensione_fase_v: float,
+    sistema: str = "TT",
+    t_intervento_s: float | None = None,
+    curva: str = "C",
+    rcd_idn_ma: int | None = None,
+    terminale: bool = True,
+) -> dict:
+    """
+    Esiti 4-41 (TN: intervento alla corrente di guasto U0/Zs entro il tempo
+    ammesso) e 4-43 (I²t alla Icc max di inizio linea e alla Icc min di fine
+    linea) con le curve di curve_intervento_ev; cc: valori scalari di
+    cortocircuito_rete per il tratto. t_intervento_s, se fornito, sostituisce il
+    tempo da curva per la verifica I²t alla Icc max.
+
+    Restituisce {"441", "443" ({ok, warning, nonconf}), "smin_i2t_mm2", "ia_a",
+    "t_limite_s", "t_guasto_s", "curva"}.
+    """
+    u0 = float(tensione_fase_v)
+    curva_eff = curva_per_in(In, curva)
+    t_lim = tempo_max_interruzione(u0, sistema, terminale)
+    ia = float(corrente_intervento(curva_eff, In, t_lim))
+    zs = float(cc["zs_fine_ohm"])
+    icc_max_in = float(cc["icc_max_inizio_a"])
+    icc_min = float(cc["icc_min_fine_a"])
+    s_tot = float(sezione_mm2) * max(1, int(n_paralleli))
+    v = verifica_interruzione(curva_eff, In, icc_max_in, icc_min, u0 / zs, t_lim, s_tot, k_i2t, idn_ma=rcd_idn_ma)
+    esito_441 = {"ok": [], "warning": [], "nonconf": []}
+    esito_443 = {"ok": [], "warning": [], "nonconf": []}
+    tipo_circ = "terminale" if terminale else "distribuzione"
+
+    # 4-41 TN: interruzione automatica entro t_lim (tab. 41A / circuiti di distribuzione)
+    if not sistema.strip().upper().startswith("TT"):
+        ig = u0 / zs
+        if v["ok_magnetotermico"]:
+            esito_441["ok"].append(
+                f"TN: Zs = {zs:.3f} Ω, Ig = U0/Zs = {ig:.0f} A ≥ Ia = {ia:.0f} A: intervento curva {curva_eff}"
+                f" in {v['t_guasto_s']:.2f} s ≤ {t_lim:g} s (circuito {tipo_circ}, OK)."
+            )
+        elif v["ok_differenziale"]:
+            esito_441["warning"].append(
+                f"TN: Zs = {zs:.3f} Ω, Ig = {ig:.0f} A < Ia = {ia:.0f} A (curva {curva_eff}, {t_lim:g} s):"
+                f" interruzione affidata al differenziale IΔn = {rcd_idn_ma} mA ({v['t_differenziale_s']:.2f} s)."
+            )
+        else:
+            esito_441["nonconf"].append(
+                f"TN: Zs = {zs:.3f} Ω, Ig = {ig:.0f} A < Ia = {ia:.0f} A: interruzione non garantita entro {t_lim:g} s"
+                " (NON CONFORME): aumentare sezione PE/fase, ridurre In o prevedere differenziale."
+            )
+
+    # 4-43: energia specifica passante al cortocircuito massimo (inizio linea)
+    if t_intervento_s is not None:
+        i2t_max = icc_max_in ** 2 * t_intervento_s
+        fonte = f"t = {t_intervento_s:.3f} s"
+    else:
+        i2t_max = float(v["i2t_max_a2s"])
+        fonte = f"curva {curva_eff}, t = {v['t_icc_max_s']:.3f} s"
+    smin = math.sqrt(i2t_max) / k_i2t
+    if s_tot >= smin:
+        esito_443["ok"].append(
+            f"I²t: S = {s_tot:g} mm² ≥ Smin = {smin:.1f} mm² (Icc max inizio linea {icc_max_in / 1000:.2f} kA,"
+            f" I²t = {i2t_max:.3g} A²s, {fonte})."
+        )
+    else:
+        esito_443["nonconf"].append(
+            f"I²t: S = {s_tot:g} mm² < Smin = {smin:.1f} mm² (I²t = {i2t_max:.3g} A²s, {fonte}) (NON CONFORME)."
+        )
+    # 4-43: cortocircuito minimo (fine linea)
+    if not math.isfinite(v["t_icc_min_s"]):
+        esito_443["warning"].append(
+            f"Icc min fine linea {icc_min:.0f} A sotto la corrente di intervento: protezione affidata al"
+            " coordinamento Ib ≤ In ≤ Iz (CEI 64-8/4-43 §435.1)."
+        )
+    elif v["ok_i2t_min"]:
+        esito_443["ok"].append(
+            f"Icc min fine linea {icc_min:.0f} A: intervento in {v['t_icc_min_s']:.2f} s, I²t ≤ k²S² (OK)."
+        )
+    else:
+        esito_443["warning"].append(
+            f"Icc min fine linea {icc_min:.0f} A: intervento in {v['t_icc_min_s']:.2f} s con I²t > k²S²;"
+            " ammesso solo con protezione da sovraccarico coordinata (CEI 64-8/4-43 §435.1)."
+        )
+
+    return {
+        "441": esito_441,
+        "443": esito_443,
+        "smin_i2t_mm2": smin,
+        "ia_a": ia,
+        "t_limite_s": t_lim,
+        "t_guasto_s": float(v["t_guasto_s"]),
+        "curva": curva_eff,
+    }
+
+
+def testo_cortocircuito(righe: list[dict]) -> str:
+    """
+    Tabella testuale per relazione: righe = [{"nome", "icc_max_inizio_a",
+    "icc_max_fine_a", "icc_min_fine_a", "zs_fine_ohm", ["t_guasto_s"]}].
+    """
+    out = [
+        "CORRENTI DI CORTOCIRCUITO E IMPEDENZA ANELLO DI GUASTO",
+        f"(Icc max: R a 20 °C, c={C_MAX:.2f}; Icc min e Zs: R a {TEMP_CC_MIN:.0f} °C, c={C_MIN:.2f})",
+    ]
+    for r in righe:
+        out.append(
+            f"- {r['nome']}: Icc max {r['icc_max_inizio_a'] / 1000:.2f} → {r['icc_max_fine_a'] / 1000:.2f} kA,"
+            f" Icc min fine {r['icc_min_fine_a'] / 1000:.3f} kA, Zs {r['zs_fine_ohm']:.3f} Ω"
+            + (f", intervento al guasto {r['t_guasto_s']:.2f} s" if "t_guasto_s" in r else "")
+        )
+    return "\n".join(out)
+
+
+def alfa_cavo(tipo_cavo: str) -> float:
+    """Coefficiente di temperatura della resistenza del conduttore del cavo."""
+    return ALFA_R.get(dati_cavo(tipo_cavo)["materiale"], ALFA_R["rame"])
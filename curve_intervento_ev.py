@@ -0,0 +1,234 @@
+"""
+Curve di intervento di interruttori magnetotermici e differenziali.
+
+- MCB curve B, C, D (CEI EN 60898-1) e scatolato termomagnetico "MCCB"
+  (CEI EN 60947-2, tarature di default): fascia tempo-corrente come inviluppo
+  dei tempi massimi ("max", usato per le verifiche di interruzione) e minimi
+  ("min", usato per la selettività). Correnti in multipli di In.
+- Differenziali generali e selettivi "S" (CEI EN 61008/61009): tempi di
+  intervento in multipli di IΔn.
+
+Le curve sono tabelle di punti convertite all'importazione in griglie log-log
+(array NumPy ordinati): il tempo per una corrente è una ricerca binaria con
+interpolazione lineare in log-log (np.interp), anche su array di correnti.
+Sotto la corrente di non intervento il tempo è infinito.
+
+Valori tipici da norma di prodotto: per verifiche puntuali usare le curve del
+costruttore.
+"""
+from __future__ import annotations
+
+import math
+from types import MappingProxyType
+
+import numpy as np
+
+# Soglie di intervento magnetico istantaneo (Im_min, Im_max) in multipli di In
+SOGLIE_MAGNETICHE = MappingProxyType({"B": (3.0, 5.0), "C": (5.0, 10.0), "D": (10.0, 20.0), "MCCB": (8.0, 12.0)})
+CURVE = tuple(SOGLIE_MAGNETICHE)
+
+# Zona termica (multipli di In -> s). MCB: 1,13 In non intervento / 1,45 In intervento entro 1 h,
+# 2,55 In tra 1 s e 60 s. MCCB: 1,05 / 1,30 In entro 2 h.
+_TERMICA = {
+    "MCB": {
+        "max": [(1.45, 3600.0), (1.8, 600.0), (2.0, 250.0), (2.55, 60.0), (3.0, 35.0), (4.0, 15.0),
+                (5.0, 8.0), (7.0, 4.0), (10.0, 2.0), (14.0, 1.2), (20.0, 0.6)],
+        "min": [(1.13, 3600.0), (1.45, 40.0), (2.0, 6.0), (2.55, 1.0), (3.0, 0.8), (4.0, 0.5),
+                (5.0, 0.35), (7.0, 0.2), (10.0, 0.12)],
+    },
+    "MCCB": {
+        "max": [(1.30, 7200.0), (2.0, 400.0), (3.0, 80.0), (6.0, 15.0), (10.0, 5.0), (12.0, 3.5)],
+        "min": [(1.05, 7200.0), (1.30, 300.0), (2.0, 60.0), (3.0, 15.0), (6.0, 3.0), (8.0, 1.5)],
+    },
+}
+# Zona magnetica: tempo massimo all'inizio della zona istantanea e a correnti elevate
+T_MAGNETICO_MAX = 0.1
+T_LIMITAZIONE = 0.01
+T_MAGNETICO_MIN = 0.005
+
+# Energia specifica passante massima MCB classe 3 di limitazione (CEI EN 60898-1, all. ZA),
+# curve B/C, per In ≤ 16 A e In ≤ 32 A: Icc [A] -> I²t [A²s]
+_I2T_CLASSE_3 = {
+    16: [(3000.0, 15000.0), (4500.0, 25000.0), (6000.0, 35000.0), (10000.0, 70000.0)],
+    32: [(3000.0, 18000.0), (4500.0, 32000.0), (6000.0, 45000.0), (10000.0, 90000.0)],
+}
+
+# Differenziali (multipli di IΔn -> s); sotto 0,5 IΔn nessun intervento
+_DIFFERENZIALI = {
+    "generale": {"max": [(1.0, 0.3), (2.0, 0.15), (5.0, 0.04)], "min": [(0.5, 0.01)]},
+    "S": {"max": [(1.0, 0.5), (2.0, 0.2), (5.0, 0.15)], "min": [(1.0, 0.13), (2.0, 0.06), (5.0, 0.05)]},
+}
+
+# Tempi massimi di interruzione (CEI 64-8/4-41, tab. 41A) per U0 [V]: circuiti terminali
+TEMPI_MAX_TN = MappingProxyType({120: 0.8, 230: 0.4, 400: 0.2, 690: 0.1})
+TEMPI_MAX_TT = MappingProxyType({120: 0.3, 230: 0.2, 400: 0.07, 690: 0.04})
+# Circuiti di distribuzione
+T_DISTRIBUZIONE_TN = 5.0
+T_DISTRIBUZIONE_TT = 1.0
+
+_PASSO = 1e-9  # gradino verticale (soglia magnetica) nella griglia
+
+
+def _sola_lettura(*array: np.ndarray) -> tuple[np.ndarray, ...]:
+    for a in array:
+        a.setflags(write=False)
+    return array
+
+
+def _griglia(punti) -> tuple[np.ndarray, np.ndarray]:
+    """Punti (m, t) -> (log10 m, log10 t) crescenti in m."""
+    m = np.log10(np.array([p[0] for p in punti], dtype=float))
+    t = np.log10(np.array([p[1] for p in punti], dtype=float))
+    if np.any(np.diff(m) < 0) or np.any(np.diff(t) > 0):
+        raise ValueError("Curva di intervento non monotona.")
+    return _sola_lettura(m, t)
+
+
+def _punti_interruttore(curva: str, limite: str) -> list[tuple[float, float]]:
+    im_min, im_max = SOGLIE_MAGNETICHE[curva]
+    im = im_max if limite == "max" else im_min
+    termica = _TERMICA["MCCB" if curva == "MCCB" else "MCB"][limite]
+    punti = [(m, t) for m, t in termica if m < im]
+    # tempo termico alla soglia magnetica (interpolazione log-log sui punti termici)
+    lm, lt = _griglia(termica)
+    t_soglia = float(10 ** np.interp(math.log10(im), lm, lt))
+    if limite == "max":
+        punti += [(im, t_soglia), (im * (1 + _PASSO), T_MAGNETICO_MAX), (2 * im, T_MAGNETICO_MAX), (5 * im, T_LIMITAZIONE)]
+    else:
+        punti += [(im, t_soglia), (im * (1 + _PASSO), T_MAGNETICO_MIN)]
+    return punti
+
+
+# Griglie precalcolate all'importazione, in sola lettura (condivise tra i thread)
+_GRIGLIE = MappingProxyType(
+    {(c, lim): _griglia(_punti_interruttore(c, lim)) for c in CURVE for lim in ("max", "min")}
+)
+_GRIGLIE_I2T = MappingProxyType({
+    In: _sola_lettura(np.log10([i for i, _ in p]), np.log10([e for _, e in p])) for In, p in _I2T_CLASSE_3.items()
+})
+_GRIGLIE_RCD = MappingProxyType(
+    {(tipo, lim): _griglia(p) for tipo, d in _DIFFERENZIALI.items() for lim, p in d.items()}
+)
+
+
+def _normalizza_curva(curva: str) -> str:
+    c = (curva or "C").strip().upper()
+    if c not in SOGLIE_MAGNETICHE:
+        raise ValueError(f"Curva di intervento non gestita: {curva} (ammesse: {', '.join(CURVE)})")
+    return c
+
+
+def _tempo(griglia, multiplo):
+    lm, lt = griglia
+    m = np.asarray(multiplo, dtype=float)
+    with np.errstate(divide="ignore"):
+        x = np.log10(np.maximum(m, 1e-12))
+    t = 10 ** np.interp(x, lm, lt)
+    t = np.where(x < lm[0], np.inf, t)
+    return float(t) if t.ndim == 0 else t
+
+
+def curva_per_in(In: float, curva: str = "C") -> str:
+    """Curva effettiva: oltre 160 A interruttore scatolato (MCCB)."""
+    return "MCCB" if float(In) > 160 else _normalizza_curva(curva)
+
+
+def tempo_intervento(curva: str, In, corrente_a, limite: str = "max"):
+    """Tempo di intervento [s] (inf se non interviene); In e corrente_a anche array."""
+    griglia = _GRIGLIE[(_normalizza_curva(curva), limite)]
+    return _tempo(griglia, np.asarray(corrente_a, dtype=float) / np.asarray(In, dtype=float))
+
+
+def corrente_intervento(curva: str, In, t_s: float, limite: str = "max"):
+    """
+    Corrente minima [A] che garantisce l'intervento entro t_s (ricerca inversa
+    sulla griglia, tempi non crescenti con la corrente). Ia per la verifica 4-41.
+    """
+    lm, lt = _GRIGLIE[(_normalizza_curva(curva), limite)]
+    y = math.log10(t_s)
+    i = int(np.searchsorted(-lt, -y, side="left"))  # primo punto con t ≤ t_s
+    if i >= len(lt):
+        return np.asarray(In, dtype=float) * np.inf
+    if i == 0 or lt[i] == lt[i - 1]:
+        m = 10 ** lm[i]
+    else:
+        f = (y - lt[i - 1]) / (lt[i] - lt[i - 1])
+        m = 10 ** (lm[i - 1] + f * (lm[i] - lm[i - 1]))
+    return np.asarray(In, dtype=float) * m
+
+
+def tempo_differenziale(idn_ma, corrente_a, tipo: str = "generale", limite: str = "max"):
+    """Tempo di intervento del differenziale [s] per corrente di guasto verso terra corrente_a."""
+    if tipo not in _DIFFERENZIALI:
+        raise ValueError(f"Tipo differenziale non gestito: {tipo}")
+    griglia = _GRIGLIE_RCD[(tipo, limite)]
+    return _tempo(griglia, np.asarray(corrente_a, dtype=float) / (np.asarray(idn_ma, dtype=float) / 1000.0))
+
+
+def energia_passante(curva: str, In, corrente_a):
+    """
+    I²t [A²s] = I²·t_max(I). Per MCB curve B/C fino a 32 A, oltre 3 kA, limitata
+    ai valori della classe 3 di limitazione (estrapolati ∝ I² oltre 10 kA).
+    """
+    c = _normalizza_curva(curva)
+    i = np.asarray(corrente_a, dtype=float)
+    In_arr = np.asarray(In, dtype=float)
+    e = i ** 2 * tempo_intervento(c, In_arr, i, "max")
+    if c in ("B", "C"):
+        for taglia, (lx, ly) in sorted(_GRIGLIE_I2T.items(), reverse=True):
+            lim = 10 ** np.interp(np.log10(np.maximum(i, 1.0)), lx, ly)
+            oltre = i > 10 ** lx[-1]
+            lim = np.where(oltre, 10 ** ly[-1] * (i / 10 ** lx[-1]) ** 2, lim)
+            applica = (In_arr <= taglia) & (i >= 10 ** lx[0] * (1 - 1e-9))
+            e = np.where(applica, np.minimum(e, lim), e)
+    return float(e) if np.ndim(e) == 0 else e
+
+
+def tempo_max_interruzione(tensione_fase_v: float, sistema: str = "TN", terminale: bool = True) -> float:
+    """Tempo massimo di interruzione ammesso (CEI 64-8/4-41) per U0 e sistema."""
+    tt = sistema.strip().upper().startswith("TT")
+    if not terminale:
+        return T_DISTRIBUZIONE_TT if tt else T_DISTRIBUZIONE_TN
+    tab = TEMPI_MAX_TT if tt else TEMPI_MAX_TN
+    for u, t in sorted(tab.items()):
+        if tensione_fase_v <= u * 1.05:
+            return t
+    return min(tab.values())
+
+
+def verifica_interruzione(
+    curva: str,
+    In,
+    icc_max_inizio_a,
+    icc_min_fine_a,
+    corrente_guasto_a,
+    t_limite_s: float,
+    sezione_tot_mm2,
+    k_i2t: float,
+    idn_ma=None,
+    tipo_differenziale: str = "generale",
+) -> dict:
+    """
+    Verifiche vettoriali (array per linea o per lotto):
+    - 4-41: tempo di intervento alla corrente di guasto fase-PE ≤ t_limite_s,
+      con il magnetotermico oppure con il differenziale (se idn_ma);
+    - 4-43: I²t ≤ k²S² alla Icc max di inizio linea e alla Icc min di fine linea.
+    """
+    s2 = (float(k_i2t) * np.asarray(sezione_tot_mm2, dtype=float)) ** 2
+    t_guasto = tempo_intervento(curva, In, corrente_guasto_a)
+    t_rcd = tempo_differenziale(idn_ma, corrente_guasto_a, tipo_differenziale) if idn_ma else np.inf
+    i2t_max = energia_passante(curva, In, icc_max_inizio_a)
+    i2t_min = energia_passante(curva, In, icc_min_fine_a)
+    return {
+        "t_guasto_s": t_guasto,
+        "t_differenziale_s": t_rcd,
+        "ok_magnetotermico": np.asarray(t_guasto) <= t_limite_s,
+        "ok_differenziale": np.asarray(t_rcd) <= t_limite_s,
+        "t_icc_max_s": tempo_intervento(curva, In, icc_max_inizio_a),
+        "t_icc_min_s": tempo_intervento(curva, In, icc_min_fine_a),
+        "i2t_max_a2s": i2t_max,
+        "i2t_min_a2s": i2t_min,
+        "ok_i2t_max": i2t_max <= s2,
+        "ok_i2t_min": i2t_min <= s2,
+        "smin_i2t_mm2": np.sqrt(i2t_max) / float(k_i2t),
+    }
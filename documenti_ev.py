@@ -1,15 +1,27 @@
 from __future__ import annotations
 
+from concurrent.futures import Executor
 from io import BytesIO
 from xml.sax.saxutils import escape
 import re
-from typing import Iterable, List
+import threading
+import zipfile
+from typing import Callable, Iterable, List
 
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle
 from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.pdfbase import pdfmetrics
+
+# Rientranza: ogni PDF usa stili, flowable e documento propri (nessuno stato di modulo),
+# quindi genera_pdf_unico_bytes può girare su più thread insieme. L'unico registro globale
+# di ReportLab toccato è quello dei font, popolato pigramente al primo uso: i font standard
+# usati qui sono registrati all'importazione, così doc.build lo legge soltanto.
+for _font in {getattr(s, "fontName", "Helvetica") for s in getSampleStyleSheet().byName.values()}:
+    pdfmetrics.getFont(_font)
+del _font
 
 
 def _p(text: str, style):
@@ -17,6 +29,22 @@ def _p(text: str, style):
     return Paragraph(safe, style)
 
 
+def _righe(text: str, style) -> list:
+    """
+    Testo lungo come un paragrafo per riga (righe vuote = spaziatura di una riga), con
+    lo stesso aspetto di _p. Un unico Paragraph di centinaia di pagine viene spezzato
+    pagina per pagina con costo quadratico e non dà avanzamento durante doc.build.
+    """
+    seguito = ParagraphStyle(f"{style.name}_riga", parent=style, spaceBefore=0)
+    out = []
+    for i, riga in enumerate(text.split("\n")):
+        if not riga.strip():
+            out.append(Spacer(1, style.leading))
+        else:
+            out.append(Paragraph(escape(riga), style if i == 0 else seguito))
+    return out
+
+
 def _bool_si_no(v) -> str:
     """Formato coerente Sì/No per il PDF."""
     if v is None:
@@ -114,7 +142,8 @@ def _page_number(canvas, doc):
     canvas.restoreState()
 
 
-def genera_pdf_unico_bytes(
+def scrivi_pdf_unico(
+    destinazione,
     relazione: str,
     unifilare: str,
     planimetria: str,
@@ -130,6 +159,8 @@ def genera_pdf_unico_bytes(
     punto_connessione: str | None = None,
     installazione_esterna: bool | None = None,
     altezza_punto_connessione_m: float | None = None,
+    # avanzamento 0..1 durante doc.build (es. per generazione in background)
+    progresso: Callable[[float], None] | None = None,
 ):
     """
     PDF tecnico EV:
@@ -138,12 +169,14 @@ def genera_pdf_unico_bytes(
     - Planimetria (testo / note)
     - Check-list CEI 64-8/722
     - In fondo: 'Conformità e Formule di verifica' (come richiesto)
+
+    destinazione: percorso del file oppure stream binario scrivibile (file, voce di
+    uno ZIP, risposta HTTP, BytesIO): il PDF vi è scritto direttamente.
     """
-    buf = BytesIO()
     styles = getSampleStyleSheet()
 
     doc = SimpleDocTemplate(
-        buf,
+        destinazione,
         pagesize=A4,
         leftMargin=18 * mm,
         rightMargin=18 * mm,
@@ -181,7 +214,7 @@ def genera_pdf_unico_bytes(
     )
     story.append(_p(dati_norme_blocco, styles["BodyText"]))
     story.append(Spacer(1, 10))
-    story.append(_p(relazione or "—", styles["BodyText"]))
+    story.extend(_righe(relazione or "—", styles["BodyText"]))
 
     story.append(PageBreak())
 
@@ -190,7 +223,7 @@ def genera_pdf_unico_bytes(
     # =========================
     story.append(_p("SCHEMA UNIFILARE", styles["Title"]))
     story.append(Spacer(1, 10))
-    story.append(_p(unifilare or "—", styles["BodyText"]))
+    story.extend(_righe(unifilare or "—", styles["BodyText"]))
 
     story.append(PageBreak())
 
@@ -199,7 +232,7 @@ def genera_pdf_unico_bytes(
     # =========================
     story.append(_p("PLANIMETRIA", styles["Title"]))
     story.append(Spacer(1, 10))
-    story.append(_p(planimetria or "—", styles["BodyText"]))
+    story.extend(_righe(planimetria or "—", styles["BodyText"]))
 
     story.append(PageBreak())
 
@@ -261,5 +294,119 @@ def genera_pdf_unico_bytes(
         story.append(_p("FORMULE E VERIFICHE (estratto)", styles["Heading2"]))
         story.append(_p("—", styles["BodyText"]))
 
+    if progresso is not None:
+        doc.setProgressCallBack(_callback_progresso(progresso))
     doc.build(story, onFirstPage=_page_number, onLaterPages=_page_number)
+
+
+def genera_pdf_unico_bytes(*args, **kwargs) -> bytes:
+    """Come scrivi_pdf_unico (stessi parametri, senza destinazione) ma restituisce il PDF in byte."""
+    buf = BytesIO()
+    scrivi_pdf_unico(buf, *args, **kwargs)
     return buf.getvalue()
+
+
+# ==============================================================
+# ARCHIVIO ZIP (esportazione massiva)
+# ==============================================================
+class ArchivioPdf:
+    """
+    Archivio ZIP di PDF scritto un documento alla volta.
+
+    Ogni PDF è generato e scritto direttamente nella propria voce dello ZIP: in memoria
+    c'è al più un documento, qualunque sia il numero di documenti esportati.
+    destinazione: percorso oppure stream binario (anche non posizionabile, es. socket).
+    compressione: deflate delle voci (i PDF di reportlab sono già compressi: di default
+    le voci sono solo archiviate, più veloce a parità quasi di dimensione).
+
+        with ArchivioPdf("progetti.zip") as zf:
+            for nome, parametri in documenti:
+                zf.aggiungi(nome, **parametri)
+    """
+
+    def __init__(self, destinazione, compressione: bool = False, livello: int | None = None):
+        metodo = zipfile.ZIP_DEFLATED if compressione else zipfile.ZIP_STORED
+        self._zip = zipfile.ZipFile(destinazione, "w", metodo, compresslevel=livello if compressione else None)
+        self.n_documenti = 0
+
+    def aggiungi(self, nome: str, **parametri) -> None:
+        """Genera il PDF (parametri di scrivi_pdf_unico) direttamente nella voce nome."""
+        with self._zip.open(nome, "w", force_zip64=True) as voce:
+            scrivi_pdf_unico(voce, **parametri)
+        self.n_documenti += 1
+
+    def aggiungi_bytes(self, nome: str, dati: bytes) -> None:
+        """Aggiunge un PDF già generato (es. restituito da un processo del pool)."""
+        self._zip.writestr(nome, dati)
+        self.n_documenti += 1
+
+    def close(self) -> None:
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def esporta_archivio_pdf(destinazione, documenti: Iterable[tuple[str, dict]], compressione: bool = False) -> int:
+    """
+    Scrive uno ZIP con un PDF per ogni (nome, parametri di scrivi_pdf_unico) di documenti,
+    generandoli uno alla volta (documenti può essere un generatore). Restituisce il numero di PDF.
+    """
+    with ArchivioPdf(destinazione, compressione=compressione) as archivio:
+        for nome, parametri in documenti:
+            archivio.aggiungi(nome, **parametri)
+    return archivio.n_documenti
+
+
+# ==============================================================
+# GENERAZIONE IN BACKGROUND
+# ==============================================================
+class GenerazioneAnnullata(Exception):
+    """Generazione PDF interrotta perché superata da una richiesta più recente."""
+
+
+def _callback_progresso(progresso: Callable[[float], None]):
+    """
+    Adatta il callback di reportlab (STARTED/SIZE_EST/PROGRESS/FINISHED) a una frazione 0..1.
+    I paragrafi lunghi vengono spezzati e reinseriti nella coda: l'avanzamento è reso monotòno.
+    """
+    stato = {"totale": 1, "fatto": 0.0}
+
+    def _cb(tipo: str, valore: int):
+        if tipo == "SIZE_EST":
+            stato["totale"] = max(1, int(valore))
+        elif tipo == "PROGRESS":
+            stato["fatto"] = max(stato["fatto"], min(0.99, valore / stato["totale"]))
+            progresso(stato["fatto"])
+        elif tipo == "FINISHED":
+            progresso(1.0)
+
+    return _cb
+
+
+def avvia_pdf_background(esecutore: Executor, chiave: str | None = None, **parametri) -> dict:
+    """
+    Avvia genera_pdf_unico_bytes(**parametri) sull'esecutore (pool di thread condiviso).
+
+    Restituisce il lavoro {"chiave", "future", "progresso" (0..1), "annulla" (Event)}:
+    il PDF è future.result() a lavoro concluso. chiave identifica gli input (per
+    riconoscere un lavoro superato quando cambiano).
+    """
+    lavoro = {"chiave": chiave, "progresso": 0.0, "annulla": threading.Event(), "future": None}
+
+    def _progresso(frazione: float):
+        if lavoro["annulla"].is_set():
+            raise GenerazioneAnnullata()
+        lavoro["progresso"] = frazione
+
+    lavoro["future"] = esecutore.submit(genera_pdf_unico_bytes, progresso=_progresso, **parametri)
+    return lavoro
+
+
+def annulla_pdf_background(lavoro: dict) -> None:
+    """Annulla un lavoro: se ancora in coda non parte, se in corso si interrompe al prossimo avanzamento."""
+    lavoro["annulla"].set()
+    lavoro["future"].cancel()
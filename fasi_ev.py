@@ -0,0 +1,209 @@
+"""
+Bilanciamento delle fasi per colonnine monofase alimentate da una fornitura trifase.
+
+Obiettivo (in ordine lessicografico):
+1) minimizzare il carico della fase più caricata;
+2) minimizzare la corrente di neutro (somma vettoriale delle correnti di fase).
+
+Metodo:
+- n piccolo (≤ esatto_fino_a): ricerca esatta branch & bound;
+- n grande: euristica LPT (carico maggiore sulla fase più scarica) seguita da
+  ricerca locale con spostamenti singoli e scambi tra coppie di fasi
+  (scambi cercati con ricerca binaria sui carichi ordinati).
+
+Priorità (opzionali, default 1): pesano la potenza della colonnina nel
+bilanciamento (es. probabilità di utilizzo contemporaneo). Le correnti di fase
+riportate sono sempre calcolate con le potenze nominali.
+"""
+from __future__ import annotations
+
+import math
+from bisect import bisect_left
+
+FASI = ("L1", "L2", "L3")
+TENSIONE_FASE_V = 230.0
+
+
+def corrente_neutro(i1: float, i2: float, i3: float) -> float:
+    """Corrente di neutro per correnti in fase con i rispettivi sistemi (sfasamento 120°)."""
+    return math.sqrt(max(0.0, i1 * i1 + i2 * i2 + i3 * i3 - i1 * i2 - i2 * i3 - i3 * i1))
+
+
+def _obiettivo(carichi) -> tuple[float, float]:
+    return (round(max(carichi), 9), round(corrente_neutro(*carichi), 9))
+
+
+def _esatto(pesi: list[float]) -> list[int]:
+    """Branch & bound su 3^n con rottura delle simmetrie tra fasi."""
+    n = len(pesi)
+    ordine = sorted(range(n), key=lambda i: -pesi[i])
+    w = [pesi[i] for i in ordine]
+    residuo = [0.0] * (n + 1)
+    for k in range(n - 1, -1, -1):
+        residuo[k] = residuo[k + 1] + w[k]
+
+    migliore = [None, None]  # (obiettivo, assegnazione)
+    carichi = [0.0, 0.0, 0.0]
+    ass = [0] * n
+
+    def _dfs(k: int):
+        if k == n:
+            ob = _obiettivo(carichi)
+            if migliore[0] is None or ob < migliore[0]:
+                migliore[0], migliore[1] = ob, list(ass)
+            return
+        # limite inferiore: max carico attuale e media del carico totale
+        lb = max(max(carichi), (sum(carichi) + residuo[k]) / 3.0)
+        if migliore[0] is not None and round(lb, 9) > migliore[0][0]:
+            return
+        visti = set()
+        for f in sorted(range(3), key=lambda j: carichi[j]):
+            if carichi[f] in visti:  # fasi con stesso carico sono equivalenti
+                continue
+            visti.add(carichi[f])
+            carichi[f] += w[k]
+            ass[k] = f
+            _dfs(k + 1)
+            carichi[f] -= w[k]
+
+    _dfs(0)
+    out = [0] * n
+    for pos, i in enumerate(ordine):
+        out[i] = migliore[1][pos]
+    return out
+
+
+def _euristica(pesi: list[float], max_passate: int = 50) -> list[int]:
+    """LPT + ricerca locale (spostamenti e scambi)."""
+    n = len(pesi)
+    ass = [0] * n
+    carichi = [0.0, 0.0, 0.0]
+    for i in sorted(range(n), key=lambda i: -pesi[i]):
+        f = min(range(3), key=lambda j: carichi[j])
+        ass[i] = f
+        carichi[f] += pesi[i]
+
+    for _ in range(max_passate):
+        migliorato = False
+        ob = _obiettivo(carichi)
+        a = max(range(3), key=lambda j: carichi[j])  # fase più carica
+        for b in sorted(range(3), key=lambda j: carichi[j]):
+            if b == a:
+                continue
+            delta = carichi[a] - carichi[b]
+            if delta <= 1e-12:
+                continue
+            membri_a = [i for i in range(n) if ass[i] == a]
+            # 1) spostamento singolo a -> b (0 < w < delta migliora)
+            for i in membri_a:
+                if 0 < pesi[i] < delta:
+                    prova = list(carichi)
+                    prova[a] -= pesi[i]
+                    prova[b] += pesi[i]
+                    if _obiettivo(prova) < ob:
+                        ass[i], carichi = b, prova
+                        migliorato = True
+                        break
+            if migliorato:
+                break
+            # 2) scambio i (in a) <-> j (in b) con w_i - w_j vicino a delta/2
+            membri_b = sorted((pesi[j], j) for j in range(n) if ass[j] == b)
+            chiavi_b = [x[0] for x in membri_b]
+            for i in membri_a:
+                obiettivo_j = pesi[i] - delta / 2.0
+                k = bisect_left(chiavi_b, obiettivo_j)
+                for kk in (k - 1, k):
+                    if not (0 <= kk < len(membri_b)):
+                        continue
+                    wj, j = membri_b[kk]
+                    d = pesi[i] - wj
+                    if not (0 < d < delta):
+                        continue
+                    prova = list(carichi)
+                    prova[a] -= d
+                    prova[b] += d
+                    if _obiettivo(prova) < ob:
+                        ass[i], ass[j], carichi = b, a, prova
+                        migliorato = True
+                        break
+                if migliorato:
+                    break
+            if migliorato:
+                break
+        if not migliorato:
+            break
+    return ass
+
+
+def bilancia_fasi(
+    potenze_kw,
+    priorita=None,
+    cosphi: float = 0.95,
+    tensione_fase_v: float = TENSIONE_FASE_V,
+    esatto_fino_a: int = 10,
+) -> dict:
+    """
+    Assegna ciascuna colonnina monofase a L1/L2/L3.
+
+    potenze_kw: potenze per colonnina (kW).
+    priorita: pesi opzionali (> 0) per colonnina, stessa lunghezza di potenze_kw.
+    esatto_fino_a: fino a questo numero di colonnine si usa la ricerca esatta.
+
+    Restituisce assegnazione ("L1"/"L2"/"L3" per colonnina), potenze e correnti
+    per fase, fase peggiore, corrente di neutro e metodo usato.
+    """
+    p = [float(x) for x in potenze_kw]
+    if not p:
+        raise ValueError("Nessuna colonnina da assegnare.")
+    if any(x <= 0 for x in p):
+        raise ValueError("Potenze colonnine devono essere > 0.")
+    if priorita is None:
+        pesi = list(p)
+    else:
+        pr = [float(x) for x in priorita]
+        if len(pr) != len(p):
+            raise ValueError("Priorità: serve un valore per ciascuna colonnina.")
+        if any(x <= 0 for x in pr):
+            raise ValueError("Priorità devono essere > 0.")
+        pesi = [a * b for a, b in zip(p, pr)]
+
+    if len(p) <= int(esatto_fino_a):
+        ass = _esatto(pesi)
+        metodo = "esatto (branch & bound)"
+    else:
+        ass = _euristica(pesi)
+        metodo = "euristico (LPT + ricerca locale)"
+
+    kw = [0.0, 0.0, 0.0]
+    for i, f in enumerate(ass):
+        kw[f] += p[i]
+    correnti = [x * 1000.0 / (tensione_fase_v * cosphi) for x in kw]
+    peggiore = max(range(3), key=lambda j: correnti[j])
+
+    return {
+        "assegnazione": [FASI[f] for f in ass],
+        "potenza_fase_kw": {FASI[j]: round(kw[j], 2) for j in range(3)},
+        "corrente_fase_a": {FASI[j]: round(correnti[j], 2) for j in range(3)},
+        "fase_peggiore": FASI[peggiore],
+        "corrente_max_fase_a": round(correnti[peggiore], 2),
+        "corrente_neutro_a": round(corrente_neutro(*correnti), 2),
+        "squilibrio_pct": round(100.0 * (max(kw) - min(kw)) / max(kw), 2) if max(kw) > 0 else 0.0,
+        "metodo": metodo,
+    }
+
+
+def testo_fasi(bil: dict) -> str:
+    """Blocco testuale per relazione/unifilare."""
+    righe = [
+        "BILANCIAMENTO FASI (colonnine monofase su fornitura trifase)",
+        f"- Metodo: {bil['metodo']}",
+    ]
+    for f in FASI:
+        idx = [str(i + 1) for i, x in enumerate(bil["assegnazione"]) if x == f]
+        righe.append(
+            f"- {f}: {bil['potenza_fase_kw'][f]:.1f} kW, I = {bil['corrente_fase_a'][f]:.1f} A"
+            f" | colonnine: {', '.join(idx) if idx else '—'}"
+        )
+    righe.append(f"- Fase più caricata: {bil['fase_peggiore']} ({bil['corrente_max_fase_a']:.1f} A)")
+    righe.append(f"- Corrente di neutro = {bil['corrente_neutro_a']:.1f} A | squilibrio = {bil['squilibrio_pct']:.1f}%")
+    return "\n".join(righe)
@@ -0,0 +1,287 @@
+"""
+Registro di metriche in processo (contatori e istogrammi) con esportazione Prometheus.
+
+Metriche definite in METRICHE:
+- ev_richieste_total{fase, esito}        richieste per fase (calcolo, pdf, api/...), esito ok/errore/annullato
+- ev_errori_total{fase, tipo, motivo}    errori per tipo di eccezione; motivo = codice da MOTIVI_ERRORE
+                                         (inizio del messaggio) oppure "altro"
+- ev_latenza_seconds{fase}               istogramma delle durate
+- ev_pdf_bytes                           istogramma della dimensione dei PDF
+- ev_cache_total{cache, esito}           accessi alle cache, esito hit/miss
+
+Il registro è thread-safe e condiviso dal processo (REGISTRO): ogni processo
+(app Streamlit, api_ev) ha le proprie metriche. I raccoglitori aggiungono al
+momento della lettura valori cumulativi già tenuti altrove (es. metriche di
+coalescenza, cache_info di lru_cache).
+
+Esportazione: prometheus() restituisce il formato testuale 0.0.4;
+scrivi_prometheus() lo scrive in modo atomico su file (textfile collector di
+node_exporter); api_ev lo espone su GET /metrics.
+
+Nell'app la pagina metriche (messaggi di errore, stato delle cache) è riservata
+all'amministratore: accesso_admin la abilita con EV_ADMIN=1 oppure aprendo l'app
+con ?admin=<EV_ADMIN_TOKEN>; senza token impostato il parametro non abilita nulla.
+"""
+from __future__ import annotations
+
+import bisect
+import hmac
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Callable, Iterable
+
+BUCKET_LATENZA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKET_PDF = (10_000, 20_000, 50_000, 100_000, 200_000, 500_000, 1_000_000, 5_000_000, 20_000_000)
+
+# nome: (tipo, descrizione, bucket per gli istogrammi)
+METRICHE = MappingProxyType({
+    "ev_richieste_total": ("counter", "Richieste per fase ed esito.", None),
+    "ev_errori_total": ("counter", "Errori per fase, tipo di eccezione e motivo.", None),
+    "ev_latenza_seconds": ("histogram", "Durata delle fasi in secondi.", BUCKET_LATENZA),
+    "ev_pdf_bytes": ("histogram", "Dimensione dei PDF generati in byte.", BUCKET_PDF),
+    "ev_cache_total": ("counter", "Accessi alle cache per esito (hit/miss).", None),
+})
+
+
+# Motivi ammessi come etichetta: inizio del messaggio (fino a ": " o ". ") con i numeri
+# sostituiti da "#". I messaggi spesso riportano l'input ricevuto (es. tipo posa o cavo):
+# ogni motivo fuori elenco diventa "altro", così le serie restano in numero finito.
+MOTIVI_ERRORE = frozenset({
+    # calcolo_ev, catalogo_ev
+    "Tipo posa non gestito",
+    "Tipo cavo non presente in catalogo",
+    "Tipo differenziale non gestito",
+    "Numero conduttori in parallelo non gestito",
+    "In monofase la potenza massima ammessa è # kW",
+    "IΔn tipica",
+    "Potenza e distanza devono essere > #",
+    "Le distanze devono essere > #",
+    "Icc presunta deve essere > #",
+    "Tempo intervento deve essere > #",
+    "Ib troppo elevata",
+    "Nessuna sezione soddisfa ΔV≤#% e Ib ≤ In ≤ Iz (con derating)",
+    "Numero colonnine ammesso",
+    "Potenza colonnine deve essere > #",
+    "Priorità devono essere > #",
+    "distanze_linee_m",
+    "potenze_colonnine_kw",
+    "priorita_colonnine",
+    "n_linee_per_linea",
+    "Architettura non presente nel piano",
+    # curve_intervento_ev, selettivita_ev, termico_ev
+    "Curva di intervento non gestita",
+    "Selettività",
+    "Portata ciclica",
+    "Profilo ciclico",
+    # simulazione_carichi_ev, montecarlo_ev
+    "Politica gestione carichi non gestita",
+    "Per la gestione carichi serve un limite di potenza del sito > # (limite_kw)",
+    "Tipo distribuzione non gestito",
+    "Distribuzione non valida",
+    "Input incerto non gestito",
+    "Confidenza richiesta",
+    # api_ev
+    "il corpo deve essere un oggetto JSON",
+})
+
+
+def motivo_errore(e: BaseException) -> str:
+    """Codice del motivo dell'errore (etichetta a cardinalità limitata): da MOTIVI_ERRORE oppure "altro"."""
+    testo = re.split(r": |\. ", str(e), maxsplit=1)[0]
+    testo = re.sub(r"\d+(?:[.,]\d+)?", "#", testo).strip().rstrip(".")
+    return testo if testo in MOTIVI_ERRORE else "altro"
+
+
+def quantile_istogramma(bucket: tuple, conteggi: list[int], q: float) -> float | None:
+    """
+    Quantile stimato da un istogramma (interpolazione lineare come histogram_quantile).
+    conteggi: cumulati per bucket, più il totale (+Inf) in fondo; oltre l'ultimo limite
+    restituisce l'ultimo limite finito.
+    """
+    n = conteggi[-1] if conteggi else 0
+    if n == 0:
+        return None
+    rango = q * n
+    i = bisect.bisect_left(conteggi, rango)
+    if i >= len(bucket):
+        return bucket[-1]
+    inf = bucket[i - 1] if i > 0 else 0.0
+    prec = conteggi[i - 1] if i > 0 else 0
+    nel_bucket = conteggi[i] - prec
+    return inf + (bucket[i] - inf) * ((rango - prec) / nel_bucket if nel_bucket else 1.0)
+
+
+def _etichette(d: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in d.items()))
+
+
+def _formato_etichette(etichette: Iterable[tuple[str, str]]) -> str:
+    parti = []
+    for k, v in etichette:
+        v = v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parti.append(f'{k}="{v}"')
+    return "{" + ",".join(parti) + "}" if parti else ""
+
+
+def _numero(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class Registro:
+    """Contatori e istogrammi per (nome, etichette), protetti da un lock."""
+
+    def __init__(self, metriche=METRICHE):
+        self.metriche = metriche
+        self._lock = threading.Lock()
+        self._contatori: dict[tuple, float] = {}
+        self._istogrammi: dict[tuple, list] = {}  # -> [conteggi per bucket (non cumulativi), somma, n]
+        self._raccoglitori: list[Callable[[], Iterable[tuple[str, dict, float]]]] = []
+        self.avvio = time.time()
+
+    def _tipo(self, nome: str, atteso: str):
+        tipo = self.metriche.get(nome, (None,))[0]
+        if tipo != atteso:
+            raise KeyError(f"Metrica {nome!r} non definita come {atteso}.")
+
+    def incrementa(self, nome: str, valore: float = 1.0, **etichette):
+        self._tipo(nome, "counter")
+        chiave = (nome, _etichette(etichette))
+        with self._lock:
+            self._contatori[chiave] = self._contatori.get(chiave, 0.0) + valore
+
+    def osserva(self, nome: str, valore: float, **etichette):
+        self._tipo(nome, "histogram")
+        bucket = self.metriche[nome][2]
+        chiave = (nome, _etichette(etichette))
+        with self._lock:
+            h = self._istogrammi.get(chiave)
+            if h is None:
+                h = self._istogrammi[chiave] = [[0] * len(bucket), 0.0, 0]
+            i = bisect.bisect_left(bucket, valore)
+            if i < len(bucket):
+                h[0][i] += 1
+            h[1] += valore
+            h[2] += 1
+
+    def registra(self, fase: str, durata_s: float, errore: BaseException | None = None):
+        """Una richiesta conclusa: conteggio per esito, durata e, se fallita, tipo e motivo dell'errore."""
+        self.osserva("ev_latenza_seconds", durata_s, fase=fase)
+        self.incrementa("ev_richieste_total", fase=fase, esito="ok" if errore is None else "errore")
+        if errore is not None:
+            self.incrementa("ev_errori_total", fase=fase, tipo=type(errore).__name__, motivo=motivo_errore(errore))
+
+    @contextmanager
+    def cronometra(self, fase: str):
+        """Come registra, attorno a un blocco (l'eccezione è registrata e rilanciata)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.registra(fase, time.perf_counter() - t0, e)
+            raise
+        self.registra(fase, time.perf_counter() - t0)
+
+    def misura_futuro(self, futuro, fase: str, annullamento: tuple[type, ...] = ()):
+        """Come cronometra, per un lavoro in background (Future); con risultato bytes osserva ev_pdf_bytes."""
+        t0 = time.perf_counter()
+
+        def _fine(f):
+            durata = time.perf_counter() - t0
+            e = None if f.cancelled() else f.exception()
+            if f.cancelled() or isinstance(e, annullamento):
+                self.incrementa("ev_richieste_total", fase=fase, esito="annullato")
+                return
+            self.registra(fase, durata, e)
+            if e is None and isinstance(f.result(), (bytes, bytearray)):
+                self.osserva("ev_pdf_bytes", len(f.result()))
+
+        futuro.add_done_callback(_fine)
+        return futuro
+
+    def aggiungi_raccoglitore(self, funz: Callable[[], Iterable[tuple[str, dict, float]]]):
+        """funz() -> [(nome contatore, etichette, valore cumulativo)], letta a ogni esportazione."""
+        with self._lock:
+            self._raccoglitori.append(funz)
+
+    def istantanea(self) -> dict:
+        """{"contatori": {(nome, etichette): valore}, "istogrammi": {(nome, etichette): {...}}}."""
+        with self._lock:
+            contatori = dict(self._contatori)
+            istogrammi = {k: (list(h[0]), h[1], h[2]) for k, h in self._istogrammi.items()}
+            raccoglitori = list(self._raccoglitori)
+        for funz in raccoglitori:
+            for nome, etichette, valore in funz():
+                contatori[(nome, _etichette(etichette))] = float(valore)
+        out = {}
+        for (nome, et), (conteggi, somma, n) in istogrammi.items():
+            bucket = self.metriche[nome][2]
+            cumulati = [sum(conteggi[: i + 1]) for i in range(len(conteggi))] + [n]
+            out[(nome, et)] = {
+                "bucket": bucket,
+                "conteggi": conteggi,
+                "cumulati": cumulati,
+                "somma": somma,
+                "n": n,
+                "media": somma / n if n else None,
+                "p50": quantile_istogramma(bucket, cumulati, 0.50),
+                "p95": quantile_istogramma(bucket, cumulati, 0.95),
+            }
+        return {"contatori": contatori, "istogrammi": out, "avvio": self.avvio}
+
+    def prometheus(self) -> str:
+        """Formato testuale Prometheus 0.0.4."""
+        ist = self.istantanea()
+        righe = []
+        for nome, (tipo, descrizione, _) in self.metriche.items():
+            righe += [f"# HELP {nome} {descrizione}", f"# TYPE {nome} {tipo}"]
+            if tipo == "counter":
+                for (n, et), v in sorted(ist["contatori"].items()):
+                    if n == nome:
+                        righe.append(f"{nome}{_formato_etichette(et)} {_numero(v)}")
+            else:
+                for (n, et), h in sorted(ist["istogrammi"].items(), key=lambda kv: kv[0]):
+                    if n != nome:
+                        continue
+                    for limite, c in zip(h["bucket"] + (math.inf,), h["cumulati"]):
+                        righe.append(f"{nome}_bucket{_formato_etichette(et + (('le', _numero(limite)),))} {c}")
+                    righe.append(f"{nome}_sum{_formato_etichette(et)} {_numero(h['somma'])}")
+                    righe.append(f"{nome}_count{_formato_etichette(et)} {h['n']}")
+        return "\n".join(righe) + "\n"
+
+    def scrivi_prometheus(self, percorso: str) -> str:
+        """Scrittura atomica (file temporaneo + rename) del formato Prometheus."""
+        os.makedirs(os.path.dirname(os.path.abspath(percorso)), exist_ok=True)
+        tmp = f"{percorso}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp, percorso)
+        return percorso
+
+
+REGISTRO = Registro()
+
+VALORI_ATTIVO = {"1", "true", "si", "sì", "yes", "on"}
+
+
+def accesso_admin(parametro: str | None) -> bool:
+    """True se la pagina metriche va mostrata: EV_ADMIN attivo o parametro ?admin= valido."""
+    if os.environ.get("EV_ADMIN", "").strip().lower() in VALORI_ATTIVO:
+        return True
+    token = os.environ.get("EV_ADMIN_TOKEN", "")
+    if not parametro or not token:
+        return False
+    return hmac.compare_digest(parametro.encode(), token.encode())
+
+
+def tasso_hit(contatori: dict, cache: str) -> tuple[float, float, float | None]:
+    """(hit, miss, hit rate) di ev_cache_total per una cache."""
+    hit = contatori.get(("ev_cache_total", _etichette({"cache": cache, "esito": "hit"})), 0.0)
+    miss = contatori.get(("ev_cache_total", _etichette({"cache": cache, "esito": "miss"})), 0.0)
+    return hit, miss, (hit / (hit + miss) if hit + miss else None)
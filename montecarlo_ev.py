@@ -0,0 +1,227 @@
+"""
+Analisi Monte Carlo del rischio di non conformità di una linea EV.
+
+Alcuni dati sono incerti in fase di progetto (resistività e temperatura del
+terreno, temperatura aria, cosφ, lunghezza reale del percorso cavo). Fissata la
+scelta di progetto di genera_progetto_ev (sezione e In), si campionano gli
+input dalle distribuzioni fornite e si stima la probabilità che la linea non
+rispetti Ib ≤ In ≤ Iz oppure ΔV ≤ 4%.
+
+Il calcolo è vettorizzato (NumPy) per blocchi di campioni e i blocchi sono
+distribuiti su un pool di processi condiviso tra le analisi (avvio "spawn", sicuro
+anche dentro un server multithread come Streamlit); ogni blocco restituisce solo i conteggi.
+Per ogni sezione a catalogo (stesso tipo cavo, posa e numero di conduttori in
+parallelo) viene calcolata la probabilità di fallimento, da cui la sezione
+minima che raggiunge la confidenza richiesta. La caduta di tensione usa lo
+stesso nucleo vettoriale del motore (caduta_tensione_ev), su (candidati × campioni).
+"""
+from __future__ import annotations
+
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from calcolo_ev import (
+    FATT_RHO_TERRA,
+    FATT_TEMP_ARIA,
+    FATT_TEMP_TERRA,
+    _fattore_raggr,
+    genera_progetto_ev,
+)
+from caduta_tensione_ev import LIMITE_DV_PERCENTO, caduta_tensione_vett, candidati
+from catalogo_ev import CAVO_DEFAULT, posa_interrata
+from cortocircuito_ev import alfa_cavo
+from simulazione_carichi_ev import campiona
+from termico_ev import costanti_tempo, fattore_ciclico
+
+# Input che possono essere resi incerti (nome parametro di genera_progetto_ev)
+INPUT_INCERTI = ("rho_terreno_km_w", "temp_terreno", "temp_amb", "cosphi", "distanza_m")
+
+
+_lock_pool = threading.Lock()
+_pool: dict[int, ProcessPoolExecutor] = {}
+
+
+def _pool_condiviso(n_proc: int) -> ProcessPoolExecutor:
+    """Pool di n_proc processi, creato alla prima analisi e riusato dalle successive."""
+    with _lock_pool:
+        if n_proc not in _pool:
+            _pool[n_proc] = ProcessPoolExecutor(max_workers=n_proc, mp_context=multiprocessing.get_context("spawn"))
+        return _pool[n_proc]
+
+
+def _interp_vett(x: np.ndarray, tab: dict) -> np.ndarray:
+    """Come _interp_dict, ma su array (estremi saturati)."""
+    xs = sorted(tab.keys())
+    return np.interp(x, xs, [tab[k] for k in xs])
+
+
+def _blocco_montecarlo(args) -> tuple[int, np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Valuta un blocco di campioni (eseguito nei processi del pool).
+
+    Restituisce (n, fall_tot[S], fall_sovracc[S], fall_dv[S], n_ib_oltre_in)
+    con conteggi per ciascuna sezione candidata.
+    """
+    (n, seed, incertezze, nominali, trifase, tensione, In, k_ragg, interrata, alfa_r, cand) = args
+    rng = np.random.default_rng(seed)
+
+    def _x(nome):
+        dist = incertezze.get(nome)
+        if dist is None:
+            return np.full(n, float(nominali[nome]))
+        return campiona(dist, n, rng)
+
+    cosphi = np.clip(_x("cosphi"), 0.05, 1.0)
+    distanza = np.clip(_x("distanza_m"), 0.1, None)
+
+    # Ib
+    if trifase:
+        ib = (nominali["potenza_kw"] * 1000.0) / (math.sqrt(3) * tensione * cosphi)
+    else:
+        ib = (nominali["potenza_kw"] * 1000.0) / (tensione * cosphi)
+
+    # Derating
+    if interrata:
+        t_rif = _x("temp_terreno")
+        k = _interp_vett(t_rif, FATT_TEMP_TERRA) * _interp_vett(_x("rho_terreno_km_w"), FATT_RHO_TERRA)
+    else:
+        t_rif = _x("temp_amb")
+        k = _interp_vett(t_rif, FATT_TEMP_ARIA)
+    k = k * k_ragg
+
+    iz = cand["iz_base"][:, None] * k                      # (nS, n)
+    dv, _ = caduta_tensione_vett(
+        cand["r20_ohm_km"], cand["x_ohm_km"], iz, ib, distanza, cosphi,
+        trifase, tensione, alfa_r, temp_rif_c=t_rif,
+    )
+    ib_oltre_in = ib > In
+    f_sovr = ib_oltre_in[None, :] | (In > iz)
+    f_dv = dv > LIMITE_DV_PERCENTO
+    f_tot = f_sovr | f_dv
+
+    return (
+        n,
+        f_tot.sum(axis=1),
+        f_sovr.sum(axis=1),
+        f_dv.sum(axis=1),
+        int(ib_oltre_in.sum()),
+    )
+
+
+def analisi_montecarlo(
+    progetto: dict,
+    incertezze: dict,
+    n_campioni: int = 200_000,
+    confidenza: float = 0.95,
+    processi: int | None = None,
+    dimensione_blocco: int = 50_000,
+    seed: int | None = 0,
+) -> dict:
+    """
+    Stima la probabilità di non conformità della linea dimensionata da genera_progetto_ev.
+
+    progetto: parametri (nominali) di genera_progetto_ev.
+    incertezze: {nome_input: distribuzione} per i nomi in INPUT_INCERTI; le
+      distribuzioni hanno il formato di simulazione_carichi_ev.campiona.
+    confidenza: probabilità di conformità richiesta per la "sezione a confidenza".
+    processi: processi del pool (None = numero di CPU, 1 = nessun pool).
+    """
+    for nome in incertezze:
+        if nome not in INPUT_INCERTI:
+            raise ValueError(f"Input incerto non gestito: {nome} (ammessi: {', '.join(INPUT_INCERTI)})")
+    if n_campioni < 1 or dimensione_blocco < 1:
+        raise ValueError("n_campioni e dimensione_blocco devono essere ≥ 1.")
+    if not (0.0 < confidenza < 1.0):
+        raise ValueError("Confidenza richiesta: valore tra 0 e 1 (es. 0.95).")
+
+    res = genera_progetto_ev(**progetto)
+    tipo_posa = progetto["tipo_posa"]
+    tipo_cavo = progetto.get("tipo_cavo", CAVO_DEFAULT)
+    trifase = "trifase" in progetto["alimentazione"].lower()
+    tensione = res["tensione_v"]
+    In = res["In_a"]
+    k_ragg = _fattore_raggr(int(progetto.get("n_linee", 1)))
+
+    nominali = {
+        "potenza_kw": float(progetto["potenza_kw"]),
+        "distanza_m": float(progetto["distanza_m"]),
+        "cosphi": float(progetto.get("cosphi", 0.95)),
+        "temp_amb": float(progetto.get("temp_amb", 30)),
+        "temp_terreno": float(20 if progetto.get("temp_terreno") is None else progetto["temp_terreno"]),
+        "rho_terreno_km_w": float(2.5 if progetto.get("rho_terreno_km_w") is None else progetto["rho_terreno_km_w"]),
+    }
+    # candidati: stessa famiglia (n conduttori in parallelo) della scelta di progetto
+    n_par = int(res.get("n_paralleli", 1))
+    tutti = candidati(tipo_cavo, tipo_posa, n_par)
+    famiglia = tutti["n_paralleli"] == n_par
+    cand = {k: v[famiglia] for k, v in tutti.items()}
+    if progetto.get("profilo_ciclico") is not None:
+        # stessa Iz ciclica del motore (kC per sezione)
+        prof = progetto["profilo_ciclico"]
+        par_t = costanti_tempo(tipo_cavo, tipo_posa, cand["sezione"])
+        kc = fattore_ciclico(prof["carico"], float(prof.get("passo_min", 60.0)), par_t["tau_cavo_s"],
+                             par_t["quota_ambiente"], par_t["tau_ambiente_s"])
+        cand["iz_base"] = cand["iz_base"] * kc
+    sezioni = cand["sezione"].tolist()
+    interrata = posa_interrata(tipo_posa)
+    alfa_r = alfa_cavo(tipo_cavo)
+
+    # ---------------------------
+    # Blocchi indipendenti (seed derivati) -> pool di processi
+    # ---------------------------
+    n_blocchi = int(math.ceil(n_campioni / dimensione_blocco))
+    semi = np.random.SeedSequence(seed).spawn(n_blocchi)
+    blocchi = []
+    for b in range(n_blocchi):
+        n_b = min(dimensione_blocco, n_campioni - b * dimensione_blocco)
+        blocchi.append((n_b, semi[b], incertezze, nominali, trifase, tensione, In, k_ragg, interrata, alfa_r, cand))
+
+    n_proc = processi if processi is not None else (os.cpu_count() or 1)
+    if n_proc <= 1 or n_blocchi == 1:
+        risultati = [_blocco_montecarlo(a) for a in blocchi]
+    else:
+        risultati = list(_pool_condiviso(n_proc).map(_blocco_montecarlo, blocchi))
+
+    n_tot = sum(r[0] for r in risultati)
+    f_tot = sum(r[1] for r in risultati) / n_tot
+    f_sovr = sum(r[2] for r in risultati) / n_tot
+    f_dv = sum(r[3] for r in risultati) / n_tot
+    p_ib_oltre_in = sum(r[4] for r in risultati) / n_tot
+
+    i_sel = sezioni.index(res["sezione_mm2"])
+    sezione_conf = next((S for S, p in zip(sezioni, f_tot) if 1.0 - p >= confidenza), None)
+
+    return {
+        "sezione_mm2": res["sezione_mm2"],
+        "n_paralleli": n_par,
+        "In_a": In,
+        "n_campioni": int(n_tot),
+        "prob_non_conforme": round(float(f_tot[i_sel]), 5),
+        "prob_sovraccarico": round(float(f_sovr[i_sel]), 5),
+        "prob_caduta_tensione": round(float(f_dv[i_sel]), 5),
+        "prob_ib_oltre_in": round(float(p_ib_oltre_in), 5),
+        "prob_non_conforme_per_sezione": {S: round(float(p), 5) for S, p in zip(sezioni, f_tot)},
+        "confidenza": confidenza,
+        "sezione_confidenza_mm2": sezione_conf,
+    }
+
+
+def testo_montecarlo(mc: dict) -> str:
+    """Blocco testuale di sintesi per la relazione."""
+    conf = f"{mc['confidenza'] * 100:.1f}%"
+    sez_conf = f"{mc['sezione_confidenza_mm2']} mm²" if mc["sezione_confidenza_mm2"] is not None else "nessuna sezione in tabella"
+    righe = [
+        f"ANALISI MONTE CARLO ({mc['n_campioni']} campioni)",
+        f"- Sezione di progetto {mc['sezione_mm2']} mm², In = {mc['In_a']} A",
+        f"- P(non conforme) = {mc['prob_non_conforme'] * 100:.2f}%"
+        f" (Ib ≤ In ≤ Iz: {mc['prob_sovraccarico'] * 100:.2f}%, ΔV ≤ 4%: {mc['prob_caduta_tensione'] * 100:.2f}%)",
+        f"- Sezione minima per confidenza {conf}: {sez_conf}",
+    ]
+    if mc["prob_ib_oltre_in"] > 0:
+        righe.append(f"- Attenzione: Ib > In nel {mc['prob_ib_oltre_in'] * 100:.2f}% dei casi (rivedere In, non risolvibile con la sezione).")
+    return "\n".join(righe)
@@ -0,0 +1,286 @@
+"""
+Instradamento automatico dei cavi su mappa raster del sito (parcheggio).
+
+La mappa è una griglia di celle quadrate di lato passo_m con un costo per metro:
+- ostacoli (edifici, aiuole protette, ...) = non attraversabili (inf);
+- cavidotti esistenti = costo basso (solo infilaggio);
+- resto = costo di scavo (scalare o raster, es. asfalto vs verde).
+
+I percorsi sono ortogonali (4-connessi) e calcolati con Dijkstra a partire dal
+quadro verso tutte le EVSE in un'unica esecuzione (albero dei cammini minimi).
+Se SciPy è disponibile si usa scipy.sparse.csgraph.dijkstra (heap in C),
+altrimenti una Dijkstra con heapq che si ferma quando tutte le destinazioni
+sono state raggiunte.
+
+Le lunghezze restituite alimentano distanza_m / distanza_dorsale_m /
+distanze_linee_m del motore di calcolo; il riepilogo testuale va nella
+sezione planimetria.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+
+import numpy as np
+
+try:
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import dijkstra as _sp_dijkstra
+except Exception:  # SciPy opzionale: fallback heapq
+    coo_matrix = None
+    _sp_dijkstra = None
+
+COSTO_MIN = 1e-9  # i costi nulli non sono ammessi (archi a peso 0 spariscono nelle matrici sparse)
+
+
+def mappa_costi(
+    forma: tuple[int, int],
+    costo_scavo=1.0,
+    ostacoli=None,
+    cavidotti=None,
+    costo_cavidotto: float = 0.1,
+) -> np.ndarray:
+    """
+    Costruisce il raster dei costi [costo/m].
+
+    costo_scavo: scalare o array (forma) con il costo di scavo per metro.
+    ostacoli / cavidotti: maschere booleane (forma) opzionali.
+    """
+    c = np.array(np.broadcast_to(np.asarray(costo_scavo, dtype=float), forma))
+    if cavidotti is not None:
+        c[np.asarray(cavidotti, dtype=bool)] = float(costo_cavidotto)
+    if ostacoli is not None:
+        c[np.asarray(ostacoli, dtype=bool)] = np.inf
+    return c
+
+
+def _archi_griglia(costo: np.ndarray, passo_m: float):
+    """Archi 4-connessi tra celle attraversabili: (u, v, peso) con peso = passo·media costi."""
+    R, C = costo.shape
+    idx = np.arange(R * C).reshape(R, C)
+    us, vs, ws = [], [], []
+    for a, b, ia, ib in (
+        (costo[:, :-1], costo[:, 1:], idx[:, :-1], idx[:, 1:]),   # orizzontali
+        (costo[:-1, :], costo[1:, :], idx[:-1, :], idx[1:, :]),   # verticali
+    ):
+        ok = np.isfinite(a) & np.isfinite(b)
+        us.append(ia[ok])
+        vs.append(ib[ok])
+        ws.append(np.maximum(passo_m * (a[ok] + b[ok]) / 2.0, COSTO_MIN))
+    return np.concatenate(us), np.concatenate(vs), np.concatenate(ws)
+
+
+def _dijkstra_scipy(costo: np.ndarray, sorgente: int, passo_m: float):
+    n = costo.size
+    u, v, w = _archi_griglia(costo, passo_m)
+    g = coo_matrix((w, (u, v)), shape=(n, n)).tocsr()
+    dist, pred = _sp_dijkstra(g, directed=False, indices=sorgente, return_predecessors=True)
+    return dist, pred
+
+
+def _dijkstra_heapq(costo: np.ndarray, sorgente: int, destinazioni, passo_m: float):
+    """Dijkstra con heapq su griglia 4-connessa, arresto quando tutte le destinazioni sono fissate."""
+    R, C = costo.shape
+    n = R * C
+    c = costo.ravel().tolist()
+    dist = [math.inf] * n
+    pred = [-9999] * n
+    fatto = bytearray(n)
+    mancanti = set(int(d) for d in destinazioni)
+    dist[sorgente] = 0.0
+    coda = [(0.0, sorgente)]
+    mezzo = passo_m / 2.0
+    while coda and mancanti:
+        d, u = heapq.heappop(coda)
+        if fatto[u]:
+            continue
+        fatto[u] = 1
+        mancanti.discard(u)
+        r, col = divmod(u, C)
+        cu = c[u]
+        for v, ok in ((u - 1, col > 0), (u + 1, col < C - 1), (u - C, r > 0), (u + C, r < R - 1)):
+            if not ok or fatto[v]:
+                continue
+            cv = c[v]
+            if cv == math.inf:
+                continue
+            nd = d + max(mezzo * (cu + cv), COSTO_MIN)
+            if nd < dist[v]:
+                dist[v] = nd
+                pred[v] = u
+                heapq.heappush(coda, (nd, v))
+    return np.asarray(dist), np.asarray(pred)
+
+
+def _polilinea(pred, sorgente: int, dest: int, C: int) -> tuple[list[tuple[int, int]], int]:
+    """Ricostruisce il percorso come polilinea (solo vertici ai cambi di direzione) e numero di passi."""
+    vertici = [divmod(dest, C)]
+    passi = 0
+    u = dest
+    dir_prec = None
+    while u != sorgente:
+        p = int(pred[u])
+        if p < 0:
+            raise ValueError("Percorso non ricostruibile (predecessore mancante).")
+        direzione = u - p
+        if dir_prec is not None and direzione != dir_prec:
+            vertici.append(divmod(u, C))
+        dir_prec = direzione
+        u = p
+        passi += 1
+    vertici.append(divmod(sorgente, C))
+    vertici.reverse()
+    return [(int(r), int(c)) for r, c in vertici], passi
+
+
+def instrada(
+    costo: np.ndarray,
+    origine: tuple[int, int],
+    destinazioni,
+    passo_m: float = 1.0,
+    scorta_m: float = 0.0,
+    cavidotti=None,
+    backend: str | None = None,
+) -> dict:
+    """
+    Percorsi di costo minimo da origine (quadro) a ciascuna destinazione (EVSE).
+
+    costo: raster da mappa_costi (inf = ostacolo).
+    origine / destinazioni: celle (riga, colonna).
+    scorta_m: lunghezza aggiuntiva per linea (risalite, ricchezza ai terminali).
+    cavidotti: maschera opzionale per separare nel riepilogo i metri in cavidotto esistente.
+    backend: "scipy", "heapq" oppure None (scipy se disponibile).
+
+    Restituisce lunghezze [m], costi, polilinee (celle), metri di nuovo scavo per
+    linea e complessivi (percorsi condivisi contati una volta).
+    """
+    costo = np.asarray(costo, dtype=float)
+    if costo.ndim != 2:
+        raise ValueError("La mappa costi deve essere una matrice 2D.")
+    if passo_m <= 0:
+        raise ValueError("passo_m deve essere > 0.")
+    if np.any(costo < 0):
+        raise ValueError("I costi della mappa devono essere ≥ 0.")
+    R, C = costo.shape
+
+    def _id(cella):
+        r, c = int(cella[0]), int(cella[1])
+        if not (0 <= r < R and 0 <= c < C):
+            raise ValueError(f"Cella fuori mappa: {cella}")
+        if not np.isfinite(costo[r, c]):
+            raise ValueError(f"Cella su ostacolo: {cella}")
+        return r * C + c
+
+    src = _id(origine)
+    dst = [_id(d) for d in destinazioni]
+    if not dst:
+        raise ValueError("Nessuna destinazione da instradare.")
+
+    uso = backend or ("scipy" if _sp_dijkstra is not None else "heapq")
+    if uso == "scipy":
+        if _sp_dijkstra is None:
+            raise ValueError("Backend scipy non disponibile (SciPy non installato).")
+        dist, pred = _dijkstra_scipy(costo, src, passo_m)
+    elif uso == "heapq":
+        dist, pred = _dijkstra_heapq(costo, src, dst, passo_m)
+    else:
+        raise ValueError(f"Backend instradamento non gestito: {backend}")
+
+    duct = None if cavidotti is None else np.asarray(cavidotti, dtype=bool).ravel()
+    scavo_usato = np.zeros(R * C, dtype=bool)
+    percorsi, lunghezze, costi, scavo_linea = [], [], [], []
+    for d in dst:
+        if not np.isfinite(dist[d]):
+            r, c = divmod(d, C)
+            raise ValueError(f"EVSE in ({r}, {c}) non raggiungibile dal quadro (ostacoli).")
+        poli, passi = _polilinea(pred, src, d, C)
+        # celle del percorso escluso il quadro: ogni cella è il passo che vi entra (metri = passi, come il cavo)
+        celle = _celle_polilinea(poli, C)
+        celle = celle[celle != src]
+        nuovo = celle if duct is None else celle[~duct[celle]]
+        scavo_usato[nuovo] = True
+        percorsi.append(poli)
+        lunghezze.append(round(passi * passo_m + scorta_m, 2))
+        costi.append(round(float(dist[d]), 3))
+        scavo_linea.append(round(len(nuovo) * passo_m, 2))
+
+    return {
+        "lunghezze_m": lunghezze,
+        "costi": costi,
+        "percorsi": percorsi,
+        "scavo_nuovo_linea_m": scavo_linea,
+        "scavo_nuovo_totale_m": round(float(scavo_usato.sum()) * passo_m, 2),
+        "cavo_totale_m": round(sum(lunghezze), 2),
+        "passo_m": passo_m,
+        "backend": uso,
+    }
+
+
+def _celle_polilinea(poli, C: int) -> np.ndarray:
+    """Indici (piatti) delle celle attraversate da una polilinea ortogonale."""
+    pezzi = []
+    for (r0, c0), (r1, c1) in zip(poli[:-1], poli[1:]):
+        if r0 == r1:
+            cc = np.arange(c0, c1 + (1 if c1 >= c0 else -1), 1 if c1 >= c0 else -1)
+            pezzi.append(r0 * C + cc)
+        else:
+            rr = np.arange(r0, r1 + (1 if r1 >= r0 else -1), 1 if r1 >= r0 else -1)
+            pezzi.append(rr * C + c0)
+    if not pezzi:
+        return np.asarray([poli[0][0] * C + poli[0][1]])
+    return np.unique(np.concatenate(pezzi))
+
+
+def distanze_progetto(
+    costo: np.ndarray,
+    quadro: tuple[int, int],
+    evse,
+    sottoquadro: tuple[int, int] | None = None,
+    passo_m: float = 1.0,
+    scorta_m: float = 0.0,
+    cavidotti=None,
+    backend: str | None = None,
+) -> dict:
+    """
+    Distanze per il motore di calcolo.
+
+    Senza sottoquadro: linee quadro -> EVSE (distanza_dorsale_m = None).
+    Con sottoquadro: dorsale quadro -> sottoquadro e linee sottoquadro -> EVSE.
+
+    Restituisce {"distanza_dorsale_m", "distanze_linee_m", "dorsale", "linee", "planimetria"}.
+    """
+    dorsale = None
+    partenza = quadro
+    if sottoquadro is not None:
+        dorsale = instrada(costo, quadro, [sottoquadro], passo_m, scorta_m, cavidotti, backend)
+        partenza = sottoquadro
+    linee = instrada(costo, partenza, evse, passo_m, scorta_m, cavidotti, backend)
+    return {
+        "distanza_dorsale_m": (dorsale["lunghezze_m"][0] if dorsale else None),
+        "distanze_linee_m": linee["lunghezze_m"],
+        "dorsale": dorsale,
+        "linee": linee,
+        "planimetria": testo_percorsi(linee, dorsale),
+    }
+
+
+def testo_percorsi(linee: dict, dorsale: dict | None = None, max_righe: int = 50) -> str:
+    """Riepilogo percorsi per la sezione planimetria."""
+    righe = [
+        "PERCORSI CAVI (instradamento automatico su mappa del sito)",
+        f"- Griglia: passo {linee['passo_m']:.2f} m, percorsi ortogonali a costo minimo ({linee['backend']})",
+    ]
+    if dorsale:
+        righe.append(
+            f"- Dorsale quadro → sottoquadro: {dorsale['lunghezze_m'][0]:.1f} m"
+            f" (scavo nuovo {dorsale['scavo_nuovo_totale_m']:.1f} m)"
+        )
+    n = len(linee["lunghezze_m"])
+    for i, (lung, poli, scavo) in enumerate(zip(linee["lunghezze_m"], linee["percorsi"], linee["scavo_nuovo_linea_m"]), 1):
+        if i > max_righe:
+            righe.append(f"- ... altre {n - max_righe} linee (dettaglio negli elaborati)")
+            break
+        righe.append(f"- Linea EVSE {i}: {lung:.1f} m, {len(poli) - 2} cambi di direzione, scavo nuovo {scavo:.1f} m")
+    righe.append(f"- Cavo totale linee: {linee['cavo_totale_m']:.1f} m")
+    righe.append(f"- Scavo nuovo complessivo (tratti condivisi contati una volta): {linee['scavo_nuovo_totale_m']:.1f} m")
+    return "\n".join(righe)
@@ -0,0 +1,446 @@
+"""
+Elaborazione di un portafoglio di siti (caricamento massivo CSV/XLSX).
+
+Ogni riga del foglio è un sito: le colonne hanno il nome dei parametri di
+genera_progetto_ev (nome, cognome, indirizzo, potenza_kw, distanza_m,
+alimentazione, tipo_posa, sistema, ...). Con n_colonnine > 1 la riga è
+calcolata con genera_progetto_ev_multi (servono architettura,
+distanza_dorsale_m e distanza_linea_m). Una colonna "sito" facoltativa dà
+l'etichetta del sito; celle vuote = valore di default del parametro.
+
+Le righe sono validate prima del calcolo, a colonne su tutto il foglio
+(valida_portafoglio): conversione dei tipi, colonne obbligatorie, nomi
+normalizzati (alimentazione, architettura, tipo_posa, tipo_cavo) e gli stessi
+limiti del motore (potenza e distanze > 0, IΔn, 7,4 kW in monofase), così un
+errore in una riga emerge subito e non dopo il calcolo dei siti precedenti. Il
+motore riceve solo righe pulite; rapporto_errori dà una riga per sito scartato.
+I siti validi sono distribuiti su un pool di processi e i risultati
+arrivano man mano che i lavori terminano. I PDF dei siti sono scritti uno alla
+volta in un archivio ZIP su file: i lavori in corso sono limitati a una finestra
+di poche unità per processo, quindi in memoria restano solo i PDF in transito.
+"""
+from __future__ import annotations
+
+import collections
+import csv
+import inspect
+import io
+import itertools
+import math
+import operator
+import re
+import types
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+
+import numpy as np
+
+from calcolo_ev import (
+    ARCHITETTURE,
+    IDN_AMMESSE_MA,
+    MAX_COLONNINE,
+    POTENZA_MAX_MONOFASE_KW,
+    genera_progetto_ev,
+    genera_progetto_ev_multi,
+    normalizza_architettura,
+)
+from catalogo_ev import CAVO_DEFAULT, tipi_cavo, tipi_posa
+from documenti_ev import ArchivioPdf, genera_pdf_unico_bytes
+
+VALORI_VERO = {"1", "true", "vero", "si", "sì", "yes", "x"}
+VALORI_FALSO = {"0", "false", "falso", "no", ""}
+ALIMENTAZIONI = ("Monofase 230 V", "Trifase 400 V")
+_SI_NO = {**dict.fromkeys(VALORI_VERO, True), **dict.fromkeys(VALORI_FALSO, False)}
+
+
+def _tipi_parametri(funz) -> dict[str, type]:
+    """{parametro: tipo scalare} dalla firma (str/int/float/bool, anche "| None")."""
+    out = {}
+    for nome, par in inspect.signature(funz).parameters.items():
+        tipo = par.annotation
+        if isinstance(tipo, types.UnionType):
+            tipo = next(t for t in tipo.__args__ if t is not type(None))
+        if tipo in (str, int, float, bool):
+            out[nome] = tipo
+    return out
+
+
+def _obbligatori(funz) -> tuple[str, ...]:
+    return tuple(
+        nome for nome, par in inspect.signature(funz).parameters.items()
+        if par.default is inspect.Parameter.empty
+    )
+
+
+TIPI_SINGOLA = _tipi_parametri(genera_progetto_ev)
+TIPI_MULTI = _tipi_parametri(genera_progetto_ev_multi)
+OBBLIGATORI_SINGOLA = _obbligatori(genera_progetto_ev)
+OBBLIGATORI_MULTI = _obbligatori(genera_progetto_ev_multi)
+
+
+def leggi_portafoglio(nome_file: str, dati: bytes) -> list[dict[str, str]]:
+    """
+    Legge le righe di un CSV (separatore , o ; rilevato) o di un XLSX (primo foglio,
+    richiede openpyxl). Restituisce una lista di {colonna: testo}, intestazioni in minuscolo.
+    """
+    if nome_file.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError as e:
+            raise RuntimeError("Per i file XLSX serve il pacchetto openpyxl (oppure carica un CSV).") from e
+        foglio = load_workbook(io.BytesIO(dati), read_only=True, data_only=True).worksheets[0]
+        righe = [["" if v is None else str(v) for v in r] for r in foglio.iter_rows(values_only=True)]
+    else:
+        testo = dati.decode("utf-8-sig")
+        prima = testo.split("\n", 1)[0]
+        sep = ";" if prima.count(";") > prima.count(",") else ","
+        righe = list(csv.reader(io.StringIO(testo), delimiter=sep))
+    righe = [r for r in righe if any(c.strip() for c in r)]
+    if not righe:
+        return []
+    intest = [c.strip().lower() for c in righe[0]]
+    vuote = [""] * len(intest)  # righe corte completate: tutte le righe hanno tutte le colonne
+    return [dict(zip(intest, [c.strip() for c in r] + vuote[len(r):])) for r in righe[1:]]
+
+
+def _float_o_nan(testo: str) -> float:
+    try:
+        return float(testo)
+    except ValueError:
+        return math.nan
+
+
+def _converti_colonna(testo: np.ndarray, tipo: type) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Conversione in blocco delle celle (non vuote) di una colonna: (valori, non_validi).
+    bool: VALORI_VERO / VALORI_FALSO; int e float: virgola decimale ammessa, solo valori finiti.
+    """
+    if tipo is bool:
+        conv = _per_valore(testo, lambda v: _SI_NO.get(v.lower()))
+        non_validi = conv == None  # noqa: E711
+        conv[non_validi] = False
+        return conv, non_validi
+    if tipo not in (int, float):
+        return testo, np.zeros(len(testo), dtype=bool)
+    punto = [v.replace(",", ".") for v in testo]
+    try:
+        x = np.array(punto, dtype=float)
+    except ValueError:  # almeno una cella non numerica: conversione cella per cella
+        x = np.array([_float_o_nan(v) for v in punto], dtype=float)
+    non_validi = ~np.isfinite(x)
+    if tipo is int:
+        with np.errstate(invalid="ignore"):
+            non_validi |= np.mod(x, 1.0) != 0
+        return np.where(non_validi, 0, x).astype(np.int64), non_validi
+    return x, non_validi
+
+
+def _per_valore(valori: np.ndarray, funz) -> np.ndarray:
+    """funz applicata una volta per valore distinto della colonna (pochi valori ripetuti su molte righe)."""
+    if len(valori) == 0:
+        return np.empty(0, dtype=object)
+    distinti, inverso = np.unique(valori, return_inverse=True)
+    return np.array([funz(v) for v in distinti] + [None], dtype=object)[:-1][inverso]
+
+
+def _normalizza_alimentazione(valore: str) -> str | None:
+    v = valore.lower()
+    if "trifase" in v:
+        return ALIMENTAZIONI[1]
+    if "monofase" in v:
+        return ALIMENTAZIONI[0]
+    if "400" in v or v.replace(" ", "") in ("3f", "3ph"):
+        return ALIMENTAZIONI[1]
+    if "230" in v or v.replace(" ", "") in ("1f", "1ph"):
+        return ALIMENTAZIONI[0]
+    return None
+
+
+def _trasponi(righe: list[dict[str, str]], colonne: list[str]) -> list[np.ndarray]:
+    """Righe {colonna: testo} -> un array (object) di testo per colonna, "" dove la cella manca."""
+    if not colonne:
+        return []
+    try:  # caso comune (leggi_portafoglio): tutte le righe hanno tutte le colonne
+        celle = list(map(operator.itemgetter(*colonne), righe))
+    except KeyError:
+        celle = [tuple(r.get(c) for c in colonne) for r in righe]
+    if len(colonne) == 1:
+        celle = [(v,) for v in celle]
+    out = []
+    for valori in zip(*celle):
+        t = np.empty(len(righe), dtype=object)
+        t[:] = valori
+        t[t == None] = ""  # noqa: E711
+        out.append(t)
+    return out
+
+
+def _segnala(errori: dict[int, list[str]], maschera: np.ndarray, messaggio: str):
+    for i in np.flatnonzero(maschera):
+        errori[i].append(messaggio)
+
+
+def valida_portafoglio(righe: list[dict[str, str]], primo_indice: int = 1) -> list[dict]:
+    """
+    Validazione a colonne di tutte le righe del portafoglio (output di leggi_portafoglio).
+
+    Ogni colonna è convertita e controllata in blocco (array numpy); le colonne di testo
+    sono normalizzate ai nomi del motore: alimentazione e alimentazione_dorsale
+    ("Monofase 230 V" / "Trifase 400 V"), architettura (calcolo_ev.ARCHITETTURE),
+    tipo_cavo e tipo_posa (nomi a catalogo, senza distinzione maiuscole/minuscole).
+    Controlli come _controlla_input del motore: potenza e distanze > 0, rcd_idn_ma in
+    IDN_AMMESSE_MA, potenza ≤ 7,4 kW in monofase (anche per la dorsale monofase delle
+    righe multi-colonnina), n_colonnine 1..MAX_COLONNINE.
+
+    Restituisce una voce per riga {"riga", "sito", "multi", "parametri", "errori"}: con errori
+    non vuoto il sito non va calcolato. Le colonne sconosciute sono ignorate.
+    """
+    n = len(righe)
+    if n == 0:
+        return []
+    errori: dict[int, list[str]] = collections.defaultdict(list)  # solo le righe con errori
+    colonne = sorted(set().union(*righe) & (TIPI_SINGOLA.keys() | TIPI_MULTI.keys()))
+    testo = dict(zip(colonne, _trasponi(righe, colonne)))
+
+    # n_colonnine decide il motore (e quindi tipi e colonne obbligatorie) di ogni riga
+    n_col = np.ones(n, dtype=np.int64)
+    if "n_colonnine" in testo:
+        t = testo["n_colonnine"]
+        presente = t != ""
+        x, non_validi = _converti_colonna(t[presente], float)
+        idx = np.flatnonzero(presente)
+        n_col[idx[~non_validi]] = x[~non_validi].astype(np.int64)
+        for i in idx[non_validi]:
+            errori[i].append(f"n_colonnine: numero non valido ({righe[i].get('n_colonnine')!r})")
+    multi = n_col > 1
+    _segnala(errori, (n_col < 1) | (n_col > MAX_COLONNINE), f"n_colonnine: ammesso 1..{MAX_COLONNINE}")
+
+    valori: dict[str, np.ndarray] = {}  # None = cella vuota o non valida (default del motore)
+    numeri: dict[str, np.ndarray] = {}  # colonne numeriche, NaN dove manca il valore
+    errate = {}
+    for col in colonne:
+        tipo = TIPI_MULTI.get(col) or TIPI_SINGOLA[col]
+        applicabile = multi if col not in TIPI_SINGOLA else (~multi if col not in TIPI_MULTI else np.ones(n, bool))
+        t = testo[col]
+        presente = (t != "") & applicabile
+        idx = np.flatnonzero(presente)
+        conv, non_validi = _converti_colonna(t[presente], tipo)
+        v = np.full(n, None, dtype=object)
+        v[idx[~non_validi]] = conv[~non_validi]
+        valori[col] = v
+        errate[col] = np.zeros(n, dtype=bool)
+        errate[col][idx[non_validi]] = True
+        atteso = {bool: "valore sì/no non riconosciuto", int: "atteso un intero", float: "numero non valido"}.get(tipo)
+        for i in idx[non_validi]:
+            errori[i].append(f"{col}: {atteso} ({str(t[i])!r})")
+        if tipo in (int, float):
+            numeri[col] = np.full(n, np.nan)
+            numeri[col][idx[~non_validi]] = conv[~non_validi]
+
+    # colonne obbligatorie
+    mancanti = collections.defaultdict(list)
+    for obbligatori, righe_tipo in ((OBBLIGATORI_SINGOLA, ~multi), (OBBLIGATORI_MULTI, multi)):
+        for col in obbligatori:
+            assente = righe_tipo if col not in valori else righe_tipo & (valori[col] == None) & ~errate[col]  # noqa: E711
+            for i in np.flatnonzero(assente):
+                mancanti[i].append(col)
+    for i, m in mancanti.items():
+        errori[i].append("colonne obbligatorie mancanti: " + ", ".join(m))
+
+    # normalizzazione dei nomi
+    for col in ("alimentazione", "alimentazione_dorsale"):
+        if col in valori:
+            presente = valori[col] != None  # noqa: E711
+            norm = _per_valore(testo[col][presente], _normalizza_alimentazione)
+            valori[col][presente] = norm
+            for i in np.flatnonzero(presente)[norm == None]:  # noqa: E711
+                errori[i].append(f"{col}: non riconosciuta ({str(testo[col][i])!r}), "
+                                 f"ammesse: {', '.join(ALIMENTAZIONI)}")
+                valori[col][i] = None
+    if "architettura" in valori:
+        presente = valori["architettura"] != None  # noqa: E711
+        norm = _per_valore(testo["architettura"][presente], normalizza_architettura)
+        valori["architettura"][presente] = norm
+        for i in np.flatnonzero(presente)[~np.isin(norm.astype(str), ARCHITETTURE)]:
+            errori[i].append(f"architettura: non riconosciuta ({str(testo['architettura'][i])!r}), ammesse: "
+                             + "; ".join(ARCHITETTURE))
+    cavi = {c.lower(): c for c in tipi_cavo()}
+    cavo = np.full(n, CAVO_DEFAULT, dtype=object)
+    if "tipo_cavo" in valori:
+        presente = valori["tipo_cavo"] != None  # noqa: E711
+        norm = _per_valore(testo["tipo_cavo"][presente], lambda v: cavi.get(v.lower()))
+        valori["tipo_cavo"][presente] = norm
+        cavo[presente] = norm
+        for i in np.flatnonzero(presente)[norm == None]:  # noqa: E711
+            errori[i].append(f"tipo_cavo: non a catalogo ({str(testo['tipo_cavo'][i])!r})")
+    if "tipo_posa" in valori:
+        presente = valori["tipo_posa"] != None  # noqa: E711
+        for c in tipi_cavo():  # pose a catalogo per tipo di cavo (righe con tipo_cavo non valido escluse)
+            righe_cavo = presente & (cavo == c)
+            pose = {p.lower(): p for p in tipi_posa(c)}
+            valori["tipo_posa"][righe_cavo] = _per_valore(testo["tipo_posa"][righe_cavo], lambda v: pose.get(v.lower()))
+        for i in np.flatnonzero(presente & (cavo != None) & (valori["tipo_posa"] == None)):  # noqa: E711
+            errori[i].append(f"tipo_posa: non gestita per {cavo[i]} ({str(testo['tipo_posa'][i])!r})")
+
+    # limiti del motore (confronti con NaN = valore assente: nessun errore)
+    def _num(col):
+        return numeri.get(col, np.full(n, np.nan))
+
+    with np.errstate(invalid="ignore"):
+        potenza = _num("potenza_kw")
+        _segnala(errori, potenza <= 0, "potenza_kw: deve essere > 0")
+        for col in ("distanza_m", "distanza_dorsale_m", "distanza_linea_m"):
+            _segnala(errori, _num(col) <= 0, f"{col}: deve essere > 0")
+        idn = _num("rcd_idn_ma")
+        _segnala(errori, ~np.isnan(idn) & ~np.isin(idn, IDN_AMMESSE_MA),
+                 "rcd_idn_ma: IΔn ammesse " + "/".join(map(str, IDN_AMMESSE_MA)) + " mA")
+        alim = valori.get("alimentazione", np.full(n, None, dtype=object))
+        monofase = alim == ALIMENTAZIONI[0]
+        _segnala(errori, monofase & (potenza > POTENZA_MAX_MONOFASE_KW),
+                 f"In monofase la potenza massima ammessa è {POTENZA_MAX_MONOFASE_KW:g} kW".replace(".", ","))
+        # multi: la dorsale (se prevista) porta la somma delle potenze con alimentazione_dorsale o alimentazione
+        alim_d = valori.get("alimentazione_dorsale", np.full(n, None, dtype=object))
+        alim_d = np.where(alim_d == None, alim, alim_d)  # noqa: E711
+        con_dorsale = valori.get("architettura", np.full(n, None, dtype=object)) != ARCHITETTURE[2]
+        totale = potenza * n_col
+        _segnala(errori, multi & con_dorsale & (alim_d == ALIMENTAZIONI[0]) & (totale > POTENZA_MAX_MONOFASE_KW),
+                 "dorsale monofase: potenza totale oltre 7,4 kW (alimentazione_dorsale trifase o meno colonnine)")
+
+    # ritorno alle righe: solo le celle valorizzate (le colonne non applicabili a singola/multi sono None)
+    if colonne:
+        per_riga = zip(*(valori[c].tolist() for c in colonne))
+        presenti = np.stack([valori[c] != None for c in colonne], axis=1).tolist()  # noqa: E711
+    else:
+        per_riga = presenti = [()] * n
+    siti = []
+    for i, (riga, valori_riga, presente, m) in enumerate(zip(righe, per_riga, presenti, multi.tolist())):
+        indice = primo_indice + i
+        siti.append({
+            "riga": indice,
+            "sito": riga.get("sito") or f"Riga {indice}",
+            "multi": m,
+            "parametri": dict(itertools.compress(zip(colonne, valori_riga), presente)),
+            "errori": errori.get(i, []),
+        })
+    return siti
+
+
+def valida_riga(riga: dict[str, str], indice: int) -> dict:
+    """Valida e converte una sola riga (stessi controlli di valida_portafoglio)."""
+    return valida_portafoglio([riga], indice)[0]
+
+
+def rapporto_errori(siti: list[dict]) -> list[dict]:
+    """Una voce per sito scartato in validazione: {"Riga", "Sito", "Errori"}."""
+    return [{"Riga": s["riga"], "Sito": s["sito"], "Errori": "; ".join(s["errori"])} for s in siti if s["errori"]]
+
+
+def rapporto_errori_csv(siti: list[dict]) -> bytes:
+    """rapporto_errori come CSV (separatore ;, UTF-8 con BOM per Excel)."""
+    buf = io.StringIO()
+    w = csv.DictWriter(buf, fieldnames=["Riga", "Sito", "Errori"], delimiter=";")
+    w.writeheader()
+    w.writerows(rapporto_errori(siti))
+    return buf.getvalue().encode("utf-8-sig")
+
+
+def _nome_pdf(sito: dict) -> str:
+    base = re.sub(r"[^A-Za-z0-9_-]+", "_", str(sito["sito"])).strip("_") or "sito"
+    return f"{sito['riga']:04d}_{base[:60]}.pdf"
+
+
+def parametri_pdf(res: dict, parametri: dict) -> dict:
+    """Parametri di genera_pdf_unico_bytes dal risultato del calcolo e dagli input del sito."""
+    return dict(
+        relazione=res["relazione"],
+        unifilare=res["unifilare"],
+        planimetria=res["planimetria"],
+        ok_722=res["ok_722"],
+        warning_722=res["warning_722"],
+        nonconf_722=res["nonconf_722"],
+        committente=f"{parametri['nome']} {parametri['cognome']}".strip(),
+        ubicazione=parametri["indirizzo"],
+        sistema_distribuzione=parametri.get("sistema", "TT"),
+        alimentazione_evse=parametri["alimentazione"],
+        modo_ricarica=parametri.get("modo_ricarica", "Modo 3"),
+        punto_connessione=parametri.get("tipo_punto", "Connettore EV"),
+        installazione_esterna=parametri.get("esterno", False),
+        altezza_punto_connessione_m=parametri.get("altezza_presa_m", 1.0),
+    )
+
+
+def calcola_sito(parametri: dict, multi: bool, pdf: bool = True) -> dict:
+    """
+    Calcolo di un sito (eseguito nei processi del pool): {"sintesi": {...}, "pdf": bytes | None}.
+    Gli errori del motore (ValueError, ...) sono propagati al chiamante.
+    """
+    res = genera_progetto_ev_multi(**parametri) if multi else genera_progetto_ev(**parametri)
+    riferimento = res["dorsale"] if multi and "In_a" in res["dorsale"] else res
+    n_par = riferimento["n_paralleli"]
+    sintesi = {
+        "colonnine": res.get("n_colonnine", 1),
+        "Ib [A]": riferimento["Ib_a"],
+        "In [A]": riferimento["In_a"],
+        "Iz [A]": riferimento["Iz_a"],
+        "Sezione [mm²]": riferimento["sezione_mm2"] if n_par == 1 else f"{n_par} × {riferimento['sezione_mm2']}",
+        "PE [mm²]": riferimento["sezione_pe_mm2"],
+        "ΔV [%]": riferimento["dv_percent"],
+        "Non conformità": len(res["nonconf_722"]) + len(res["nonconf_441"]) + len(res["nonconf_443"]),
+    }
+    documento = genera_pdf_unico_bytes(**parametri_pdf(res, parametri)) if pdf else None
+    return {"sintesi": sintesi, "pdf": documento}
+
+
+def elabora_portafoglio(
+    siti: list[dict],
+    esecutore: Executor,
+    archivio_zip=None,
+    pdf: bool = True,
+    lavori_per_processo: int = 2,
+    n_processi: int = 1,
+    compressione: bool = False,
+):
+    """
+    Generatore: calcola i siti validi (output di valida_portafoglio senza errori) sull'esecutore
+    e produce un esito per sito nell'ordine di completamento:
+    {"riga", "sito", "stato" ("ok"/"errore"), "errore", "pdf" (nome nel ZIP), **sintesi}.
+
+    archivio_zip: percorso o file binario in cui scrivere lo ZIP dei PDF (documenti_ev.ArchivioPdf,
+    un PDF alla volta; compressione = deflate delle voci).
+    In corso al massimo lavori_per_processo × n_processi siti: i risultati non consumati
+    non si accumulano in memoria.
+    """
+    finestra = max(1, int(lavori_per_processo) * int(n_processi))
+    coda = iter(siti)
+    in_corso = {}
+    zf = ArchivioPdf(archivio_zip, compressione=compressione) if (pdf and archivio_zip is not None) else None
+
+    def _riempi():
+        for sito in coda:
+            in_corso[esecutore.submit(calcola_sito, sito["parametri"], sito["multi"], pdf)] = sito
+            if len(in_corso) >= finestra:
+                break
+
+    try:
+        _riempi()
+        while in_corso:
+            fatti, _ = wait(in_corso, return_when=FIRST_COMPLETED)
+            for fut in fatti:
+                sito = in_corso.pop(fut)
+                esito = {"riga": sito["riga"], "sito": sito["sito"], "stato": "ok", "errore": "", "pdf": ""}
+                try:
+                    calcolo = fut.result()
+                except Exception as e:
+                    esito.update(stato="errore", errore=f"{type(e).__name__}: {e}")
+                else:
+                    if zf is not None and calcolo["pdf"] is not None:
+                        esito["pdf"] = _nome_pdf(sito)
+                        zf.aggiungi_bytes(esito["pdf"], calcolo["pdf"])
+                    esito.update(calcolo["sintesi"])
+                del fut
+                yield esito
+            _riempi()
+    finally:
+        for fut in in_corso:
+            fut.cancel()
+        if zf is not None:
+            zf.close()
@@ -0,0 +1,179 @@
+"""
+Modalità debug: profilo di una singola richiesta (calcolo + PDF) con cattura degli input.
+
+CatturaProfilo esegue le fasi di una richiesta sotto cProfile e, insieme, sotto
+un profilatore a campionamento (stack del thread ogni intervallo_s). Alla fine
+salva in una cartella dedicata:
+- profilo.pstats     statistiche cProfile (python -m pstats, snakeviz, ...)
+- profilo.collapsed  stack collassati "f1;f2;f3 n" (flamegraph.pl, speedscope)
+- riepilogo.txt      tempi per fase e prime funzioni per tempo cumulativo
+- ingressi.json      fasi eseguite: funzione ("modulo:funzione") e parametri
+- riproduci.py       rilancia offline le stesse fasi con gli stessi parametri
+                     (python riproduci.py [--profilo])
+
+Attivazione nell'app: variabile d'ambiente EV_PROFILO=1 oppure interruttore nella
+barra laterale, visibile solo aprendo l'app con ?debug=1. Cartella di uscita:
+EV_PROFILO_DIR (default ./profili accanto all'app).
+
+Il lavoro eseguito in altri processi (es. pool Monte Carlo) non compare nel profilo,
+solo il tempo di attesa del processo principale.
+"""
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import zipfile
+from typing import Callable
+
+CARTELLA_PROFILI = os.environ.get(
+    "EV_PROFILO_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profili")
+)
+VALORI_ATTIVO = {"1", "true", "si", "sì", "yes", "on"}
+# un solo cProfile attivo per volta (da Python 3.12 è un vincolo dell'interprete)
+_lock_profilo = threading.Lock()
+
+
+def profilo_da_ambiente() -> bool:
+    """True se la variabile d'ambiente EV_PROFILO attiva la modalità debug."""
+    return os.environ.get("EV_PROFILO", "").strip().lower() in VALORI_ATTIVO
+
+
+def _json(v):
+    if hasattr(v, "tolist"):
+        return v.tolist()
+    raise TypeError(f"Parametro non serializzabile in JSON: {type(v).__name__}")
+
+
+class _Campionatore:
+    """
+    Campiona lo stack di un thread (sys._current_frames) e conta gli stack collassati,
+    troncati sotto il frame radice e con il nome della fase come primo elemento.
+    """
+
+    def __init__(self, id_thread: int, radice, fase: str, intervallo_s: float, conteggi: dict[str, int]):
+        self.id_thread = id_thread
+        self.radice = radice
+        self.fase = fase
+        self.intervallo_s = intervallo_s
+        self.conteggi = conteggi
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._ciclo, name="campionatore_ev", daemon=True)
+
+    def _ciclo(self):
+        while not self._stop.wait(self.intervallo_s):
+            frame = sys._current_frames().get(self.id_thread)
+            stack = []
+            while frame is not None and frame is not self.radice:
+                codice = frame.f_code
+                stack.append(f"{os.path.basename(codice.co_filename)}:{codice.co_name}")
+                frame = frame.f_back
+            if stack:
+                chiave = ";".join([self.fase, *reversed(stack)])
+                self.conteggi[chiave] = self.conteggi.get(chiave, 0) + 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+_RIPRODUCI = '''"""Rilancia offline la richiesta catturata (stesse fasi, stessi parametri)."""
+import argparse
+import cProfile
+import importlib
+import json
+import os
+import pstats
+import sys
+import time
+
+sys.path.insert(0, {radice!r})
+ap = argparse.ArgumentParser()
+ap.add_argument("--profilo", action="store_true", help="esegue sotto cProfile e stampa le prime funzioni")
+args = ap.parse_args()
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingressi.json"), encoding="utf-8") as f:
+    fasi = json.load(f)["fasi"]
+prof = cProfile.Profile() if args.profilo else None
+for fase in fasi:
+    modulo, nome = fase["funzione"].split(":")
+    funz = getattr(importlib.import_module(modulo), nome)
+    t0 = time.perf_counter()
+    if prof is not None:
+        prof.runcall(funz, **fase["parametri"])
+    else:
+        funz(**fase["parametri"])
+    print(f"{{fase['fase']}}: {{(time.perf_counter() - t0) * 1000:.0f}} ms (catturato {{fase['durata_s'] * 1000:.0f}} ms)")
+if prof is not None:
+    pstats.Stats(prof).sort_stats("cumulative").print_stats(30)
+'''
+
+
+class CatturaProfilo:
+    """Profilo e input delle fasi di una richiesta; salva() scrive la cartella di cattura."""
+
+    def __init__(self, etichetta: str = "richiesta", cartella_base: str | None = None, intervallo_s: float = 0.005):
+        nome = time.strftime("%Y%m%d_%H%M%S") + f"_{os.getpid()}_{etichetta}"
+        self.cartella = os.path.join(cartella_base or CARTELLA_PROFILI, nome)
+        self.intervallo_s = intervallo_s
+        self.profilo = cProfile.Profile()
+        self.stack: dict[str, int] = {}
+        self.fasi: list[dict] = []
+
+    def esegui(self, fase: str, funz: Callable, **parametri):
+        """funz(**parametri) sotto profilo; parametri e funzione sono registrati per la riproduzione."""
+        # la fase deve essere riproducibile: funzione di modulo e parametri serializzabili in JSON
+        if "<locals>" in funz.__qualname__:
+            raise ValueError(f"Fase {fase}: la funzione deve essere definita a livello di modulo.")
+        json.dumps(parametri, default=_json)
+        with _lock_profilo:
+            t0 = time.perf_counter()
+            try:
+                with _Campionatore(threading.get_ident(), sys._getframe(), fase, self.intervallo_s, self.stack):
+                    return self.profilo.runcall(funz, **parametri)
+            finally:
+                self.fasi.append({
+                    "fase": fase,
+                    "funzione": f"{funz.__module__}:{funz.__qualname__}",
+                    "durata_s": round(time.perf_counter() - t0, 4),
+                    "parametri": parametri,
+                })
+
+    def salva(self) -> str:
+        """Scrive pstats, stack collassati, riepilogo, ingressi e script di riproduzione. Restituisce la cartella."""
+        os.makedirs(self.cartella, exist_ok=True)
+        self.profilo.dump_stats(os.path.join(self.cartella, "profilo.pstats"))
+        with open(os.path.join(self.cartella, "profilo.collapsed"), "w", encoding="utf-8") as f:
+            for stack, n in sorted(self.stack.items()):
+                f.write(f"{stack} {n}\n")
+        with open(os.path.join(self.cartella, "ingressi.json"), "w", encoding="utf-8") as f:
+            json.dump({"fasi": self.fasi}, f, ensure_ascii=False, indent=2, default=_json)
+        with open(os.path.join(self.cartella, "riproduci.py"), "w", encoding="utf-8") as f:
+            f.write(_RIPRODUCI.format(radice=os.path.dirname(os.path.abspath(__file__))))
+        with open(os.path.join(self.cartella, "riepilogo.txt"), "w", encoding="utf-8") as f:
+            f.write(self.riepilogo())
+        return self.cartella
+
+    def riepilogo(self, n_funzioni: int = 30) -> str:
+        testo = io.StringIO()
+        for fase in self.fasi:
+            testo.write(f"{fase['fase']:<12} {fase['durata_s'] * 1000:9.1f} ms  {fase['funzione']}\n")
+        testo.write(f"campioni: {sum(self.stack.values())} (ogni {self.intervallo_s * 1000:.0f} ms)\n\n")
+        pstats.Stats(self.profilo, stream=testo).sort_stats("cumulative").print_stats(n_funzioni)
+        return testo.getvalue()
+
+    def archivio_zip(self) -> bytes:
+        """La cartella di cattura (dopo salva) come ZIP in memoria, per il download dall'app."""
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            for nome in sorted(os.listdir(self.cartella)):
+                zf.write(os.path.join(self.cartella, nome), os.path.join(os.path.basename(self.cartella), nome))
+        return buf.getvalue()
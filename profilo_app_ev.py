@@ -0,0 +1,215 @@
+"""
+Profilo dei rerun di app.py e carico multi-utente simulato (Streamlit AppTest, headless).
+
+Una sessione ripete l'interazione tipica di un tecnico, misurando ogni rerun:
+- apertura:   primo caricamento della pagina
+- potenza:    modifica di "Potenza EVSE (kW)"
+- colonnine:  passaggio a 3 colonnine
+- calcola:    pressione di "Calcola e genera documenti"
+- pdf:        rerun che mostra il pulsante di download a PDF pronto
+              (attesa_pdf = attesa della generazione in background)
+
+profila_memoria misura una sessione isolata con tracemalloc (memoria trattenuta
+dalla sessione e picco), dopo una sessione di riscaldamento che crea le risorse
+condivise (pool, catalogo). simula_sessioni avvia N sessioni insieme e riporta i
+percentili di latenza per passo. AppTest non è thread-safe: ogni sessione gira
+in un proprio processo (avvio "spawn", un solo AppTest per processo), che esegue
+una sessione di riscaldamento e poi attende la partenza comune. Le risorse che un
+server Streamlit condivide tra sessioni (cache_resource, coalescenza) sono quindi
+per processo. Con identiche=False ogni sessione usa una potenza diversa.
+
+Uso (codice di uscita 1 se una sessione fallisce):
+    python profilo_app_ev.py --sessioni 50
+    python profilo_app_ev.py --sessioni 30 --identiche
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from threading import BrokenBarrierError
+
+from streamlit.testing.v1 import AppTest
+
+FILE_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PASSI = ("apertura", "potenza", "colonnine", "calcola", "pdf")
+
+
+def _widget(elementi, etichetta: str):
+    for w in elementi:
+        if etichetta in w.label:
+            return w
+    raise LookupError(f"Widget non trovato: {etichetta}")
+
+
+def _sessione(at: AppTest, potenza_kw: float, attesa_pdf_s: float) -> dict:
+    """Sequenza di interazioni su una sessione AppTest: {passo: secondi} + dimensione del PDF."""
+    tempi = {}
+
+    def _rerun(passo, azione=None):
+        t0 = time.perf_counter()
+        (azione() if azione is not None else at).run()
+        tempi[passo] = time.perf_counter() - t0
+        if at.exception:
+            raise RuntimeError(f"{passo}: {at.exception[0].value}")
+
+    _rerun("apertura")
+    _rerun("potenza", lambda: _widget(at.number_input, "Potenza EVSE").set_value(potenza_kw))
+    _rerun("colonnine", lambda: _widget(at.number_input, "Numero colonnine").set_value(3))
+    _rerun("calcola", lambda: _widget(at.button, "Calcola").click())
+    if at.error:
+        raise RuntimeError(f"calcola: {at.error[0].value}")
+    t0 = time.perf_counter()
+    pdf = at.session_state["lavoro_pdf"]["future"].result(timeout=attesa_pdf_s)
+    tempi["attesa_pdf"] = time.perf_counter() - t0
+    _rerun("pdf")
+    return {"tempi": tempi, "pdf_byte": len(pdf)}
+
+
+def esegui_sessione(potenza_kw: float = 11.0, timeout_s: float = 120.0, attesa_pdf_s: float = 300.0) -> dict:
+    """Una sessione completa: {"tempi": {passo: s}, "pdf_byte"}."""
+    return _sessione(AppTest.from_file(FILE_APP, default_timeout=timeout_s), potenza_kw, attesa_pdf_s)
+
+
+def profila_memoria(potenza_kw: float = 11.0) -> dict:
+    """Memoria Python di una sessione [MB]: trattenuta a fine sequenza e picco (tracemalloc)."""
+    esegui_sessione(potenza_kw + 0.5)  # riscaldamento: import, catalogo, risorse condivise
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        at = AppTest.from_file(FILE_APP, default_timeout=120)
+        esito = _sessione(at, potenza_kw, 300)
+        gc.collect()
+        corrente, picco = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del at
+    return {
+        "trattenuta_mb": round((corrente - base) / 2**20, 2),
+        "picco_mb": round((picco - base) / 2**20, 2),
+        "tempi": esito["tempi"],
+    }
+
+
+def _percentili(valori: list[float]) -> dict:
+    v = sorted(valori)
+    if not v:
+        return {}
+
+    def _p(q):
+        return round(v[min(len(v) - 1, int(q * len(v)))] * 1000, 1)
+
+    return {"n": len(v), "p50_ms": _p(0.50), "p90_ms": _p(0.90), "p95_ms": _p(0.95), "p99_ms": _p(0.99),
+            "max_ms": round(v[-1] * 1000, 1)}
+
+
+def _rss_mb() -> float:
+    """Picco RSS del processo [MB] (ru_maxrss: kB su Linux, byte su macOS)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def _utente(potenza_kw: float, timeout_s: float, partenza) -> dict:
+    """Processo di una sessione: riscaldamento, attesa della partenza comune, sessione misurata."""
+    errore = None
+    try:
+        esegui_sessione(potenza_kw + 0.25, timeout_s, timeout_s)  # import, catalogo, risorse condivise
+    except Exception as e:
+        errore = e
+    partenza.wait()  # il processo principale rompe la barriera se una sessione non arriva
+    if errore is not None:
+        raise errore
+    esito = esegui_sessione(potenza_kw, timeout_s, timeout_s)
+    esito["rss_mb"] = _rss_mb()
+    return esito
+
+
+def simula_sessioni(n_sessioni: int = 50, identiche: bool = False, timeout_s: float = 300.0) -> dict:
+    """
+    N sessioni concorrenti (partenza simultanea, un processo per sessione). Restituisce
+    percentili per passo, percentili su tutti i rerun, errori, durata totale e picco RSS
+    del processo di sessione più grande.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Manager() as gestore, ProcessPoolExecutor(
+        max_workers=n_sessioni, mp_context=ctx, max_tasks_per_child=1
+    ) as ex:
+        partenza = gestore.Barrier(n_sessioni + 1)
+        futuri = [
+            ex.submit(_utente, 11.0 if identiche else 11.0 + 0.5 * (i % 60), timeout_s, partenza)
+            for i in range(n_sessioni)
+        ]
+        try:
+            partenza.wait(2 * timeout_s)
+        except BrokenBarrierError:
+            pass  # una sessione non è partita: l'errore arriva dal suo risultato
+        t0 = time.perf_counter()
+        esiti, errori = [], []
+        for fut in futuri:
+            try:
+                esiti.append(fut.result())
+            except Exception as e:
+                errori.append(f"{type(e).__name__}: {e}")
+        durata = time.perf_counter() - t0
+
+    per_passo = {p: _percentili([e["tempi"][p] for e in esiti]) for p in PASSI + ("attesa_pdf",)}
+    return {
+        "sessioni": n_sessioni,
+        "identiche": identiche,
+        "durata_s": round(durata, 2),
+        "passi": per_passo,
+        "rerun": _percentili([e["tempi"][p] for e in esiti for p in PASSI]),
+        "errori": errori,
+        "rss_sessione_mb": max((e["rss_mb"] for e in esiti), default=0.0),
+    }
+
+
+def testo_profilo(memoria: dict | None, carico: dict | None) -> str:
+    righe = []
+    if memoria:
+        righe += [
+            "Sessione singola",
+            f"  memoria trattenuta {memoria['trattenuta_mb']} MB, picco {memoria['picco_mb']} MB",
+            "  " + ", ".join(f"{p} {s * 1000:.0f} ms" for p, s in memoria["tempi"].items()),
+        ]
+    if carico:
+        righe += [
+            f"{carico['sessioni']} sessioni concorrenti ({'identiche' if carico['identiche'] else 'input diversi'}): "
+            f"{carico['durata_s']} s, errori {len(carico['errori'])}, "
+            f"RSS picco per sessione {carico['rss_sessione_mb']} MB",
+            f"  {'passo':<14}{'n':>5}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  [ms]",
+        ]
+        for nome, p in list(carico["passi"].items()) + [("tutti i rerun", carico["rerun"])]:
+            if p:
+                righe.append(f"  {nome:<14}{p['n']:>5}{p['p50_ms']:>9}{p['p90_ms']:>9}{p['p95_ms']:>9}"
+                             f"{p['p99_ms']:>9}{p['max_ms']:>9}")
+        righe += [f"  ! {e}" for e in carico["errori"][:5]]
+    return "\n".join(righe)
+
+
+def _main(argv=None):
+    ap = argparse.ArgumentParser(description="Latenza dei rerun di app.py e carico multi-sessione (AppTest).")
+    ap.add_argument("--sessioni", type=int, default=50)
+    ap.add_argument("--identiche", action="store_true", help="stessi input in tutte le sessioni")
+    ap.add_argument("--senza-memoria", action="store_true", help="salta il profilo di memoria")
+    args = ap.parse_args(argv)
+    memoria = None
+    if not args.senza_memoria:
+        # anche la sessione isolata gira in un processo a parte: AppTest sostituisce __main__
+        # del processo che lo esegue, e le sessioni "spawn" lo reimporterebbero
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as ex:
+            memoria = ex.submit(profila_memoria).result()
+    carico = simula_sessioni(args.sessioni, args.identiche) if args.sessioni > 0 else None
+    print(testo_profilo(memoria, carico))
+    return 1 if carico and carico["errori"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,143 @@
+"""
+Prova di carico concorrente del motore (calcolo + PDF) su thread e processi.
+
+Esegue lo stesso lotto di lavori (scenari misti: linea singola, multi-colonnina,
+con e senza PDF, con simulazione annuale dei carichi, distanze variate) con un numero crescente di lavoratori, prima
+su un ThreadPoolExecutor e poi su un ProcessPoolExecutor, e riporta throughput,
+accelerazione rispetto a 1 lavoratore ed efficienza per core.
+
+Ogni esito è confrontato con quello di un'esecuzione sequenziale di riferimento
+(sintesi del calcolo e PDF, a meno di data di creazione e /ID): una divergenza
+indica stato condiviso non rientrante. Con il GIL i thread non scalano sul
+calcolo Python puro; su Python free-threaded (3.13t) la stessa prova misura la
+scalabilità reale dei thread.
+
+Uso:
+    python prova_carico_ev.py --lavori 80 --livelli 1 2 4 8 --modalita thread processi
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from portafoglio_ev import calcola_sito
+
+_BASE = dict(nome="Mario", cognome="Rossi", indirizzo="Via Garibaldi 1, Mantova")
+
+# (etichetta, multi, pdf, parametri, parametro di distanza variato)
+SCENARI = (
+    ("singola 22 kW", False, False, dict(_BASE, potenza_kw=22.0, distanza_m=35.0, alimentazione="Trifase 400 V",
+                                         tipo_posa="A vista"), "distanza_m"),
+    ("singola 7,4 kW interrata", False, False, dict(_BASE, potenza_kw=7.4, distanza_m=20.0, tipo_posa="Interrata",
+                                                    alimentazione="Monofase 230 V", sistema="TN-S"), "distanza_m"),
+    ("singola + PDF", False, True, dict(_BASE, potenza_kw=11.0, distanza_m=50.0, alimentazione="Trifase 400 V",
+                                        tipo_posa="In tubo a vista"), "distanza_m"),
+    ("multi 6 colonnine", True, False, dict(_BASE, n_colonnine=6, potenza_kw=7.4, distanza_dorsale_m=60.0,
+                                            distanza_linea_m=15.0, architettura="Dorsale unica + sottoquadro in prossimità",
+                                            alimentazione="Monofase 230 V", alimentazione_dorsale="Trifase 400 V",
+                                            tipo_posa="Interrata"), "distanza_linea_m"),
+    ("multi 4 colonnine + PDF", True, True, dict(_BASE, n_colonnine=4, potenza_kw=11.0, distanza_dorsale_m=40.0,
+                                                 distanza_linea_m=10.0, architettura="Sottoquadro con linee uniche",
+                                                 alimentazione="Trifase 400 V", tipo_posa="A vista"), "distanza_linea_m"),
+    # simulazione annuale dei carichi (distribuzioni di default di simulazione_carichi_ev, seme fisso)
+    ("multi 8 colonnine + gestione carichi", True, False, dict(_BASE, n_colonnine=8, potenza_kw=7.4,
+                                                              distanza_dorsale_m=50.0, distanza_linea_m=12.0,
+                                                              architettura="Dorsale unica + sottoquadro in prossimità",
+                                                              alimentazione="Monofase 230 V",
+                                                              alimentazione_dorsale="Trifase 400 V", tipo_posa="A vista",
+                                                              gestione_carichi=True, portata_ciclica_dorsale=True,
+                                                              profilo_carichi={"limite_kw": 22.0}), "distanza_dorsale_m"),
+)
+
+_VARIABILI_PDF = re.compile(rb"/(CreationDate|ModDate) \(D:[^)]*\)|/ID\s*\[<[0-9a-fA-F]*><[0-9a-fA-F]*>\]")
+
+
+def lavoro(i: int) -> tuple[int, str, str, str]:
+    """Lavoro i del lotto: (i, scenario, impronta della sintesi, impronta del PDF normalizzato)."""
+    etichetta, multi, pdf, parametri, distanza = SCENARI[i % len(SCENARI)]
+    parametri = {**parametri, distanza: parametri[distanza] + (i // len(SCENARI)) % 10}
+    esito = calcola_sito(parametri, multi, pdf=pdf)
+    documento = esito["pdf"]
+    impronta_pdf = hashlib.sha1(_VARIABILI_PDF.sub(b"", documento)).hexdigest() if documento else ""
+    return i, etichetta, repr(sorted(esito["sintesi"].items())), impronta_pdf
+
+
+def _avvio(_):
+    return os.getpid()
+
+
+def misura(modalita: str, n_lavoratori: int, n_lavori: int, riferimento: dict | None = None) -> dict:
+    """Esegue il lotto con n_lavoratori thread o processi; divergenze = esiti diversi dal riferimento."""
+    classe = ThreadPoolExecutor if modalita == "thread" else ProcessPoolExecutor
+    with classe(max_workers=n_lavoratori) as esecutore:
+        list(esecutore.map(_avvio, range(n_lavoratori)))  # avvio dei processi fuori dalla misura
+        t0 = time.perf_counter()
+        esiti = list(esecutore.map(lavoro, range(n_lavori)))
+        durata = time.perf_counter() - t0
+    divergenze = 0
+    if riferimento is not None:
+        divergenze = sum(1 for e in esiti if riferimento[e[0]] != e)
+    return {
+        "modalita": modalita,
+        "lavoratori": n_lavoratori,
+        "durata_s": round(durata, 3),
+        "lavori_s": round(n_lavori / durata, 2),
+        "divergenze": divergenze,
+    }
+
+
+def prova_carico(n_lavori: int = 60, livelli: tuple[int, ...] | None = None,
+                 modalita: tuple[str, ...] = ("thread", "processi")) -> dict:
+    """
+    Misure per ogni modalità e numero di lavoratori (default 1, 2, 4, ... fino ai core),
+    con accelerazione ed efficienza rispetto a 1 lavoratore della stessa modalità.
+    """
+    n_core = os.cpu_count() or 1
+    if livelli is None:
+        livelli = tuple(sorted({1, n_core} | {2 ** k for k in range(1, n_core.bit_length()) if 2 ** k <= n_core}))
+    riferimento = {e[0]: e for e in map(lavoro, range(n_lavori))}
+    misure = []
+    for m in modalita:
+        base = None
+        for n in livelli:
+            r = misura(m, n, n_lavori, riferimento)
+            base = base or r["lavori_s"]
+            r["accelerazione"] = round(r["lavori_s"] / base, 2)
+            r["efficienza"] = round(r["accelerazione"] / n, 2)
+            misure.append(r)
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    return {"core": n_core, "gil": gil, "lavori": n_lavori, "misure": misure}
+
+
+def testo_prova_carico(esito: dict) -> str:
+    righe = [
+        f"Prova di carico: {esito['lavori']} lavori, {esito['core']} core, GIL {'attivo' if esito['gil'] else 'disattivo'}",
+        f"{'modalità':<10}{'lavoratori':>11}{'lavori/s':>10}{'accel.':>8}{'effic.':>8}{'diverg.':>9}",
+    ]
+    for r in esito["misure"]:
+        righe.append(
+            f"{r['modalita']:<10}{r['lavoratori']:>11}{r['lavori_s']:>10.2f}{r['accelerazione']:>8.2f}"
+            f"{r['efficienza']:>8.2f}{r['divergenze']:>9}"
+        )
+    return "\n".join(righe)
+
+
+def _main(argv=None):
+    ap = argparse.ArgumentParser(description="Prova di carico concorrente del motore EV.")
+    ap.add_argument("--lavori", type=int, default=60)
+    ap.add_argument("--livelli", type=int, nargs="+", default=None)
+    ap.add_argument("--modalita", nargs="+", choices=("thread", "processi"), default=("thread", "processi"))
+    args = ap.parse_args(argv)
+    esito = prova_carico(args.lavori, tuple(args.livelli) if args.livelli else None, tuple(args.modalita))
+    print(testo_prova_carico(esito))
+    if any(r["divergenze"] for r in esito["misure"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,155 @@
+"""
+Raggruppamento per tratti: quante linee condividono ciascun tratto di percorso.
+
+Ogni linea è descritta dal suo percorso come polilinea [(x, y), ...] in metri
+(es. percorsi_ev.instrada convertito con passo_m, oppure rilievo).
+
+- Segmenti orizzontali/verticali: per ogni retta (orientamento + coordinata,
+  con tolleranza) una sweep-line sugli estremi trova i tratti condivisi e il
+  numero di circuiti presenti su ciascun tratto elementare.
+- Segmenti obliqui: hash spaziale su celle di lato tolleranza_m (campionamento
+  lungo il segmento); le celle condivise contano come tratti comuni.
+
+Per ogni linea si ricava il raggruppamento peggiore lungo il percorso, da
+passare a _fattore_raggr (n_linee_per_linea di genera_progetto_ev_multi).
+Incroci perpendicolari non contano come raggruppamento.
+"""
+from __future__ import annotations
+
+import math
+from collections import defaultdict
+
+
+def _segmenti(poli):
+    for (x0, y0), (x1, y1) in zip(poli[:-1], poli[1:]):
+        if (x0, y0) != (x1, y1):
+            yield float(x0), float(y0), float(x1), float(y1)
+
+
+def raggruppamento_percorsi(
+    percorsi,
+    tolleranza_m: float = 0.3,
+    lunghezza_min_m: float = 1.0,
+) -> dict:
+    """
+    percorsi: lista di polilinee (una per linea).
+    tolleranza_m: distanza entro cui due tratti paralleli sono nello stesso cavidotto.
+    lunghezza_min_m: tratti comuni più corti sono trascurati (es. ingresso quadro).
+
+    Restituisce:
+    - "n_linee_per_linea": raggruppamento peggiore per ciascuna linea (≥ 1);
+    - "tratti_condivisi": [{"orientamento", "coordinata", "da", "a", "n_circuiti", "linee"}];
+    - "n_max": raggruppamento massimo sul sito.
+    """
+    if tolleranza_m <= 0:
+        raise ValueError("tolleranza_m deve essere > 0.")
+    n = len(percorsi)
+    peggiore = [1] * n
+
+    # ---------------------------
+    # Segmenti ortogonali: raggruppati per retta (coordinata quantizzata)
+    # ---------------------------
+    rette = defaultdict(list)      # (orient, k) -> [(a, b, linea)]
+    celle_oblique = defaultdict(set)  # (ix, iy) -> {linee}
+    for idx, poli in enumerate(percorsi):
+        for x0, y0, x1, y1 in _segmenti(poli):
+            if abs(y1 - y0) <= 1e-9:
+                rette[("H", round(y0 / tolleranza_m))].append((min(x0, x1), max(x0, x1), idx))
+            elif abs(x1 - x0) <= 1e-9:
+                rette[("V", round(x0 / tolleranza_m))].append((min(y0, y1), max(y0, y1), idx))
+            else:
+                lung = math.hypot(x1 - x0, y1 - y0)
+                passi = max(1, int(math.ceil(lung / (tolleranza_m / 2.0))))
+                for s in range(passi + 1):
+                    t = s / passi
+                    celle_oblique[(
+                        int(math.floor((x0 + t * (x1 - x0)) / tolleranza_m)),
+                        int(math.floor((y0 + t * (y1 - y0)) / tolleranza_m)),
+                    )].add(idx)
+
+    tratti = []
+    for (orient, k), segs in rette.items():
+        # eventi: (posizione, +1/-1, linea); fine prima dell'inizio a parità di posizione
+        eventi = []
+        for a, b, idx in segs:
+            eventi.append((a, 1, idx))
+            eventi.append((b, -1, idx))
+        eventi.sort(key=lambda e: (e[0], e[1]))
+        attive = defaultdict(int)  # linea -> molteplicità (segmenti sovrapposti della stessa linea)
+        pos_prec = None
+        for pos, tipo, idx in eventi:
+            if pos_prec is not None and pos > pos_prec and len(attive) > 1:
+                tratti.append((orient, k, pos_prec, pos, frozenset(attive)))
+            if tipo == 1:
+                attive[idx] += 1
+            else:
+                attive[idx] -= 1
+                if attive[idx] == 0:
+                    del attive[idx]
+            pos_prec = pos
+
+    # fusione dei tratti elementari contigui con lo stesso insieme di linee
+    tratti.sort(key=lambda t: (t[0], t[1], t[2]))
+    fusi = []
+    for t in tratti:
+        if fusi and fusi[-1][0] == t[0] and fusi[-1][1] == t[1] and fusi[-1][3] >= t[2] - 1e-9 and fusi[-1][4] == t[4]:
+            fusi[-1] = (t[0], t[1], fusi[-1][2], t[3], t[4])
+        else:
+            fusi.append(t)
+
+    tratti_condivisi = []
+    for orient, k, a, b, linee in fusi:
+        if b - a < lunghezza_min_m:
+            continue
+        c = len(linee)
+        for idx in linee:
+            if c > peggiore[idx]:
+                peggiore[idx] = c
+        tratti_condivisi.append({
+            "orientamento": "orizzontale" if orient == "H" else "verticale",
+            "coordinata": round(k * tolleranza_m, 3),
+            "da": round(a, 3),
+            "a": round(b, 3),
+            "n_circuiti": c,
+            "linee": sorted(i + 1 for i in linee),
+        })
+
+    # ---------------------------
+    # Segmenti obliqui: hash spaziale
+    # ---------------------------
+    celle_min = max(1, int(math.ceil(lunghezza_min_m / tolleranza_m)))
+    conteggio_celle = defaultdict(int)  # (linea, n) -> celle condivise con n circuiti
+    for linee in celle_oblique.values():
+        if len(linee) > 1:
+            for idx in linee:
+                conteggio_celle[(idx, len(linee))] += 1
+    for (idx, c), celle in conteggio_celle.items():
+        if celle >= celle_min and c > peggiore[idx]:
+            peggiore[idx] = c
+
+    return {
+        "n_linee_per_linea": peggiore,
+        "tratti_condivisi": tratti_condivisi,
+        "n_max": max(peggiore) if peggiore else 1,
+    }
+
+
+def percorsi_in_metri(instradamento: dict) -> list[list[tuple[float, float]]]:
+    """Converte le polilinee di percorsi_ev.instrada (celle riga/colonna) in metri (x, y)."""
+    p = float(instradamento["passo_m"])
+    return [[(c * p, r * p) for r, c in poli] for poli in instradamento["percorsi"]]
+
+
+def testo_raggruppamento(ragg: dict, max_righe: int = 30) -> str:
+    """Riepilogo dei tratti condivisi per relazione/planimetria."""
+    righe = ["RAGGRUPPAMENTO PER TRATTI (percorsi condivisi)"]
+    tratti = sorted(ragg["tratti_condivisi"], key=lambda t: -t["n_circuiti"])
+    for t in tratti[:max_righe]:
+        righe.append(
+            f"- Tratto {t['orientamento']} a {t['coordinata']:.1f} m, da {t['da']:.1f} a {t['a']:.1f} m:"
+            f" {t['n_circuiti']} circuiti"
+        )
+    if len(tratti) > max_righe:
+        righe.append(f"- ... altri {len(tratti) - max_righe} tratti condivisi")
+    righe.append(f"- Raggruppamento massimo sul sito: {ragg['n_max']} circuiti")
+    return "\n".join(righe)
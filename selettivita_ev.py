@@ -0,0 +1,98 @@
+"""
+Selettività amperometrica/cronometrica tra protezione a monte (dorsale) e
+protezioni a valle (linee colonnine).
+
+Per ogni coppia monte/valle le curve di curve_intervento_ev sono confrontate su
+una griglia logaritmica di correnti comune, da In valle fino alla Icc max nel
+punto di installazione della protezione a valle. La coppia perde selettività
+alla prima corrente in cui la protezione a monte può intervenire (tempo minimo
+a monte) non dopo la protezione a valle (tempo massimo a valle): quella
+corrente è il limite di selettività Is. Se non esiste, la selettività è totale.
+
+Il confronto è vettoriale su una matrice (coppie distinte × punti griglia):
+coppie uguali (stessa curva, In e Icc) sono valutate una sola volta.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+from curve_intervento_ev import curva_per_in, tempo_intervento
+
+PUNTI_GRIGLIA = 400
+
+
+def analisi_selettivita(
+    curva_monte: str,
+    In_monte: float,
+    curve_valle,
+    In_valle,
+    icc_max_valle_a,
+    punti: int = PUNTI_GRIGLIA,
+) -> dict:
+    """
+    curve_valle, In_valle, icc_max_valle_a: un valore per ogni protezione a valle.
+
+    Restituisce array per protezione a valle:
+    - "totale": selettività fino alla Icc max;
+    - "limite_a": Is (corrente del primo punto non selettivo), np.inf se totale.
+    Per MCB oltre 160 A la curva è quella dello scatolato (curva_per_in).
+    """
+    In_valle = np.asarray(In_valle, dtype=float)
+    icc = np.asarray(icc_max_valle_a, dtype=float)
+    curve_valle = np.array([curva_per_in(i, c) for c, i in zip(np.broadcast_to(curve_valle, In_valle.shape), In_valle)])
+    if np.any(icc <= 0) or np.any(In_valle <= 0):
+        raise ValueError("Selettività: In e Icc devono essere > 0.")
+    curva_monte = curva_per_in(In_monte, curva_monte)
+    n = In_valle.shape[0]
+
+    # coppie distinte (curva, In, Icc) -> una riga della matrice
+    chiavi = {}
+    inversa = np.empty(n, dtype=np.int64)
+    for j in range(n):
+        inversa[j] = chiavi.setdefault((curve_valle[j], In_valle[j], icc[j]), len(chiavi))
+    uniche = list(chiavi)
+    lim_u = np.full(len(uniche), np.inf)
+
+    # griglia comune in multipli normalizzati [0, 1] -> correnti per riga (In valle .. Icc)
+    f = np.linspace(0.0, 1.0, int(punti))
+    for curva in {c for c, _, _ in uniche}:
+        righe = np.array([k for k, (c, _, _) in enumerate(uniche) if c == curva])
+        In_v = np.array([uniche[k][1] for k in righe])[:, None]
+        icc_v = np.array([uniche[k][2] for k in righe])[:, None]
+        i_min = np.minimum(In_v, icc_v)
+        correnti = i_min * (icc_v / i_min) ** f[None, :]         # (righe, punti)
+        t_valle = tempo_intervento(curva, In_v, correnti, "max")
+        t_monte = tempo_intervento(curva_monte, In_monte, correnti, "min")
+        non_sel = np.isfinite(t_monte) & (t_monte <= t_valle)
+        primo = np.argmax(non_sel, axis=1)
+        trovato = non_sel[np.arange(len(righe)), primo]
+        lim_u[righe] = np.where(trovato, correnti[np.arange(len(righe)), primo], np.inf)
+
+    limite = lim_u[inversa]
+    return {
+        "curva_monte": curva_monte,
+        "In_monte_a": float(In_monte),
+        "totale": ~np.isfinite(limite),
+        "limite_a": limite,
+    }
+
+
+def testo_selettivita(sel: dict, nomi: list[str], icc_max_valle_a) -> str:
+    """Sintesi per relazione: coppie non selettive raggruppate per limite."""
+    righe = [
+        "SELETTIVITÀ PROTEZIONI (dorsale → linee)",
+        f"- Protezione a monte: In = {sel['In_monte_a']:.0f} A, curva {sel['curva_monte']}",
+    ]
+    tot = [n for n, t in zip(nomi, sel["totale"]) if t]
+    if tot:
+        righe.append(f"- Selettività totale (fino a Icc max): {len(tot)} linee")
+    gruppi = {}
+    for nome, t, lim, icc in zip(nomi, sel["totale"], sel["limite_a"], icc_max_valle_a):
+        if not t:
+            gruppi.setdefault((round(float(lim)), round(float(icc))), []).append(nome)
+    for (lim, icc), linee in sorted(gruppi.items()):
+        elenco = ", ".join(linee[:10]) + (f" ... (+{len(linee) - 10})" if len(linee) > 10 else "")
+        righe.append(f"- Selettività parziale fino a Is ≈ {lim} A (Icc max {icc / 1000:.2f} kA): {elenco}")
+    if gruppi:
+        righe.append("  Valutare curve/tarature a monte (es. scatolato con ritardo) o tabelle di selettività del costruttore.")
+    return "\n".join(righe)
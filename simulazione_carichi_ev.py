@@ -0,0 +1,289 @@
+"""
+Simulazione annuale (risoluzione 1 minuto) delle sessioni di ricarica di un
+gruppo di colonnine con gestione carichi (load management).
+
+Scopo: stimare la potenza realmente contemporanea sulla dorsale, invece di
+assumere potenza_kw * n_colonnine.
+
+Modello (pre-dimensionamento):
+- per ogni colonnina e giorno il numero di sessioni è Poisson(sessioni_giorno),
+  limitato a max_sessioni; arrivo, durata di sosta ed energia richiesta sono
+  campionati dalle distribuzioni fornite;
+- un veicolo ricarica alla potenza ammessa dalla politica finché ha energia
+  residua e finché resta in sosta; una nuova sessione su una colonnina ancora
+  occupata viene scartata (posto non disponibile);
+- i 365 giorni sono simulati in parallelo (vettorizzazione NumPy): ogni giorno
+  è preceduto dal giorno precedente come pre-riscaldamento, così le soste a
+  cavallo della mezzanotte sono considerate. Le soste sono limitate a 24 h.
+
+Politiche di gestione carichi:
+- "nessuna": ogni veicolo connesso assorbe la potenza nominale;
+- "limite": limite di potenza del sito, servizio in ordine di arrivo (FIFO);
+- "proporzionale": limite del sito ripartito in proporzione alla richiesta;
+- "round_robin": limite del sito, precedenza a rotazione ogni slot_min minuti.
+"""
+from __future__ import annotations
+
+import math
+from collections.abc import Mapping
+from types import MappingProxyType
+
+import numpy as np
+
+MINUTI_GIORNO = 1440
+GIORNI_ANNO = 365
+
+POLITICHE = ("nessuna", "limite", "proporzionale", "round_robin")
+
+# Distribuzioni di default (tipico condominiale/aziendale, ricarica serale)
+ARRIVO_DEFAULT = MappingProxyType({"tipo": "normale", "media": 18.5, "dev_std": 2.5, "min": 0.0, "max": 23.99})   # ora del giorno
+DURATA_DEFAULT = MappingProxyType({"tipo": "lognormale", "media": 10.0, "dev_std": 4.0, "min": 0.25, "max": 24.0})  # ore di sosta
+ENERGIA_DEFAULT = MappingProxyType({"tipo": "normale", "media": 15.0, "dev_std": 7.0, "min": 1.0, "max": 80.0})    # kWh per sessione
+
+
+def campiona(dist, n, rng: np.random.Generator) -> np.ndarray:
+    """
+    Campiona n valori da una distribuzione descritta da un dizionario.
+
+    Tipi gestiti:
+    - {"tipo": "costante", "valore": x}
+    - {"tipo": "uniforme", "min": a, "max": b}
+    - {"tipo": "normale", "media": m, "dev_std": s}
+    - {"tipo": "lognormale", "media": m, "dev_std": s}   (media/dev. std della variabile, non del log)
+    - {"tipo": "triangolare", "min": a, "moda": c, "max": b}
+    - {"tipo": "esponenziale", "media": m}
+    - {"tipo": "empirica", "valori": [...], "pesi": [...] (opzionale)}
+
+    Un numero semplice equivale a "costante". "min"/"max" opzionali troncano
+    (clip) i valori campionati per tutti i tipi.
+    """
+    if isinstance(dist, (int, float)):
+        return np.full(n, float(dist))
+    if not isinstance(dist, Mapping) or "tipo" not in dist:
+        raise ValueError(f"Distribuzione non valida: {dist!r}")
+
+    tipo = str(dist["tipo"]).strip().lower()
+    if tipo == "costante":
+        x = np.full(n, float(dist["valore"]))
+    elif tipo == "uniforme":
+        x = rng.uniform(float(dist["min"]), float(dist["max"]), n)
+    elif tipo == "normale":
+        x = rng.normal(float(dist["media"]), float(dist["dev_std"]), n)
+    elif tipo == "lognormale":
+        m, s = float(dist["media"]), float(dist["dev_std"])
+        if m <= 0:
+            raise ValueError("Distribuzione lognormale: media deve essere > 0.")
+        sigma2 = math.log(1.0 + (s / m) ** 2)
+        x = rng.lognormal(math.log(m) - sigma2 / 2.0, math.sqrt(sigma2), n)
+    elif tipo == "triangolare":
+        x = rng.triangular(float(dist["min"]), float(dist["moda"]), float(dist["max"]), n)
+    elif tipo == "esponenziale":
+        x = rng.exponential(float(dist["media"]), n)
+    elif tipo == "empirica":
+        valori = np.asarray(dist["valori"], dtype=float)
+        pesi = dist.get("pesi")
+        p = None
+        if pesi is not None:
+            p = np.asarray(pesi, dtype=float)
+            p = p / p.sum()
+        x = rng.choice(valori, size=n, p=p)
+    else:
+        raise ValueError(f"Tipo distribuzione non gestito: {dist['tipo']}")
+
+    if "min" in dist or "max" in dist:
+        x = np.clip(x, dist.get("min", -np.inf), dist.get("max", np.inf))
+    return x
+
+
+def _genera_sessioni(n_colonnine, sessioni_giorno, max_sessioni, arrivo, durata, energia, rng):
+    """
+    Sessioni per (giorno, colonnina, slot): restituisce array (365, N, K) di
+    inizio [min], fine [min] ed energia [kWh]; gli slot non usati hanno energia 0.
+    """
+    forma = (GIORNI_ANNO, n_colonnine, max_sessioni)
+    n_tot = GIORNI_ANNO * n_colonnine * max_sessioni
+
+    n_sess = np.minimum(rng.poisson(float(sessioni_giorno), (GIORNI_ANNO, n_colonnine)), max_sessioni)
+    usato = np.arange(max_sessioni)[None, None, :] < n_sess[:, :, None]
+
+    inizio = np.floor(np.clip(campiona(arrivo, n_tot, rng), 0.0, 24.0) * 60.0).reshape(forma)
+    inizio = np.minimum(inizio, MINUTI_GIORNO - 1).astype(np.int64)
+    sosta = np.clip(campiona(durata, n_tot, rng), 1.0 / 60.0, 24.0).reshape(forma)
+    fine = inizio + np.maximum(1, np.round(sosta * 60.0)).astype(np.int64)
+    kwh = np.clip(campiona(energia, n_tot, rng), 0.0, None).reshape(forma)
+    kwh = np.where(usato, kwh, 0.0)
+    return inizio, fine, kwh
+
+
+def _alloca_in_ordine(richiesta: np.ndarray, ordine: np.ndarray, limite: float) -> np.ndarray:
+    """Serve le colonnine nell'ordine dato finché non si raggiunge il limite (ultima parzializzata)."""
+    r = np.take_along_axis(richiesta, ordine, axis=1)
+    prima = np.cumsum(r, axis=1) - r
+    a = np.clip(limite - prima, 0.0, r)
+    out = np.empty_like(richiesta)
+    np.put_along_axis(out, ordine, a, axis=1)
+    return out
+
+
+def simula_anno(
+    n_colonnine: int,
+    potenza_kw,
+    politica: str = "nessuna",
+    limite_kw: float | None = None,
+    sessioni_giorno: float = 1.0,
+    max_sessioni: int = 3,
+    arrivo=None,
+    durata=None,
+    energia=None,
+    slot_min: int = 15,
+    percentile_progetto: float | None = None,
+    seed: int | None = 0,
+    restituisci_serie: bool = False,
+) -> dict:
+    """
+    Simula un anno a passo 1 minuto e restituisce le statistiche di potenza del sito.
+
+    potenza_kw: potenza nominale per colonnina (scalare o sequenza di lunghezza n_colonnine).
+    politica: una di POLITICHE; per politiche diverse da "nessuna" serve limite_kw.
+    percentile_progetto: se None la potenza di progetto è il picco simulato,
+      altrimenti il percentile indicato (es. 99.9).
+
+    Restituisce un dizionario con picco, percentili, fattore di contemporaneità,
+    energia non servita e "potenza_progetto_kw" (da usare per la dorsale).
+    """
+    n = int(n_colonnine)
+    if n < 1:
+        raise ValueError("Numero colonnine deve essere ≥ 1.")
+    pol = (politica or "nessuna").strip().lower().replace("-", "_").replace(" ", "_")
+    if pol not in POLITICHE:
+        raise ValueError(f"Politica gestione carichi non gestita: {politica}")
+    pmax = np.broadcast_to(np.asarray(potenza_kw, dtype=float), (n,)).copy()
+    if np.any(pmax <= 0):
+        raise ValueError("Potenza colonnine deve essere > 0.")
+    if pol != "nessuna":
+        if limite_kw is None or limite_kw <= 0:
+            raise ValueError("Per la gestione carichi serve un limite di potenza del sito > 0 (limite_kw).")
+        limite = float(limite_kw)
+    else:
+        limite = float("inf")
+    if int(max_sessioni) < 1 or int(slot_min) < 1:
+        raise ValueError("max_sessioni e slot_min devono essere ≥ 1.")
+
+    rng = np.random.default_rng(seed)
+    inizio, fine, kwh = _genera_sessioni(
+        n, sessioni_giorno, int(max_sessioni),
+        ARRIVO_DEFAULT if arrivo is None else arrivo,
+        DURATA_DEFAULT if durata is None else durata,
+        ENERGIA_DEFAULT if energia is None else energia,
+        rng,
+    )
+
+    # ---------------------------
+    # Eventi per corsia: corsia g = [giorno g-1 (pre-riscaldamento), giorno g]
+    # ---------------------------
+    giorni = np.arange(GIORNI_ANNO)
+    prec = np.roll(giorni, 1)  # il giorno 0 usa il 364 (regime stazionario)
+    corsia = np.concatenate([np.broadcast_to(giorni[:, None, None], inizio.shape)] * 2).ravel()
+    col = np.concatenate([np.broadcast_to(np.arange(n)[None, :, None], inizio.shape)] * 2).ravel()
+    ev_t = np.concatenate([inizio[prec], inizio + MINUTI_GIORNO]).ravel()
+    ev_fine = np.concatenate([fine[prec], fine + MINUTI_GIORNO]).ravel()
+    ev_kwh = np.concatenate([kwh[prec], kwh]).ravel()
+
+    valido = ev_kwh > 0
+    corsia, col, ev_t, ev_fine, ev_kwh = corsia[valido], col[valido], ev_t[valido], ev_fine[valido], ev_kwh[valido]
+    ordine = np.argsort(ev_t, kind="stable")
+    corsia, col, ev_t, ev_fine, ev_kwh = corsia[ordine], col[ordine], ev_t[ordine], ev_fine[ordine], ev_kwh[ordine]
+    passi = 2 * MINUTI_GIORNO
+    ptr = np.searchsorted(ev_t, np.arange(passi + 1))
+
+    # ---------------------------
+    # Stato per (corsia, colonnina)
+    # ---------------------------
+    residuo = np.zeros((GIORNI_ANNO, n))
+    partenza = np.zeros((GIORNI_ANNO, n), dtype=np.int64)
+    arrivo_min = np.full((GIORNI_ANNO, n), np.inf)
+    serie = np.zeros((GIORNI_ANNO, MINUTI_GIORNO))
+    richiesta_kwh = 0.0
+    idx_col = np.arange(n)
+
+    for t in range(passi):
+        a, b = ptr[t], ptr[t + 1]
+        if a != b:
+            cl, cc = corsia[a:b], col[a:b]
+            libero = partenza[cl, cc] <= t
+            cl, cc = cl[libero], cc[libero]
+            residuo[cl, cc] = ev_kwh[a:b][libero]
+            partenza[cl, cc] = ev_fine[a:b][libero]
+            arrivo_min[cl, cc] = t
+            if t >= MINUTI_GIORNO:
+                richiesta_kwh += float(ev_kwh[a:b][libero].sum())
+
+        attivo = (residuo > 1e-9) & (partenza > t)
+        richiesta = np.where(attivo, np.minimum(pmax, residuo * 60.0), 0.0)
+
+        if pol == "nessuna":
+            p = richiesta
+        elif pol == "proporzionale":
+            tot = richiesta.sum(axis=1, keepdims=True)
+            p = richiesta * np.minimum(1.0, limite / np.maximum(tot, 1e-12))
+        elif pol == "limite":
+            ordine_fifo = np.argsort(np.where(attivo, arrivo_min, np.inf), axis=1, kind="stable")
+            p = _alloca_in_ordine(richiesta, ordine_fifo, limite)
+        else:  # round_robin
+            offset = (t // int(slot_min)) % n
+            ordine_rr = np.broadcast_to(np.roll(idx_col, -offset), richiesta.shape)
+            p = _alloca_in_ordine(richiesta, ordine_rr, limite)
+
+        residuo -= p / 60.0
+        if t >= MINUTI_GIORNO:
+            serie[:, t - MINUTI_GIORNO] = p.sum(axis=1)
+
+    flat = serie.ravel()
+    installata = float(pmax.sum())
+    picco = float(flat.max())
+    p95, p99, p999 = (float(v) for v in np.percentile(flat, [95.0, 99.0, 99.9]))
+    erogata_kwh = float(flat.sum()) / 60.0
+    # stima: l'energia erogata nel giorno include code del giorno precedente
+    non_servita = max(0.0, richiesta_kwh - erogata_kwh)
+
+    if percentile_progetto is None:
+        progetto = picco
+        criterio = "picco"
+    else:
+        progetto = float(np.percentile(flat, float(percentile_progetto)))
+        criterio = f"percentile {float(percentile_progetto):g}"
+
+    out = {
+        "politica": pol,
+        "limite_kw": (None if pol == "nessuna" else limite),
+        "n_colonnine": n,
+        "potenza_installata_kw": round(installata, 2),
+        "picco_kw": round(picco, 2),
+        "p95_kw": round(p95, 2),
+        "p99_kw": round(p99, 2),
+        "p999_kw": round(p999, 2),
+        "media_kw": round(float(flat.mean()), 2),
+        "fattore_contemporaneita": round(picco / installata, 3),
+        "energia_richiesta_kwh": round(richiesta_kwh, 1),
+        "energia_erogata_kwh": round(erogata_kwh, 1),
+        "energia_non_servita_pct": round(100.0 * non_servita / richiesta_kwh, 2) if richiesta_kwh > 0 else 0.0,
+        "criterio_progetto": criterio,
+        "potenza_progetto_kw": round(min(progetto, installata), 2),
+    }
+    if restituisci_serie:
+        out["serie_kw"] = flat
+    return out
+
+
+def testo_simulazione(sim: dict) -> str:
+    """Blocco testuale per relazione (sintesi della simulazione)."""
+    limite = f"{sim['limite_kw']:.1f} kW" if sim.get("limite_kw") is not None else "—"
+    return "\n".join([
+        "SIMULAZIONE ANNUALE GESTIONE CARICHI (passo 1 min)",
+        f"- Politica: {sim['politica']} | Limite sito: {limite}",
+        f"- Potenza installata: {sim['potenza_installata_kw']:.1f} kW",
+        f"- Picco simulato: {sim['picco_kw']:.1f} kW | P99,9 = {sim['p999_kw']:.1f} kW | P99 = {sim['p99_kw']:.1f} kW | P95 = {sim['p95_kw']:.1f} kW",
+        f"- Fattore di contemporaneità (picco/installata) = {sim['fattore_contemporaneita']:.3f}",
+        f"- Energia non servita (stima) = {sim['energia_non_servita_pct']:.2f}%",
+        f"- Potenza di progetto dorsale ({sim['criterio_progetto']}) = {sim['potenza_progetto_kw']:.1f} kW",
+    ])
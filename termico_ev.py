@@ -0,0 +1,199 @@
+"""
+Portata ciclica dei cavi che alimentano carichi EV.
+
+La ricarica è un carico ciclico (poche ore a piena potenza, poi a vuoto): la
+portata Iz di catalogo × fattori k vale invece per carico continuo. Qui la
+sovratemperatura del conduttore è integrata su un profilo di carico periodico
+(giornaliero o settimanale) con un modello termico a parametri concentrati:
+
+    ΔT = ΔT_cavo + ΔT_ambiente
+    dΔT_k/dt = (q_k · ΔT_ss · u(t) − ΔT_k) / τ_k          u = (I / Iz)²
+
+- nodo cavo: τ_cavo = C_cavo · R_th,cavo, con R_th ricavata dalla portata a
+  catalogo (a I = Iz il conduttore è a θ_max) e C_cavo dalla capacità termica
+  del conduttore (più isolante e guaina, FATTORE_CAPACITA_CAVO);
+- nodo ambiente (solo pose interrate): terreno/cavidotto, quota q e τ da
+  PARAMETRI_TERRENO.
+
+Il modello è lineare in u: la risposta a regime periodico h(t) (frazione di
+ΔT_ss) è calcolata esattamente per passi a carico costante e vale per ogni
+scala di corrente. Con il profilo normalizzato al picco (forma ≤ 1):
+
+    M = 1 / √max(h)       fattore di portata ciclica (Iz_ciclica = M · Iz)
+    θ_picco = T_rif + (θ_max − T_rif) · (I_picco / (M · Iz))²
+
+Il calcolo è vettoriale (NumPy) su linee e profili (forma di lotto comune);
+il ciclo è solo sui passi temporali.
+"""
+from __future__ import annotations
+
+from types import MappingProxyType
+
+import numpy as np
+
+from caduta_tensione_ev import TEMP_MAX_ESERCIZIO
+from catalogo_ev import dati_cavo, posa_interrata, tabella
+from cortocircuito_ev import alfa_cavo
+
+# Capacità termica volumica del conduttore [J/(m³·K)]
+CAPACITA_TERMICA = MappingProxyType({"rame": 3.45e6, "alluminio": 2.50e6})
+# Capacità cavo / capacità conduttore (isolante, riempitivi, guaina): valore prudente
+FATTORE_CAPACITA_CAVO = 1.6
+
+# Pose interrate: quota della sovratemperatura a regime dovuta al terreno e sua costante di tempo
+PARAMETRI_TERRENO = MappingProxyType({"quota": 0.6, "tau_h": 8.0})
+
+# Temperatura di riferimento delle portate a catalogo (aria 30 °C, terreno 20 °C)
+TEMP_RIF_ARIA = 30.0
+TEMP_RIF_TERRENO = 20.0
+
+
+def costanti_tempo(tipo_cavo: str, tipo_posa: str, sezioni) -> dict:
+    """
+    Parametri del modello termico per le sezioni indicate (array).
+
+    Restituisce tau_cavo_s (forma di sezioni), quota_ambiente e tau_ambiente_s (scalari).
+    """
+    t = tabella(tipo_cavo, tipo_posa)
+    tab_s = np.asarray(t["sezioni"], dtype=float)
+    sez = np.asarray(sezioni, dtype=float)
+    idx = np.clip(np.searchsorted(tab_s, sez), 0, len(tab_s) - 1)
+    if np.any(tab_s[idx] != sez):
+        raise ValueError("Portata ciclica: sezione non presente nel catalogo cavi.")
+    iz = np.asarray(t["iz"], dtype=float)[idx]
+    interrata = posa_interrata(tipo_posa)
+    t_rif = TEMP_RIF_TERRENO if interrata else TEMP_RIF_ARIA
+    quota_amb = PARAMETRI_TERRENO["quota"] if interrata else 0.0
+
+    # W/m per conduttore a I = Iz, resistenza a θ_max
+    r_max = np.asarray(t["r20_ohm_km"], dtype=float)[idx] / 1000.0 * (1.0 + alfa_cavo(tipo_cavo) * (TEMP_MAX_ESERCIZIO - 20.0))
+    w = iz ** 2 * r_max
+    c_cavo = FATTORE_CAPACITA_CAVO * CAPACITA_TERMICA[dati_cavo(tipo_cavo)["materiale"]] * sez * 1e-6  # J/(m·K) per conduttore
+    r_th = (1.0 - quota_amb) * (TEMP_MAX_ESERCIZIO - t_rif) / w                                  # K·m/W per conduttore
+    return {
+        "tau_cavo_s": c_cavo * r_th,
+        "quota_ambiente": quota_amb,
+        "tau_ambiente_s": PARAMETRI_TERRENO["tau_h"] * 3600.0 if interrata else 0.0,
+    }
+
+
+def risposta_periodica(u, passo_s: float, tau_s, quote) -> np.ndarray:
+    """
+    Sovratemperatura a regime periodico, in frazione di ΔT_ss.
+
+    u: (..., n_passi) rapporto (I/Iz)² costante in ciascun passo (un periodo);
+    tau_s, quote: (..., n_nodi) costanti di tempo [s] e quote di ΔT_ss dei nodi
+    (τ = 0: nodo istantaneo). Restituisce h (..., n_passi) a fine di ogni passo.
+    """
+    u = np.asarray(u, dtype=float)
+    tau = np.asarray(tau_s, dtype=float)
+    q = np.asarray(quote, dtype=float)
+    lotto = np.broadcast_shapes(u.shape[:-1], tau.shape[:-1], q.shape[:-1])
+    n_passi = u.shape[-1]
+    u = np.broadcast_to(u, lotto + (n_passi,))
+    d = np.exp(-float(passo_s) / np.where(tau > 0, tau, 1.0)) * (tau > 0)
+    d = np.broadcast_to(d, lotto + d.shape[-1:])
+    guad = np.broadcast_to(q * (1.0 - d), d.shape)
+
+    # risposta da stato iniziale nullo
+    x = np.zeros(d.shape)
+    h = np.empty(lotto + (n_passi,))
+    for t in range(n_passi):
+        x = x * d + guad * u[..., t, None]
+        h[..., t] = x.sum(axis=-1)
+
+    # regime periodico: x0 = x(P) / (1 − d^N), contributo x0 · d^(t+1) a fine passo t
+    x0 = x / (1.0 - d ** n_passi)
+    pot = d[..., None, :] ** np.arange(1, n_passi + 1)[:, None]
+    return h + (x0[..., None, :] * pot).sum(axis=-1)
+
+
+def fattore_ciclico(forma, passo_min: float, tau_cavo_s, quota_ambiente=0.0, tau_ambiente_s=0.0) -> np.ndarray:
+    """
+    Fattore di portata ciclica M ≥ 1 per profili di corrente forma (..., n_passi).
+
+    forma è normalizzata al proprio picco; tau_cavo_s (e gli altri parametri)
+    sono scalari o array con forma di lotto compatibile (es. una per linea).
+    """
+    forma = np.asarray(forma, dtype=float)
+    if forma.shape[-1] < 1 or np.any(forma < 0):
+        raise ValueError("Profilo di carico: valori ≥ 0 su almeno un passo.")
+    picco = forma.max(axis=-1, keepdims=True)
+    if np.any(picco <= 0):
+        raise ValueError("Profilo di carico nullo.")
+    if passo_min <= 0:
+        raise ValueError("Passo del profilo di carico deve essere > 0.")
+    u = (forma / picco) ** 2
+    tau_c = np.asarray(tau_cavo_s, dtype=float)
+    tau_a = np.broadcast_to(np.asarray(tau_ambiente_s, dtype=float), tau_c.shape)
+    q_a = np.broadcast_to(np.asarray(quota_ambiente, dtype=float), tau_c.shape)
+    tau = np.stack([tau_c, tau_a], axis=-1)
+    quote = np.stack([1.0 - q_a, q_a], axis=-1)
+    h = risposta_periodica(u, 60.0 * float(passo_min), tau, quote)
+    return 1.0 / np.sqrt(h.max(axis=-1))
+
+
+def analisi_termica(
+    correnti_a,
+    iz_a,
+    tipo_cavo: str,
+    tipo_posa: str,
+    sezioni,
+    passo_min: float = 60.0,
+    temp_rif_c=None,
+    temp_max_c: float = TEMP_MAX_ESERCIZIO,
+) -> dict:
+    """
+    Temperatura di picco e fattore di portata ciclica per più linee/profili.
+
+    correnti_a: (..., n_passi) corrente per conduttore di linea [A] su un periodo;
+    iz_a, sezioni: portata continua corretta (con k) e sezione, forma di lotto (...);
+    temp_rif_c: temperatura ambiente/terreno (None = riferimento del catalogo).
+    Con più conduttori in parallelo sezioni è la sezione del singolo cavo
+    (le costanti di tempo non dipendono dal numero di cavi).
+    """
+    correnti = np.asarray(correnti_a, dtype=float)
+    iz = np.asarray(iz_a, dtype=float)
+    if np.any(iz <= 0):
+        raise ValueError("Portata ciclica: Iz deve essere > 0.")
+    par = costanti_tempo(tipo_cavo, tipo_posa, sezioni)
+    M = fattore_ciclico(correnti, passo_min, par["tau_cavo_s"], par["quota_ambiente"], par["tau_ambiente_s"])
+    if temp_rif_c is None:
+        temp_rif_c = TEMP_RIF_TERRENO if posa_interrata(tipo_posa) else TEMP_RIF_ARIA
+    t_rif = np.asarray(temp_rif_c, dtype=float)
+    picco = correnti.max(axis=-1)
+    theta = t_rif + (temp_max_c - t_rif) * (picco / (M * iz)) ** 2
+    return {
+        "fattore_ciclico": M,
+        "iz_ciclica_a": M * iz,
+        "temp_picco_c": theta,
+        "tau_cavo_s": par["tau_cavo_s"],
+    }
+
+
+def profilo_da_serie(serie_kw, periodo: str = "giorno", passo_min: int = 15) -> np.ndarray:
+    """
+    Profilo periodico peggiore (massima energia) da una serie a passo 1 minuto
+    (es. simula_anno(..., restituisci_serie=True)["serie_kw"]), mediato su passo_min.
+    """
+    minuti = {"giorno": 1440, "settimana": 7 * 1440}.get(periodo)
+    if minuti is None:
+        raise ValueError("Periodo profilo: 'giorno' o 'settimana'.")
+    if minuti % int(passo_min):
+        raise ValueError("passo_min deve dividere la durata del periodo.")
+    serie = np.asarray(serie_kw, dtype=float)
+    n = serie.size // minuti
+    if n < 1:
+        raise ValueError("Serie troppo corta per il periodo richiesto.")
+    periodi = serie[: n * minuti].reshape(n, minuti)
+    peggiore = periodi[np.argmax(periodi.sum(axis=1))]
+    return peggiore.reshape(-1, int(passo_min)).mean(axis=1)
+
+
+def testo_portata_ciclica(fattore: float, temp_picco_c: float, passo_min: float, n_passi: int) -> str:
+    """Riga di sintesi per la relazione."""
+    durata_h = passo_min * n_passi / 60.0
+    return (
+        f"- Portata ciclica (profilo {durata_h:g} h, passo {passo_min:g} min): kC = {fattore:.2f}, "
+        f"θ conduttore di picco ≈ {temp_picco_c:.0f} °C (≤ {TEMP_MAX_ESERCIZIO:.0f} °C)"
+    )
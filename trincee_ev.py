@@ -0,0 +1,431 @@
+"""
+Pianificazione scavi (trincee) e confronto delle architetture multi-colonnina.
+
+Dati quadro principale ed EVSE (coordinate in metri), si costruisce un albero
+di Steiner rettilineo approssimato:
+1) albero sui punti in metrica di Manhattan: MST su un grafo dei k vicini
+   ottenuto con una griglia a bucket, poi Kruskal con union-find
+   (O(n·k·log n)), oppure, con alfa > 0, albero di Prim-Dijkstra radicato nel
+   quadro, che accorcia i percorsi dalla radice a scapito dello scavo;
+2) ogni arco dell'albero è posato a "L" scegliendo l'orientamento che si
+   sovrappone di più agli scavi già posati (i tratti comuni diventano scavo
+   condiviso, gli spigoli punti di Steiner);
+3) la lunghezza di scavo è l'unione dei segmenti orizzontali/verticali;
+4) la lunghezza di cavo di ogni linea è il cammino minimo dalla radice lungo
+   la rete di scavo effettivamente posata (segmenti fusi, incroci come nodi).
+
+Architetture confrontate (quelle di genera_progetto_ev_multi):
+- "Dorsale unica + sottoquadro in prossimità": scavo condiviso, sottoquadro in
+  posizione ottimizzata, dorsale + linee brevi;
+- "Sottoquadro con linee uniche": sottoquadro al quadro principale, scavo
+  condiviso, linee lunghe dedicate;
+- "Linee separate dal contatore": percorsi indipendenti (nessuno scavo condiviso).
+
+I cavi seguono lo scavo: scavo e lunghezze di cavo vengono dalla stessa rete.
+pianifica_trincee sceglie per ogni architettura l'alfa di costo minimo.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from calcolo_ev import ARCHITETTURE
+
+
+def _manhattan(a, b) -> float:
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+# ---------------------------
+# MST rettilineo (k vicini + Kruskal)
+# ---------------------------
+def _trova(padre, i):
+    while padre[i] != i:
+        padre[i] = padre[padre[i]]
+        i = padre[i]
+    return i
+
+
+def _archi_vicini(pts: np.ndarray, k: int) -> list[tuple[float, int, int]]:
+    """Archi verso (circa) i k vicini più prossimi, cercati con griglia a bucket."""
+    n = len(pts)
+    lo = pts.min(axis=0)
+    estensione = max(float((pts.max(axis=0) - lo).max()), 1e-9)
+    lato = max(estensione / max(1.0, math.sqrt(n / 2.0)), 1e-9)
+    celle = np.floor((pts - lo) / lato).astype(int)
+    bucket = defaultdict(list)
+    for i, (cx, cy) in enumerate(celle.tolist()):
+        bucket[(cx, cy)].append(i)
+
+    archi = []
+    for i in range(n):
+        cx, cy = celle[i]
+        anello = 0
+        candidati = []
+        # allarga l'anello finché ci sono almeno k candidati (più un anello di sicurezza)
+        while True:
+            for dx in range(-anello, anello + 1):
+                for dy in range(-anello, anello + 1):
+                    if max(abs(dx), abs(dy)) != anello:
+                        continue
+                    candidati.extend(bucket.get((cx + dx, cy + dy), ()))
+            if len(candidati) > k or anello * lato > estensione:
+                break
+            anello += 1
+        candidati = [j for j in candidati if j != i]
+        if not candidati:
+            continue
+        c = np.asarray(candidati)
+        d = np.abs(pts[c] - pts[i]).sum(axis=1)
+        for j in c[np.argsort(d)[:k]].tolist():
+            archi.append((float(abs(pts[i] - pts[j]).sum()), min(i, j), max(i, j)))
+    return archi
+
+
+def mst_rettilineo(punti, k: int = 8) -> list[tuple[int, int]]:
+    """MST in metrica di Manhattan (approssimato sul grafo dei k vicini, poi reso connesso)."""
+    pts = np.asarray(punti, dtype=float)
+    n = len(pts)
+    if n < 2:
+        return []
+    padre = list(range(n))
+    mst = []
+    for _, i, j in sorted(set(_archi_vicini(pts, k))):
+        ri, rj = _trova(padre, i), _trova(padre, j)
+        if ri != rj:
+            padre[ri] = rj
+            mst.append((i, j))
+    # componenti residue (gruppi molto distanti): Prim sui componenti
+    while len(mst) < n - 1:
+        radici = np.array([_trova(padre, i) for i in range(n)])
+        comp0 = radici == radici[0]
+        a = np.flatnonzero(comp0)
+        b = np.flatnonzero(~comp0)
+        d = np.abs(pts[a][:, None, :] - pts[b][None, :, :]).sum(axis=2)
+        ia, ib = np.unravel_index(int(np.argmin(d)), d.shape)
+        i, j = int(a[ia]), int(b[ib])
+        padre[_trova(padre, i)] = _trova(padre, j)
+        mst.append((i, j))
+    return mst
+
+
+def albero_prim_dijkstra(punti, radice: int = 0, alfa: float = 0.5) -> list[tuple[int, int]]:
+    """
+    Albero di Prim-Dijkstra in metrica di Manhattan: a ogni passo collega il punto v
+    che minimizza alfa·d_albero(radice, u) + |u - v|. alfa = 0 è l'MST (scavo minimo),
+    alfa = 1 l'albero dei cammini minimi (ogni punto a distanza di Manhattan dalla radice).
+    O(n²) con passi vettoriali.
+    """
+    pts = np.asarray(punti, dtype=float)
+    n = len(pts)
+    dentro = np.zeros(n, dtype=bool)
+    dentro[radice] = True
+    d_radice = np.zeros(n)
+    chiave = np.abs(pts - pts[radice]).sum(axis=1)
+    padre = np.full(n, radice)
+    archi = []
+    for _ in range(n - 1):
+        v = int(np.argmin(np.where(dentro, np.inf, chiave)))
+        u = int(padre[v])
+        dentro[v] = True
+        d_radice[v] = d_radice[u] + float(np.abs(pts[u] - pts[v]).sum())
+        archi.append((u, v))
+        nuova = alfa * d_radice[v] + np.abs(pts - pts[v]).sum(axis=1)
+        migliora = nuova < chiave
+        chiave = np.where(migliora, nuova, chiave)
+        padre = np.where(migliora, v, padre)
+    return archi
+
+
+# ---------------------------
+# Posa a "L" con massima sovrapposizione
+# ---------------------------
+def _sovrapposizione(linee: dict, chiave: float, a: float, b: float) -> float:
+    lo, hi = min(a, b), max(a, b)
+    tot = 0.0
+    for s0, s1 in linee.get(chiave, ()):
+        tot += max(0.0, min(hi, s1) - max(lo, s0))
+    return tot
+
+
+def _unione(linee: dict) -> tuple[float, list]:
+    """Lunghezza dell'unione degli intervalli per ciascuna retta e segmenti fusi."""
+    tot = 0.0
+    fusi = []
+    for chiave, intervalli in linee.items():
+        cur = None
+        for s0, s1 in sorted(intervalli):
+            if cur is None:
+                cur = [s0, s1]
+            elif s0 <= cur[1]:
+                cur[1] = max(cur[1], s1)
+            else:
+                fusi.append((chiave, cur[0], cur[1]))
+                tot += cur[1] - cur[0]
+                cur = [s0, s1]
+        if cur is not None:
+            fusi.append((chiave, cur[0], cur[1]))
+            tot += cur[1] - cur[0]
+    return tot, fusi
+
+
+def _distanze_rete(seg_o: list, seg_v: list, punti: list, radice: int) -> list[float]:
+    """
+    Cammino minimo [m] dalla radice a ciascun punto lungo la rete di scavo: nodi agli
+    estremi dei segmenti fusi, agli incroci orizzontale/verticale e nei punti stessi.
+    """
+    def _r(v):
+        return round(v, 3)
+
+    oriz = [(_r(y), _r(x0), _r(x1)) for y, x0, x1 in seg_o]
+    vert = [(_r(x), _r(y0), _r(y1)) for x, y0, y1 in seg_v]
+    pos_o = [{x0, x1} for _, x0, x1 in oriz]
+    pos_v = [{y0, y1} for _, y0, y1 in vert]
+    if oriz and vert:
+        h = np.array(oriz)
+        v = np.array(vert)
+        for inizio in range(0, len(h), 512):  # incroci a blocchi (matrice booleana limitata)
+            b = h[inizio:inizio + 512]
+            incrocio = ((b[:, None, 1] <= v[None, :, 0]) & (v[None, :, 0] <= b[:, None, 2])
+                        & (v[None, :, 1] <= b[:, None, 0]) & (b[:, None, 0] <= v[None, :, 2]))
+            for i, j in zip(*np.nonzero(incrocio)):
+                pos_o[inizio + i].add(vert[j][0])
+                pos_v[j].add(oriz[inizio + i][0])
+    per_y, per_x = defaultdict(list), defaultdict(list)
+    for i, (y, _, _) in enumerate(oriz):
+        per_y[y].append(i)
+    for j, (x, _, _) in enumerate(vert):
+        per_x[x].append(j)
+    nodi = [(_r(x), _r(y)) for x, y in punti]
+    for x, y in nodi:
+        for i in per_y.get(y, ()):
+            if oriz[i][1] <= x <= oriz[i][2]:
+                pos_o[i].add(x)
+        for j in per_x.get(x, ()):
+            if vert[j][1] <= y <= vert[j][2]:
+                pos_v[j].add(y)
+
+    adiacenza = defaultdict(list)
+    for (y, _, _), pos in zip(oriz, pos_o):
+        p = sorted(pos)
+        for a, b in zip(p, p[1:]):
+            adiacenza[(a, y)].append(((b, y), b - a))
+            adiacenza[(b, y)].append(((a, y), b - a))
+    for (x, _, _), pos in zip(vert, pos_v):
+        p = sorted(pos)
+        for a, b in zip(p, p[1:]):
+            adiacenza[(x, a)].append(((x, b), b - a))
+            adiacenza[(x, b)].append(((x, a), b - a))
+
+    dist = {nodi[radice]: 0.0}
+    heap = [(0.0, nodi[radice])]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for w, l in adiacenza[u]:
+            if d + l < dist.get(w, math.inf):
+                dist[w] = d + l
+                heapq.heappush(heap, (d + l, w))
+    return [dist.get(p, math.inf) for p in nodi]
+
+
+def albero_steiner(punti, radice: int = 0, k: int = 8, alfa: float = 0.0) -> dict:
+    """
+    Albero di Steiner rettilineo approssimato sui punti (x, y) [m].
+
+    alfa = 0: MST (k vicini); alfa > 0: albero di Prim-Dijkstra radicato in radice.
+    Restituisce lunghezza di scavo (unione segmenti), segmenti orizzontali e
+    verticali fusi, e distanza dalla radice a ciascun punto lungo la rete di scavo
+    (cammino minimo: è la lunghezza del cavo che segue lo scavo).
+    """
+    pts = [(float(x), float(y)) for x, y in punti]
+    n = len(pts)
+    mst = albero_prim_dijkstra(pts, radice, alfa) if alfa > 0 and n > 1 else mst_rettilineo(pts, k)
+
+    adiacenza = defaultdict(list)
+    for i, j in mst:
+        adiacenza[i].append(j)
+        adiacenza[j].append(i)
+
+    # visita dalla radice: posa gli archi in ordine di visita (BFS)
+    oriz = defaultdict(list)  # y -> [(x0, x1)]
+    vert = defaultdict(list)  # x -> [(y0, y1)]
+    visitato = [False] * n
+    visitato[radice] = True
+    coda = [radice]
+    for u in coda:
+        for v in adiacenza[u]:
+            if visitato[v]:
+                continue
+            (x1, y1), (x2, y2) = pts[u], pts[v]
+            ky1, ky2, kx1, kx2 = round(y1, 3), round(y2, 3), round(x1, 3), round(x2, 3)
+            # A: orizzontale a y1 poi verticale a x2 | B: verticale a x1 poi orizzontale a y2
+            ov_a = _sovrapposizione(oriz, ky1, x1, x2) + _sovrapposizione(vert, kx2, y1, y2)
+            ov_b = _sovrapposizione(vert, kx1, y1, y2) + _sovrapposizione(oriz, ky2, x1, x2)
+            if ov_a >= ov_b:
+                if x1 != x2:
+                    oriz[ky1].append((min(x1, x2), max(x1, x2)))
+                if y1 != y2:
+                    vert[kx2].append((min(y1, y2), max(y1, y2)))
+            else:
+                if y1 != y2:
+                    vert[kx1].append((min(y1, y2), max(y1, y2)))
+                if x1 != x2:
+                    oriz[ky2].append((min(x1, x2), max(x1, x2)))
+            visitato[v] = True
+            coda.append(v)
+
+    l_o, seg_o = _unione(oriz)
+    l_v, seg_v = _unione(vert)
+    return {
+        "lunghezza_scavo_m": l_o + l_v,
+        "segmenti_orizzontali": seg_o,
+        "segmenti_verticali": seg_v,
+        "distanza_albero_m": _distanze_rete(seg_o, seg_v, pts, radice) if n > 1 else [0.0] * n,
+        "lunghezza_mst_m": sum(_manhattan(pts[i], pts[j]) for i, j in mst),
+    }
+
+
+# ---------------------------
+# Confronto architetture
+# ---------------------------
+def _mediana_pesata(valori, pesi) -> float:
+    ordine = np.argsort(valori)
+    v = np.asarray(valori, dtype=float)[ordine]
+    w = np.asarray(pesi, dtype=float)[ordine]
+    c = np.cumsum(w)
+    return float(v[np.searchsorted(c, c[-1] / 2.0)])
+
+
+def pianifica_trincee(
+    quadro: tuple[float, float],
+    evse,
+    costo_scavo_m: float = 60.0,
+    costo_cavo_linea_m: float = 8.0,
+    costo_cavo_dorsale_m: float = 25.0,
+    sottoquadro: tuple[float, float] | None = None,
+    k: int = 8,
+    alfa: tuple[float, ...] = (0.0, 0.25, 0.5, 1.0),
+) -> dict:
+    """
+    Confronta le tre architetture per scavo, cavo e costo complessivo.
+
+    quadro, evse: coordinate (x, y) in metri.
+    costo_*: costi unitari [€/m] per scavo, cavo linea, cavo dorsale.
+    sottoquadro: posizione imposta per l'architettura con dorsale; se None viene
+      scelta tra candidate (mediane pesate quadro/EVSE) minimizzando il costo.
+    alfa: parametri di Prim-Dijkstra provati per ogni albero (0 = MST); si tiene il
+      costo minimo (più scavo contro cavi più corti).
+
+    Per ogni architettura scavo e cavi vengono dalla stessa rete di scavo: le linee
+    sono i cammini minimi dal sottoquadro alle EVSE, la dorsale il cammino minimo
+    quadro-sottoquadro. Restituisce per ogni architettura scavo_m, cavo_linee_m,
+    cavo_dorsale_m, costo, alfa, distanze per genera_progetto_ev_multi, e
+    l'architettura consigliata.
+    """
+    ev = [(float(x), float(y)) for x, y in evse]
+    if not ev:
+        raise ValueError("Nessuna EVSE da collegare.")
+    q = (float(quadro[0]), float(quadro[1]))
+    n = len(ev)
+
+    def _costo(scavo, cavo_linee, cavo_dorsale):
+        return scavo * costo_scavo_m + cavo_linee * costo_cavo_linea_m + cavo_dorsale * costo_cavo_dorsale_m
+
+    def _migliore(sottoquadro_ev, con_quadro):
+        """Rete di costo minimo (tra i valori di alfa) radicata nel sottoquadro; con_quadro: anche la dorsale."""
+        punti = [sottoquadro_ev] + ([q] if con_quadro else []) + ev
+        migliore = None
+        for a in alfa:
+            albero = albero_steiner(punti, radice=0, k=k, alfa=a)
+            dist = albero["distanza_albero_m"]
+            dist_l = dist[2:] if con_quadro else dist[1:]
+            dorsale = dist[1] if con_quadro else 0.0
+            voce = {
+                "sottoquadro": sottoquadro_ev,
+                "scavo_m": round(albero["lunghezza_scavo_m"], 1),
+                "cavo_linee_m": round(sum(dist_l), 1),
+                "cavo_dorsale_m": round(dorsale, 1),
+                "distanza_dorsale_m": round(dorsale, 1) if con_quadro else None,
+                "distanze_linee_m": [round(d, 1) for d in dist_l],
+                "alfa": a,
+            }
+            voce["costo"] = round(_costo(voce["scavo_m"], voce["cavo_linee_m"], voce["cavo_dorsale_m"]), 0)
+            if migliore is None or voce["costo"] < migliore["costo"]:
+                migliore = voce
+        return migliore
+
+    risultati = {}
+
+    # --- Dorsale unica + sottoquadro in prossimità (un'unica rete: dorsale Q-S e linee da S)
+    if sottoquadro is not None:
+        candidati = [(float(sottoquadro[0]), float(sottoquadro[1]))]
+    else:
+        xs = [q[0]] + [p[0] for p in ev]
+        ys = [q[1]] + [p[1] for p in ev]
+        candidati = []
+        # peso del quadro = rapporto costo dorsale/linea × numero di linee "attratte"
+        for w_q in (0.0, 1.0, costo_cavo_dorsale_m / max(costo_cavo_linea_m, 1e-9), n / 2.0):
+            pesi = [w_q] + [1.0] * n
+            c = (_mediana_pesata(xs, pesi), _mediana_pesata(ys, pesi))
+            if c not in candidati:
+                candidati.append(c)
+    risultati[ARCHITETTURE[0]] = min((_migliore(s, s != q) for s in candidati), key=lambda v: v["costo"])
+
+    # --- Sottoquadro con linee uniche (sottoquadro al quadro principale)
+    risultati[ARCHITETTURE[1]] = _migliore(q, False)
+
+    # --- Linee separate dal contatore (percorsi indipendenti)
+    dirette = [_manhattan(q, p) for p in ev]
+    voce = {
+        "sottoquadro": None,
+        "scavo_m": round(sum(dirette), 1),
+        "cavo_linee_m": round(sum(dirette), 1),
+        "cavo_dorsale_m": 0.0,
+        "distanza_dorsale_m": None,
+        "distanze_linee_m": [round(d, 1) for d in dirette],
+        "alfa": None,
+    }
+    voce["costo"] = round(_costo(voce["scavo_m"], voce["cavo_linee_m"], 0.0), 0)
+    risultati[ARCHITETTURE[2]] = voce
+
+    consigliata = min(risultati, key=lambda a: risultati[a]["costo"])
+    return {"architetture": risultati, "consigliata": consigliata, "n_evse": n}
+
+
+def testo_trincee(piano: dict) -> str:
+    """Tabella testuale di confronto architetture (per relazione/planimetria)."""
+    righe = ["CONFRONTO ARCHITETTURE (albero di Steiner rettilineo approssimato)"]
+    for arch, v in piano["architetture"].items():
+        extra = ""
+        if v.get("distanza_dorsale_m"):
+            extra = f", dorsale {v['distanza_dorsale_m']:.1f} m, sottoquadro in ({v['sottoquadro'][0]:.1f}; {v['sottoquadro'][1]:.1f})"
+        righe.append(
+            f"- {arch}: scavo {v['scavo_m']:.1f} m, cavo linee {v['cavo_linee_m']:.1f} m{extra}, costo stimato {v['costo']:.0f} €"
+        )
+    righe.append(f"- Architettura consigliata (costo minimo): {piano['consigliata']}")
+    return "\n".join(righe)
+
+
+def parametri_multi(piano: dict, architettura: str | None = None) -> dict:
+    """
+    Parametri di distanza per genera_progetto_ev_multi relativi a un'architettura
+    del piano (default: quella consigliata).
+    """
+    arch = architettura or piano["consigliata"]
+    if arch not in piano["architetture"]:
+        raise ValueError(f"Architettura non presente nel piano: {arch}")
+    v = piano["architetture"][arch]
+    dist = [max(d, 1.0) for d in v["distanze_linee_m"]]
+    return {
+        "architettura": arch,
+        "n_colonnine": len(dist),
+        "distanza_dorsale_m": max(v["distanza_dorsale_m"] or 1.0, 1.0),
+        "distanza_linea_m": max(dist),
+        "distanze_linee_m": dist,
+        "planimetria_percorsi": testo_trincee(piano),
+    }